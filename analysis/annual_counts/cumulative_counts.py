@@ -0,0 +1,332 @@
+##########################################################################
+
+# This is a script to calculate the same cumulative annual migrant counts as
+# generate_annual_migrant_counts.py, but from a single per-patient extract
+# (dataset_definition_annual_counts_inputs.py) instead of re-evaluating every
+# measure in every interval.
+#
+# Each patient's time in the denominator (alive, registered, not over 100) is
+# turned into non-overlapping date ranges, split by subgroup (age band, IMD
+# quintile and region can change over time). Because the numerators are
+# cumulative, a patient enters a numerator from the first interval whose end
+# is on or after their first code and stays in it. The counts for every
+# interval then come from one sorted sweep over the range start and end dates,
+# so adding intervals (or making them monthly) costs a binary search each.
+#
+# --workers splits each subgroup's patients into that many chunks and spreads
+# the subgroup x chunk tasks over as many processes; the chunks' counts add up
+# to the subgroup's. That only speeds up this script: the ehrQL measures
+# action (generate_annual_migrant_counts.py) is evaluated by ehrQL itself and
+# doesn't benefit.
+#
+# Usage (from the repo root; project.yaml runs it as generate_annual_migrant_counts_cumulative):
+#   python analysis/annual_counts/cumulative_counts.py \
+#       --input-dir output/annual_counts_inputs --output output/tables/annual_migrant_counts_cumulative.csv \
+#       [--features output/patient_features/patient_features.arrow] [--workers 16]
+
+#############################################################################
+
+import json
+import sys
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.create_cohorts.patient_features import PATIENT_FEATURES, join_features, read_features
+from analysis.lib import point_in_time
+from analysis.lib.spells import (
+    NEVER,
+    age_band_segments,
+    anniversaries,
+    count_active,
+    from_days,
+    intersect,
+    to_days,
+)
+
+NUMERATORS = ["any_migrant", "cob_migrant", "asylum_refugee_migrant", "interpreter_migrant"]
+
+# subgroup suffix -> group_by column, in the order generate_annual_migrant_counts.py defines them
+SUBGROUPS = {
+    "": None,
+    "age": "age_band",
+    "sex": "sex",
+    "ethnicity": "ethnicity",
+    "imd": "imd_quintile",
+    "region": "region",
+}
+GROUP_COLUMNS = [column for column in SUBGROUPS.values() if column is not None]
+
+AGE_BANDS = [
+    (0, "0-15"),
+    (16, "16-24"),
+    (25, "25-34"),
+    (35, "35-49"),
+    (50, "50-64"),
+    (65, "65-74"),
+    (75, "75-84"),
+    (85, "85 plus"),
+]
+
+MEASURE_COLUMNS = ["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"]
+
+
+def yearly_intervals(study_dates_file="analysis/lib/study-dates.json"):
+    """Return (start, end) days of each calendar year of the study, as
+    years(16).starting_on("2009-01-01") gives them."""
+    with open(study_dates_file) as f:
+        study_dates = json.load(f)
+    first_year = int(study_dates["study_start_date"][:4])
+    last_year = int(study_dates["study_end_date"][:4])
+    years = np.arange(first_year, last_year + 1)
+    starts = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64)
+    ends = (years - 1969).astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64) - 1
+    return starts, ends
+
+
+def read_inputs(input_dir, features=PATIENT_FEATURES):
+    """The annual counts inputs, with each patient's latest ethnicity group
+    ("unknown" if none) from the patient feature table."""
+    input_dir = Path(input_dir)
+    patients = join_features(
+        feather.read_table(input_dir / "dataset.arrow"),
+        read_features(features, ["latest_ethnicity_group"]),
+        ["latest_ethnicity_group"],
+    ).to_pandas()
+    patients["ethnicity"] = patients.pop("latest_ethnicity_group").fillna("unknown")
+    return (
+        patients,
+        feather.read_table(input_dir / "registrations.arrow").to_pandas(),
+        feather.read_table(input_dir / "addresses.arrow").to_pandas(),
+    )
+
+
+def registration_segments(registrations):
+    """Date ranges in which each patient is registered, labelled with the
+    region of the registration practice_registrations.for_patient_on() picks."""
+    segments = point_in_time.registration_segments(registrations, ["region"])
+    segments["region"] = segments["region"].where(segments["region"].notna(), "unknown")
+    return segments
+
+
+def address_segments(addresses, patient_ids):
+    """Date ranges labelled with the IMD quintile of the address
+    addresses.for_patient_on() picks (missing where there is no address)."""
+    return point_in_time.address_segments(addresses, ["imd_quintile"], patient_ids)
+
+
+def denominator_segments(patients, registrations):
+    """Date ranges in which each patient meets the denominator: alive,
+    registered, with a recorded sex and not over 100."""
+    patients = patients[patients["sex"].isin(["male", "female"])]
+    dob, missing_dob = to_days(patients["date_of_birth"])
+    dod, _ = to_days(patients["date_of_death"], fill=NEVER)
+    patients = patients[~missing_dob]
+    dob = dob[~missing_dob]
+    dod = dod[~missing_dob]
+
+    alive_and_not_over_100 = pd.DataFrame({
+        "patient_id": patients["patient_id"].to_numpy(),
+        "start": dob,
+        "end": np.minimum(dod, anniversaries(dob, 101)),
+    })
+    return intersect(alive_and_not_over_100, registration_segments(registrations))
+
+
+def numerator_start(first_code_dates, interval_ends, interval_starts):
+    """The first interval start from which a patient counts in a cumulative
+    numerator: the start of the first interval ending on or after their
+    first code."""
+    first, missing = to_days(first_code_dates)
+    k = np.searchsorted(interval_ends, first, side="left")
+    return np.where(
+        missing | (k >= len(interval_starts)),
+        NEVER,
+        interval_starts[np.minimum(k, len(interval_starts) - 1)],
+    )
+
+
+def subgroup_segments(denominator, patients, addresses, column):
+    if column is None:
+        return denominator.assign(value="")
+    if column == "age_band":
+        dob, _ = to_days(patients["date_of_birth"])
+        bands = age_band_segments(patients["patient_id"].to_numpy(), dob, AGE_BANDS)
+        return intersect(denominator, bands)
+    if column == "imd_quintile":
+        imd = address_segments(addresses, patients["patient_id"].to_numpy())
+        return intersect(denominator, imd.rename(columns={"imd_quintile": "value"}))
+    if column == "region":
+        return denominator.assign(value=denominator["region"])
+    values = patients.set_index("patient_id")[column]
+    return denominator.assign(value=denominator["patient_id"].map(values).to_numpy())
+
+
+def _count_by_value(segments, interval_starts):
+    counts = {}
+    for value, group in segments.groupby("value", dropna=False, sort=False):
+        counts[None if pd.isna(value) else value] = count_active(
+            group["start"].to_numpy(), group["end"].to_numpy(), interval_starts
+        )
+    return counts
+
+
+def _sort_key(value):
+    return (value is None, "" if value is None else str(value))
+
+
+# State shared with the worker processes. It is filled in before the pool is
+# forked, so every worker reads the same inputs and denominator ranges
+# (copy-on-write) instead of recomputing or unpickling them.
+_shared = {}
+
+
+def _chunk_bounds(patient_id, chunk_ids):
+    # rows [start, end) of each chunk's patients in a frame sorted by patient_id
+    starts = np.searchsorted(patient_id, [ids[0] for ids in chunk_ids], side="left")
+    ends = np.searchsorted(patient_id, [ids[-1] for ids in chunk_ids], side="right")
+    return list(zip(starts, ends))
+
+
+def _by_patient(frame):
+    return frame.sort_values("patient_id", kind="stable").reset_index(drop=True)
+
+
+def _chunk_counts(task):
+    """Count one subgroup over one chunk of patients: {value: counts per
+    interval} for the denominator and for each numerator. The counts of the
+    chunks of a subgroup add up to the subgroup's counts."""
+    suffix, chunk = task
+    interval_starts = _shared["interval_starts"]
+    denominator, patients, addresses = (
+        _shared[name].iloc[slice(*_shared["bounds"][name][chunk])]
+        for name in ["denominator", "patients", "addresses"]
+    )
+    segments = subgroup_segments(denominator, patients, addresses, SUBGROUPS[suffix])
+
+    numerators = {}
+    for name in NUMERATORS:
+        entered = segments["patient_id"].map(_shared["entry_dates"][name]).to_numpy()
+        numerator_segments = segments.assign(start=np.maximum(segments["start"], entered))
+        numerator_segments = numerator_segments[numerator_segments["start"] < numerator_segments["end"]]
+        numerators[name] = _count_by_value(numerator_segments, interval_starts)
+    return _count_by_value(segments, interval_starts), numerators
+
+
+def _add_counts(total, counts):
+    for value, values in counts.items():
+        total[value] = total[value] + values if value in total else values
+    return total
+
+
+def _measure_rows(name, suffix, numerators, denominators, interval_starts, interval_ends):
+    column = SUBGROUPS[suffix]
+    measure = name if suffix == "" else f"{name}_{suffix}"
+    rows = []
+    for i, (start, end) in enumerate(zip(from_days(interval_starts), from_days(interval_ends))):
+        for value in sorted(denominators, key=_sort_key):
+            d = int(denominators[value][i])
+            if d == 0:
+                continue
+            n = int(numerators[value][i]) if value in numerators else 0
+            row = {
+                "measure": measure,
+                "interval_start": str(start),
+                "interval_end": str(end),
+                "ratio": n / d,
+                "numerator": n,
+                "denominator": d,
+            }
+            if column is not None:
+                row[column] = value
+            rows.append(row)
+    return rows
+
+
+def calculate_counts(patients, registrations, addresses, interval_starts, interval_ends, workers=1):
+    """Calculate every numerator x subgroup measure. The work is split into
+    one task per subgroup per chunk of patients (`workers` chunks), run across
+    `workers` processes; each task builds its share of the subgroup's ranges,
+    the costly part for age band and IMD quintile, and counts them. The
+    parts are added up per subgroup, and rows come back in the order the
+    measures are defined in generate_annual_migrant_counts.py, however many
+    workers are used."""
+    patients = _by_patient(patients)
+    addresses = _by_patient(addresses)
+    denominator = _by_patient(denominator_segments(patients, registrations))
+    chunk_ids = [ids for ids in np.array_split(patients["patient_id"].to_numpy(), workers) if len(ids)]
+    _shared.update(
+        interval_starts=interval_starts,
+        patients=patients,
+        addresses=addresses,
+        denominator=denominator,
+        bounds={
+            name: _chunk_bounds(frame["patient_id"].to_numpy(), chunk_ids)
+            for name, frame in [("patients", patients), ("addresses", addresses), ("denominator", denominator)]
+        },
+        entry_dates={
+            name: pd.Series(
+                numerator_start(patients[f"first_{name}_code_date"], interval_ends, interval_starts),
+                index=patients["patient_id"].to_numpy(),
+            )
+            for name in NUMERATORS
+        },
+    )
+
+    tasks = [(suffix, chunk) for suffix in SUBGROUPS for chunk in range(len(chunk_ids))]
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(workers, mp_context=get_context("fork")) as pool:
+                results = list(pool.map(_chunk_counts, tasks))
+        else:
+            results = [_chunk_counts(task) for task in tasks]
+    finally:
+        _shared.clear()
+
+    denominators = {suffix: {} for suffix in SUBGROUPS}
+    numerators = {suffix: {name: {} for name in NUMERATORS} for suffix in SUBGROUPS}
+    for (suffix, _), (chunk_denominators, chunk_numerators) in zip(tasks, results):
+        _add_counts(denominators[suffix], chunk_denominators)
+        for name in NUMERATORS:
+            _add_counts(numerators[suffix][name], chunk_numerators[name])
+
+    rows = [
+        row
+        for name in NUMERATORS
+        for suffix in SUBGROUPS
+        for row in _measure_rows(
+            name, suffix, numerators[suffix][name], denominators[suffix], interval_starts, interval_ends
+        )
+    ]
+    return pd.DataFrame(rows, columns=MEASURE_COLUMNS + GROUP_COLUMNS)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input-dir", default="output/annual_counts_inputs")
+    parser.add_argument("--output", default="output/tables/annual_migrant_counts_cumulative.csv")
+    parser.add_argument("--features", default=PATIENT_FEATURES)
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    interval_starts, interval_ends = yearly_intervals()
+    counts = calculate_counts(
+        *read_inputs(args.input_dir, args.features), interval_starts, interval_ends, workers=args.workers
+    )
+
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    counts.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
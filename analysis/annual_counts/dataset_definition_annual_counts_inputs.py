@@ -0,0 +1,75 @@
+##########################################################################
+
+# This is a script to extract, once, everything needed to calculate the
+# cumulative annual migrant counts (see cumulative_counts.py) without
+# re-evaluating the inclusion criteria and numerators in every interval:
+# - One row per patient with a non-disclosive sex who was registered at some
+#   point between the first and last interval start, with:
+#         - date of birth, date of death and sex
+#         - the date of their first code in each of the migration codelists
+# - An event table of their practice registrations
+# - An event table of their addresses
+# Their latest ethnicity comes from the patient feature table
+# (dataset_definition_patient_features.py), joined on by cumulative_counts.py.
+
+#############################################################################
+
+import json
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import addresses, patients, practice_registrations
+
+from analysis.create_cohorts.migration_events import MIGRANT, COB, ASYLUM_REFUGEE, INTERPRETER, date_of_first_code
+
+with open("analysis/lib/study-dates.json") as f:
+    study_dates = json.load(f)
+
+study_start_date = study_dates["study_start_date"]
+last_interval_start = study_dates["study_end_date"][:4] + "-01-01"
+
+# Population -------------------------------------------------------------
+
+has_recorded_sex = patients.sex.is_in(["male", "female"])
+
+was_registered_during_intervals = (
+    practice_registrations.where(practice_registrations.start_date <= last_interval_start)
+    .except_where(practice_registrations.end_date < study_start_date)
+    .exists_for_patient()
+)
+
+dataset = create_dataset()
+dataset.define_population(has_recorded_sex & was_registered_during_intervals)
+
+# Patient-level variables ------------------------------------------------
+
+dataset.date_of_birth = patients.date_of_birth
+dataset.date_of_death = patients.date_of_death
+dataset.sex = patients.sex
+
+# Date of first code for each numerator (names match generate_annual_migrant_counts.py)
+
+dataset.first_any_migrant_code_date = date_of_first_code(MIGRANT)
+dataset.first_cob_migrant_code_date = date_of_first_code(COB)
+dataset.first_asylum_refugee_migrant_code_date = date_of_first_code(ASYLUM_REFUGEE)
+dataset.first_interpreter_migrant_code_date = date_of_first_code(INTERPRETER)
+
+# Registrations and addresses, resolved to a point in time outside ehrQL ---
+
+dataset.add_event_table(
+    "registrations",
+    start_date=practice_registrations.start_date,
+    end_date=practice_registrations.end_date,
+    practice_pseudo_id=practice_registrations.practice_pseudo_id,
+    region=practice_registrations.practice_nuts1_region_name,
+)
+
+dataset.add_event_table(
+    "addresses",
+    start_date=addresses.start_date,
+    end_date=addresses.end_date,
+    address_id=addresses.address_id,
+    has_postcode=addresses.has_postcode,
+    imd_quintile=addresses.imd_quintile,
+)
+
+dataset.configure_dummy_data(population_size=1000)
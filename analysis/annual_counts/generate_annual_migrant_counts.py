@@ -13,6 +13,10 @@
 # - Ethnicity (using SNOMED:2022 codelist) 
 # - Practice region - to do 
 # - IMD quintile 
+#
+# The intervals are the calendar years from --start-date (default 2009-01-01),
+# --intervals of them (default 16); incremental_counts.py uses these to
+# compute only the years after the ones an existing output already holds.
 
 # Author: Yamina Boukari
 # Bennett Institute for Applied Data Science, University of Oxford, 2025
@@ -22,6 +26,15 @@
 from ehrql import create_dataset, codelist_from_csv, show, INTERVAL, case, create_measures, years, when
 from ehrql.tables.tpp import addresses, patients, practice_registrations, clinical_events
 from utilities import load_all_codelists 
+from analysis.create_cohorts.demographics import latest_ethnicity_group
+from argparse import ArgumentParser
+
+# Arguments (from project.yaml or incremental_counts.py)
+
+parser = ArgumentParser()
+parser.add_argument("--start-date", default="2009-01-01")
+parser.add_argument("--intervals", type=int, default=16)
+args = parser.parse_args()
 
 measures = create_measures()
 
@@ -98,15 +111,10 @@ numerators = {
 
 ## Define subgroup variables (if needed)
 
-## Ethnicity
+## Ethnicity (the patient feature table's latest_ethnicity_group: a measures
+## definition can't join that table on, so it is evaluated here too)
 
-ethnicity = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(ethnicity_codelist))
-    .sort_by(clinical_events.date)
-    .last_for_patient()
-    .snomedct_code.to_category(ethnicity_codelist)
-    .when_null_then("unknown")
-)
+ethnicity = latest_ethnicity_group.when_null_then("unknown")
 
 ## IMD
 
@@ -136,7 +144,7 @@ subgroups = {
 
 measures.define_defaults(
     denominator=was_alive_on_1Jan & was_registered_on1Jan & has_recorded_sex & not_over_100_years,
-    intervals=years(16).starting_on("2009-01-01")
+    intervals=years(args.intervals).starting_on(args.start_date)
 )
 
 for key, numerator in numerators.items():
@@ -0,0 +1,185 @@
+##########################################################################
+
+# This is a script to bring output/tables/annual_migrant_counts.csv up to date
+# without recomputing the years it already holds. The earlier intervals don't
+# change between extracts, so when a calendar year closes only the intervals
+# after the last one in the existing output are computed (by running
+# generate_annual_migrant_counts.py with --start-date and --intervals) and
+# their rows are added to the output.
+#
+# The output is only extended if it was made from the same definition,
+# local modules and codelists (see action_cache.definition_fingerprint) and
+# from the same first interval, as recorded in a .fingerprint.json file next
+# to it. Otherwise, or with --full, every interval is recomputed. This script
+# writes the fingerprint whenever it writes the output; for an output made
+# by the generate_annual_migrant_counts_broken_down action, --record writes
+# it without computing anything (project.yaml runs that as
+# record_annual_migrant_counts_fingerprint), so the next incremental run
+# extends that output rather than starting again.
+#
+# Usage (from the repo root):
+#   python -m analysis.annual_counts.incremental_counts [--end-year 2025] \
+#       [--output output/tables/annual_migrant_counts.csv] [--full | --record] \
+#       [--runner "opensafely exec ehrql:v1"] [--dummy-tables dummy_tables]
+
+#############################################################################
+
+import csv
+import json
+import shlex
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+from pathlib import Path
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib.action_cache import definition_fingerprint
+
+DEFINITION = "analysis/annual_counts/generate_annual_migrant_counts.py"
+OUTPUT_FILE = "output/tables/annual_migrant_counts.csv"
+
+with open("analysis/lib/study-dates.json") as f:
+    study_dates = json.load(f)
+
+START_DATE = study_dates["study_start_date"]
+END_YEAR = int(study_dates["study_end_date"][:4])
+
+
+def fingerprint_path(output_file):
+    output_file = Path(output_file)
+    return output_file.with_name(f"{output_file.stem}.fingerprint.json")
+
+
+def write_fingerprint(output_file, fingerprint, start_date):
+    fingerprint_path(output_file).write_text(
+        json.dumps({"fingerprint": fingerprint, "start_date": start_date}, indent=2) + "\n"
+    )
+
+
+def read_rows(path):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        return next(reader), list(reader)
+
+
+def write_rows(path, header, rows):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_name(path.name + ".tmp")
+    with open(temporary, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    temporary.replace(path)
+
+
+def run_measures(output_file, start_date, intervals, runner, dummy_tables=None):
+    argv = [*shlex.split(runner), "generate-measures", DEFINITION, "--output", str(output_file)]
+    if dummy_tables:
+        argv += ["--dummy-tables", dummy_tables]
+    argv += ["--", "--start-date", start_date, "--intervals", str(intervals)]
+    subprocess.run(argv, check=True)
+
+
+def merge_rows(header, existing, new):
+    """The existing rows with the new intervals' rows added, in the order the
+    measures output uses: if it is sorted by interval the new rows go at the
+    end, otherwise each measure's new rows go after its existing ones."""
+    interval_start = header.index("interval_start")
+    starts = [row[interval_start] for row in existing]
+    if starts == sorted(starts):
+        return existing + new
+    measure = header.index("measure")
+    order = {}
+    for row in existing + new:
+        order.setdefault(row[measure], len(order))
+    # sorted() is stable, so rows keep their order within each measure
+    return sorted(existing + new, key=lambda row: order[row[measure]])
+
+
+def plan(output_file, start_date, end_year, fingerprint):
+    """Return (start date, number of intervals) still to compute, or None if
+    the output is up to date. A start date of start_date means a full run."""
+    full_run = (start_date, end_year - int(start_date[:4]) + 1)
+    output_file = Path(output_file)
+    if not output_file.exists() or not fingerprint_path(output_file).exists():
+        return full_run
+    recorded = json.loads(fingerprint_path(output_file).read_text())
+    if recorded != {"fingerprint": fingerprint, "start_date": start_date}:
+        return full_run
+
+    header, rows = read_rows(output_file)
+    interval_start = header.index("interval_start")
+    last_year = max(int(row[interval_start][:4]) for row in rows) if rows else int(start_date[:4]) - 1
+    if last_year >= end_year:
+        return None
+    return f"{last_year + 1}-01-01", end_year - last_year
+
+
+def update_counts(output_file=OUTPUT_FILE, end_year=END_YEAR, start_date=START_DATE, full=False,
+                  runner="opensafely exec ehrql:v1", dummy_tables=None):
+    fingerprint = definition_fingerprint(DEFINITION)
+    to_compute = plan(output_file, start_date, end_year, fingerprint)
+    if full:
+        to_compute = (start_date, end_year - int(start_date[:4]) + 1)
+    if to_compute is None:
+        print(f"{output_file} already has every interval up to {end_year}")
+        return
+
+    interval_start, intervals = to_compute
+    with tempfile.TemporaryDirectory() as tmp:
+        new_file = Path(tmp) / "measures.csv"
+        run_measures(new_file, interval_start, intervals, runner, dummy_tables)
+        header, new = read_rows(new_file)
+
+    if interval_start == start_date:
+        print(f"computing all {intervals} intervals from {start_date}")
+        write_rows(output_file, header, new)
+    else:
+        print(f"adding {intervals} interval(s) from {interval_start}")
+        existing_header, existing = read_rows(output_file)
+        if existing_header != header:
+            raise ValueError(f"the new intervals' columns don't match {output_file}: {header} != {existing_header}")
+        write_rows(output_file, header, merge_rows(header, existing, new))
+
+    write_fingerprint(output_file, fingerprint, start_date)
+
+
+def record_fingerprint(output_file=OUTPUT_FILE, start_date=START_DATE):
+    """Record the fingerprint of an output made by running the definition
+    in full (as the project.yaml action does), from the current definition."""
+    header, rows = read_rows(output_file)
+    interval_start = header.index("interval_start")
+    first = min((row[interval_start] for row in rows), default=None)
+    if first != start_date:
+        raise ValueError(f"{output_file} starts at {first}, not {start_date}: it isn't a full run")
+    write_fingerprint(output_file, definition_fingerprint(DEFINITION), start_date)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--end-year", type=int, default=END_YEAR,
+                        help="the last calendar year to count (default: the year of the study end date)")
+    modes = parser.add_mutually_exclusive_group()
+    modes.add_argument("--full", action="store_true", help="recompute every interval")
+    modes.add_argument("--record", action="store_true",
+                       help="record the fingerprint of an existing full output, without computing anything")
+    parser.add_argument("--runner", default="opensafely exec ehrql:v1",
+                        help='how to run ehrQL, e.g. "python -m ehrql"')
+    parser.add_argument("--dummy-tables", help="directory of dummy tables to run against")
+    args = parser.parse_args()
+
+    if args.record:
+        record_fingerprint(args.output)
+        return
+    update_counts(args.output, args.end_year, full=args.full, runner=args.runner, dummy_tables=args.dummy_tables)
+
+
+if __name__ == "__main__":
+    main()
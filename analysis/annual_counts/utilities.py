@@ -20,19 +20,13 @@
 # }
 
 # function to load codelists 
-from ehrql import codelist_from_csv
-
-from ehrql import codelist_from_csv
+from analysis.lib.codelist_registry import load_codelists
 
 def load_all_codelists():
-    return {
-        "all_migrant_codes": codelist_from_csv("codelists/user-YaminaB-migration-status.csv", column="code"),
-        "cob_migrant_codes": codelist_from_csv("codelists/user-YaminaB-born-outside-the-uk.csv", column="code"),
-        "asylum_refugee_migrant_codes": codelist_from_csv("codelists/user-YaminaB-asylum-seeker-or-refugee.csv", column="code"),
-        "interpreter_migrant_codes": codelist_from_csv("codelists/user-YaminaB-interpreter-required.csv", column="code"),
-        "ethnicity_codelist": codelist_from_csv(
-            "codelists/opensafely-ethnicity-snomed-0removed.csv",
-            column="code",
-            category_column="Label_6",
-        ),
-    }
+    return load_codelists(
+        "all_migrant_codes",
+        "cob_migrant_codes",
+        "asylum_refugee_migrant_codes",
+        "interpreter_migrant_codes",
+        "ethnicity_codelist",
+    )
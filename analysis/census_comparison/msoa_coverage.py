@@ -0,0 +1,188 @@
+####
+# A script comparing a census cohort with the census itself, MSOA by MSOA:
+# the cohort is counted per MSOA x sex x age band and set against the number
+# of usual residents born outside the UK in the same cell, giving the
+# proportion of them the cohort picks up (coverage_ratio).
+#
+# The census counts come from a CSV in census_tables/ (ONS country of birth
+# by MSOA, sex and age, with the age bands of dataset_definition_census_cohorts.py),
+# with the columns:
+#   msoa_code, sex (male/female), age_band, all_usual_residents, born_outside_uk
+#
+# The census table's MSOAs are sorted into an index once, and every cell
+# (MSOA, sex, age band) is a position in one flat array. Each batch of the
+# cohort is mapped onto it with hash lookups (pc.index_in) and counted with
+# np.bincount, so the cohort is never grouped row by row and the join with
+# the census is by position. Cohort patients with no MSOA, or one that isn't
+# in the census table, are counted separately. If there's no census table
+# (yet), the cohort counts are still written, with the census columns empty.
+#
+# Cohort counts are rounded to the midpoint of multiples of --min-count (as
+# kaplan_meier.py does), and the ratios are calculated from the rounded
+# counts.
+#
+# Usage (from the repo root):
+#   python analysis/census_comparison/msoa_coverage.py --year 2021 \
+#       [--cohort output/cohorts/compact/census_2021_study_cohort.arrow] \
+#       [--census census_tables/census_2021_msoa_country_of_birth.csv] \
+#       [--output-dir output/tables/census_comparison] [--min-count 6]
+###
+
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib.arrow_files import iter_batches
+from analysis.lib.rounding import MIN_COUNT, rounded_counts
+
+COHORT = "output/cohorts/compact/census_{year}_study_cohort.arrow"
+CENSUS = "census_tables/census_{year}_msoa_country_of_birth.csv"
+OUTPUT_DIR = "output/tables/census_comparison"
+
+SEXES = ["male", "female"]
+# as in dataset_definition_census_cohorts.py ("missing" is left out: the
+# census has no such band)
+AGE_BANDS = ["0-15", "16-24", "25-34", "35-49", "50-64", "65-74", "75-84", "85 plus"]
+CENSUS_COUNTS = ["all_usual_residents", "born_outside_uk"]
+
+class CellIndex:
+    """Every (MSOA, sex, age band) cell as a position in a flat array, with
+    the MSOAs in sorted order."""
+
+    def __init__(self, msoa_codes):
+        self.msoa_codes = pa.array(sorted(set(msoa_codes)), pa.string())
+        self.sexes = pa.array(SEXES)
+        self.age_bands = pa.array(AGE_BANDS)
+        self.size = len(self.msoa_codes) * len(SEXES) * len(AGE_BANDS)
+
+    def positions(self, msoa_code, sex, age_band):
+        """The cell of each row, or -1 where any of its values isn't in the
+        index."""
+        msoa = pc.index_in(msoa_code, value_set=self.msoa_codes).fill_null(-1).to_numpy()
+        sex = pc.index_in(sex, value_set=self.sexes).fill_null(-1).to_numpy()
+        band = pc.index_in(age_band, value_set=self.age_bands).fill_null(-1).to_numpy()
+        cell = (msoa * len(SEXES) + sex) * len(AGE_BANDS) + band
+        return np.where((msoa >= 0) & (sex >= 0) & (band >= 0), cell, -1)
+
+    def frame(self):
+        """The cells in position order, as columns."""
+        msoa, sex, band = np.unravel_index(
+            np.arange(self.size), (len(self.msoa_codes), len(SEXES), len(AGE_BANDS))
+        )
+        return pd.DataFrame({
+            "msoa_code": self.msoa_codes.to_numpy(zero_copy_only=False)[msoa],
+            "sex": np.array(SEXES)[sex],
+            "age_band": np.array(AGE_BANDS)[band],
+        })
+
+
+def read_census(path):
+    return pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={"msoa_code": pa.string(), "sex": pa.string(), "age_band": pa.string(),
+                      **{name: pa.int64() for name in CENSUS_COUNTS}},
+        include_columns=["msoa_code", "sex", "age_band", *CENSUS_COUNTS],
+    ))
+
+
+def census_counts(census, index):
+    """{count column: array of the census count in each cell}."""
+    positions = index.positions(census.column("msoa_code"), census.column("sex"), census.column("age_band"))
+    if np.any(positions < 0):
+        raise ValueError(f"{np.sum(positions < 0)} census rows have a sex or age band that isn't in {SEXES} / {AGE_BANDS}")
+    return {
+        name: np.bincount(
+            positions, weights=census.column(name).fill_null(0).to_numpy(), minlength=index.size
+        ).astype(np.int64)
+        for name in CENSUS_COUNTS
+    }
+
+
+def cohort_counts(path, index):
+    """The number of cohort patients in each cell, and the number with no
+    MSOA or one that isn't in the index."""
+    counts = np.zeros(index.size, dtype=np.int64)
+    unmatched = 0
+    for batch in iter_batches(path, ["msoa_code", "sex", "age_band"]):
+        positions = index.positions(batch.column("msoa_code"), batch.column("sex"), batch.column("age_band"))
+        matched = positions >= 0
+        counts += np.bincount(positions[matched], minlength=index.size)
+        unmatched += int(np.sum(~matched))
+    return counts, unmatched
+
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(denominator > 0, numerator / denominator, np.nan)
+
+
+def msoa_coverage(cohort_path, census_path, min_count=MIN_COUNT):
+    """Return (cells, msoas, unmatched): the counts and coverage ratio of
+    each cell and of each MSOA overall, and the number of cohort patients not
+    in any cell."""
+    census = read_census(census_path) if Path(census_path).exists() else None
+    if census is not None:
+        index = CellIndex(census.column("msoa_code").drop_null().to_pylist())
+        counts = census_counts(census, index)
+    else:
+        print(f"{census_path} not found: writing the cohort counts without census counts")
+        msoa_codes = set()
+        for batch in iter_batches(cohort_path, ["msoa_code"]):
+            msoa_codes.update(pc.unique(batch.column("msoa_code").drop_null()).to_pylist())
+        index = CellIndex(msoa_codes)
+        counts = None
+    cohort, unmatched = cohort_counts(cohort_path, index)
+
+    def table(keys, cohort, counts):
+        frame = keys.copy()
+        frame["cohort_count"] = rounded_counts(cohort, min_count)
+        for name in CENSUS_COUNTS:
+            frame[name] = counts[name] if counts else pd.NA
+        frame["coverage_ratio"] = _ratio(frame["cohort_count"], counts["born_outside_uk"]) if counts else np.nan
+        return frame
+
+    # MSOA totals are summed before rounding; cells are laid out MSOA by MSOA
+    per_msoa = len(SEXES) * len(AGE_BANDS)
+    msoa_keys = pd.DataFrame({"msoa_code": index.msoa_codes.to_numpy(zero_copy_only=False)})
+    msoa_counts = counts and {name: values.reshape(-1, per_msoa).sum(axis=1) for name, values in counts.items()}
+    cells = table(index.frame(), cohort, counts)
+    msoas = table(msoa_keys, cohort.reshape(-1, per_msoa).sum(axis=1), msoa_counts)
+    return cells, msoas, int(rounded_counts(unmatched, min_count))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--year", required=True, help="census year, e.g. 2021")
+    parser.add_argument("--cohort", help=f"default: {COHORT}")
+    parser.add_argument("--census", help=f"default: {CENSUS}")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT)
+    args = parser.parse_args()
+
+    cells, msoas, unmatched = msoa_coverage(
+        args.cohort or COHORT.format(year=args.year),
+        args.census or CENSUS.format(year=args.year),
+        args.min_count,
+    )
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cells.to_csv(output_dir / f"msoa_sex_age_coverage_{args.year}.csv", index=False)
+    msoas.to_csv(output_dir / f"msoa_coverage_{args.year}.csv", index=False)
+    pd.DataFrame({"census_year": [args.year], "cohort_patients_without_a_census_msoa": [unmatched]}).to_csv(
+        output_dir / f"unmatched_{args.year}.csv", index=False)
+    print(f"{len(msoas):,} MSOAs; {unmatched:,} cohort patients without a census MSOA, sex or age band")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+# script to describe combinations of migration-related codes per patient
+# (goal 3 of code_counts.py)
+# 1) the most common combinations of individual migration-related codes
+# 2) the number of patients with each combination of code categories
+#    (country of birth, asylum/refugee, main language, interpreter), i.e. the
+#    counts behind a Venn diagram of the four codelists
+#
+# Every code in all_migrant_codes is given a bit position, and each patient's
+# events are folded into a fixed-width bitset (one bit per code) with NumPy
+# reductions. Distinct bitsets are then counted in a hash table, so memory
+# depends on the number of distinct combinations, not on the number of rows.
+#
+# The event-level dataset is written by ehrQL in patient order, which lets the
+# patients in each record batch be folded independently (a patient split
+# across two batches is carried over to the next one).
+#
+# The numbers of patients are rounded to the midpoint of multiples of
+# --min-count, as in code_counts.py, before they are written.
+#
+# Usage (from the repo root):
+#   python -m analysis.code_usage.code_combinations [--top-n 50] [--min-count 6]
+
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from analysis.code_usage.code_counts import EVENT_LEVEL_DATASET, iter_batches
+from analysis.lib.codelist_registry import load_codelist
+from analysis.lib.migration_categories import (
+    ASYLUM_REFUGEE,
+    COB,
+    INTERPRETER,
+    LANGUAGE,
+    category_table,
+)
+from analysis.lib.rounding import MIN_COUNT, rounded_counts
+
+OUTPUT_DIR = "output/tables/code_usage"
+
+VENN_CATEGORIES = {
+    "has_cob_migrant_code": COB,
+    "has_asylum_or_refugee_migrant_code": ASYLUM_REFUGEE,
+    "has_language_migrant_code": LANGUAGE,
+    "has_interpreter_migrant_code": INTERPRETER,
+}
+
+
+class CodeBitsets:
+    """Bit positions for every code in all_migrant_codes, and the category
+    bitmask of each position."""
+
+    def __init__(self, codes=None):
+        self.codes = pa.array(sorted(codes if codes is not None else load_codelist("all_migrant_codes")))
+        self.n_words = -(-len(self.codes) // 64)
+        table = category_table()
+        self.category_masks = np.array(
+            [table.get(code, 0) for code in self.codes.to_pylist()], dtype=np.uint8
+        )
+
+    def positions(self, snomedct_codes):
+        # -1 for any code that isn't in the codelist
+        return pc.index_in(snomedct_codes, value_set=self.codes).fill_null(-1).to_numpy()
+
+    def fold(self, patient_ids, positions):
+        """Fold rows (sorted by patient) into one bitset and one category mask
+        per patient, returning (patient_ids, bitsets, category_masks)."""
+        keep = positions >= 0
+        patient_ids, positions = patient_ids[keep], positions[keep]
+
+        starts = np.flatnonzero(np.r_[True, patient_ids[1:] != patient_ids[:-1]])
+        bits = np.zeros((len(positions), self.n_words), dtype=np.uint64)
+        bits[np.arange(len(positions)), positions // 64] = np.left_shift(
+            np.uint64(1), (positions % 64).astype(np.uint64)
+        )
+        if len(positions) == 0:
+            return patient_ids, bits, np.zeros(0, dtype=np.uint8)
+        bitsets = np.bitwise_or.reduceat(bits, starts, axis=0)
+        category_masks = np.bitwise_or.reduceat(self.category_masks[positions], starts)
+        return patient_ids[starts], bitsets, category_masks
+
+    def decode(self, bitset):
+        words = np.frombuffer(bitset, dtype=np.uint64)
+        bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+        return [self.codes[int(i)].as_py() for i in np.flatnonzero(bits)]
+
+
+def count_combinations(path, code_bitsets=None):
+    code_bitsets = code_bitsets or CodeBitsets()
+    combinations = Counter()
+    venn = Counter()
+
+    def tally(bitsets, category_masks):
+        patterns, counts = np.unique(
+            np.ascontiguousarray(bitsets).view(np.dtype((np.void, code_bitsets.n_words * 8))),
+            return_counts=True,
+        )
+        combinations.update(dict(zip((p.tobytes() for p in patterns), counts.tolist())))
+        masks, counts = np.unique(category_masks, return_counts=True)
+        venn.update(dict(zip(masks.tolist(), counts.tolist())))
+
+    carry = None
+    last_patient_id = None
+    for batch in iter_batches(path, columns=["patient_id", "snomedct_code"]):
+        patient_ids = batch.column("patient_id").to_numpy()
+        if len(patient_ids) == 0:
+            continue
+        if np.any(np.diff(patient_ids) < 0) or (
+            last_patient_id is not None and patient_ids[0] < last_patient_id
+        ):
+            raise ValueError(f"{path} is not sorted by patient_id")
+        last_patient_id = patient_ids[-1]
+
+        ids, bitsets, category_masks = code_bitsets.fold(
+            patient_ids, code_bitsets.positions(batch.column("snomedct_code"))
+        )
+        if carry is not None:
+            carry_id, carry_bitset, carry_mask = carry
+            if len(ids) and ids[0] == carry_id:
+                bitsets[0] |= carry_bitset
+                category_masks[0] |= carry_mask
+            elif patient_ids[-1] == carry_id:
+                # the whole batch is the carried patient's, with no codes in
+                # the codelist: they may still continue into the next one
+                continue
+            else:
+                tally(carry_bitset[np.newaxis], np.array([carry_mask], dtype=np.uint8))
+            # tallied, or merged into this batch's first patient
+            carry = None
+        if len(ids) == 0:
+            continue
+        # the last patient may continue into the next batch
+        carry = (ids[-1], bitsets[-1].copy(), category_masks[-1])
+        tally(bitsets[:-1], category_masks[:-1])
+
+    if carry is not None:
+        _, carry_bitset, carry_mask = carry
+        tally(carry_bitset[np.newaxis], np.array([carry_mask], dtype=np.uint8))
+
+    return combinations, venn
+
+
+def _rounded(frame, min_count):
+    frame["number_of_patients"] = rounded_counts(frame["number_of_patients"], min_count)
+    return frame
+
+
+def top_combinations(combinations, code_bitsets, top_n, min_count=MIN_COUNT):
+    # ranked on the exact numbers, which are then rounded
+    rows = []
+    for bitset, n in combinations.most_common(top_n):
+        codes = code_bitsets.decode(bitset)
+        rows.append({
+            "number_of_patients": n,
+            "number_of_codes": len(codes),
+            "codes": " - ".join(codes),
+        })
+    return _rounded(pd.DataFrame(rows, columns=["number_of_patients", "number_of_codes", "codes"]), min_count)
+
+
+def venn_counts(venn, min_count=MIN_COUNT):
+    rows = [
+        {
+            **{name: bool(mask & bit) for name, bit in VENN_CATEGORIES.items()},
+            "number_of_patients": n,
+        }
+        for mask, n in venn.items()
+    ]
+    frame = pd.DataFrame(rows, columns=[*VENN_CATEGORIES, "number_of_patients"])
+    # collapse masks that only differ in bits outside the four categories,
+    # before rounding
+    frame = (
+        frame.groupby(list(VENN_CATEGORIES), as_index=False)["number_of_patients"].sum()
+        .sort_values(list(VENN_CATEGORIES), ascending=False)
+        .reset_index(drop=True)
+    )
+    return _rounded(frame, min_count)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=EVENT_LEVEL_DATASET)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--top-n", type=int, default=50)
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT)
+    args = parser.parse_args()
+
+    code_bitsets = CodeBitsets()
+    combinations, venn = count_combinations(args.input, code_bitsets)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    top_combinations(combinations, code_bitsets, args.top_n, args.min_count).to_csv(
+        output_dir / "code_combinations_top.csv", index=False)
+    venn_counts(venn, args.min_count).to_csv(output_dir / "category_combinations.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,166 @@
 # script to describe code usage (note that how this corresponds to individuals is in the 3-annual_counts folder)
 # 1) number of all migration-related codes overall and annually
-# 2) number of migration-related codes split into the codelist subthemes overall and annually 
+# 2) number of migration-related codes split into the codelist subthemes overall and annually
 # 3) combinations of migration-related codes
+#
+# The event-level dataset has a row per patient per migration-related code, so
+# rather than loading it into memory it is memory-mapped and aggregated one
+# record batch at a time, reading only the columns needed. Memory use depends
+# on the number of distinct codes and years, not on the number of rows.
+#
+# The input can also be the partitioned Parquet export
+# (partition_event_level_dataset.py). Restricting to some years, categories or
+# codes (--years, --categories, --codes) then skips the partitions that don't
+# match and pushes the rest of the filter down to the row-group statistics.
+#
+# The counts are rounded to the midpoint of multiples of --min-count (as
+# kaplan_meier.py does) before they are written, as they are released.
 
 # load packages
 
-import pyarrow.feather as feather
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from pathlib import Path
+
 import pandas as pd
-import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib import arrow_files
+from analysis.lib.arrow_files import decoded
+from analysis.lib.rounding import MIN_COUNT, rounded_counts
+
+EVENT_LEVEL_DATASET = "output/cohorts/migration_event_level_dataset/migration_related_codes.arrow"
+OUTPUT_DIR = "output/tables/code_usage"
+
+COLUMNS = ["date", "snomedct_code", "migration_category"]
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("year", pa.int32()), ("migration_category", pa.string())]), flavor="hive"
+)
+
+
+def event_filter(years=None, categories=None, codes=None):
+    """A dataset filter restricting the events to some years, categories or
+    codes (None for no restriction)."""
+    conditions = []
+    if years:
+        conditions.append(ds.field("year").isin(years))
+    if categories:
+        conditions.append(ds.field("migration_category").isin(categories))
+    if codes:
+        conditions.append(ds.field("snomedct_code").isin(codes))
+    if not conditions:
+        return None
+    condition = conditions[0]
+    for other in conditions[1:]:
+        condition = condition & other
+    return condition
+
+
+def iter_batches(path, columns=COLUMNS, years=None, categories=None, codes=None):
+    if Path(path).is_dir():
+        # the partitioned Parquet export: only the matching partitions and
+        # row groups are read
+        dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING)
+        for batch in dataset.to_batches(columns=columns, filter=event_filter(years, categories, codes)):
+            yield arrow_files.select_decoded(batch, columns)
+        return
+
+    # The ehrQL .arrow output is an Arrow IPC file, so each record batch can be
+    # read straight out of the memory map without copying
+    for batch in arrow_files.iter_batches(path):
+        if years or categories or codes:
+            batch = _filter_batch(batch, years, categories, codes)
+        yield arrow_files.select_decoded(batch, columns)
+
+
+def _filter_batch(batch, years, categories, codes):
+    keep = pa.array([True] * batch.num_rows)
+    if years:
+        keep = pc.and_(keep, pc.is_in(pc.year(batch.column("date")), pa.array(years, pa.int64())))
+    if categories:
+        category = pc.fill_null(decoded(batch.column("migration_category")), "Other")
+        keep = pc.and_(keep, pc.is_in(category, pa.array(categories)))
+    if codes:
+        keep = pc.and_(keep, pc.is_in(decoded(batch.column("snomedct_code")), pa.array(codes)))
+    return batch.filter(pc.fill_null(keep, False))
+
+
+def count_batch(batch, keys):
+    table = pa.Table.from_batches([batch])
+    grouped = table.group_by(keys).aggregate([([], "count_all")])
+    return Counter(
+        {
+            tuple(row[key] for key in keys): row["count_all"]
+            for row in grouped.to_pylist()
+        }
+    )
+
+
+def count_code_usage(path, years=None, categories=None, codes=None):
+    counts = {
+        "code": Counter(),
+        "code_annual": Counter(),
+        "category": Counter(),
+        "category_annual": Counter(),
+    }
+    for batch in iter_batches(path, years=years, categories=categories, codes=codes):
+        batch = pa.record_batch(
+            [
+                batch.column("snomedct_code"),
+                pc.fill_null(batch.column("migration_category"), "Other"),
+                pc.year(batch.column("date")),
+            ],
+            names=["snomedct_code", "migration_category", "year"],
+        )
+        counts["code"] += count_batch(batch, ["snomedct_code"])
+        counts["code_annual"] += count_batch(batch, ["snomedct_code", "year"])
+        counts["category"] += count_batch(batch, ["migration_category"])
+        counts["category_annual"] += count_batch(batch, ["migration_category", "year"])
+    return counts
+
+
+def counts_to_frame(counter, keys, min_count=MIN_COUNT):
+    frame = pd.DataFrame(
+        [(*key, n) for key, n in counter.items()], columns=[*keys, "number_of_codes"]
+    )
+    frame["number_of_codes"] = rounded_counts(frame["number_of_codes"], min_count)
+    return frame.sort_values(keys, na_position="last").reset_index(drop=True)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=EVENT_LEVEL_DATASET,
+                        help="the event-level .arrow file, or a directory of the partitioned Parquet export")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--years", type=int, nargs="+")
+    parser.add_argument("--categories", nargs="+")
+    parser.add_argument("--codes", nargs="+")
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT)
+    args = parser.parse_args()
+
+    counts = count_code_usage(args.input, args.years, args.categories, args.codes)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    counts_to_frame(counts["code"], ["snomedct_code"], args.min_count).to_csv(
+        output_dir / "code_counts_overall.csv", index=False)
+    counts_to_frame(counts["code_annual"], ["snomedct_code", "year"], args.min_count).to_csv(
+        output_dir / "code_counts_annual.csv", index=False)
+    counts_to_frame(counts["category"], ["migration_category"], args.min_count).to_csv(
+        output_dir / "category_counts_overall.csv", index=False)
+    counts_to_frame(counts["category_annual"], ["migration_category", "year"], args.min_count).to_csv(
+        output_dir / "category_counts_annual.csv", index=False)
 
-# read in data
 
-table = feather.read_table("output/cohorts/migration_event_level_dataset/migration_related_codes.arrow")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# script to describe the timing and order of each patient's migration-related
+# codes
+# 1) the time between a patient's first and second codes, between any two
+#    consecutive codes, and from their first code to their last
+# 2) which category (as in migration_category) usually comes first: the
+#    number of patients whose first code is in each category, and how often
+#    a code in one category is followed by a code in another
+#
+# Rather than grouping by patient in pandas, the rows are put in (patient,
+# date) order and each patient's rows found from the positions where
+# patient_id changes. Gaps are then one np.diff over the whole batch, with
+# the gaps across a patient boundary masked out. Intervals are tallied in a
+# histogram of days, and transitions in a category x category matrix, so
+# memory depends on the longest interval, not on the number of rows, and the
+# quantiles are exact.
+#
+# The event-level dataset is written by ehrQL in patient order, so each
+# record batch is handled on its own (a patient split across two batches is
+# carried over to the next one). Codes on the same day are put in category
+# order, as their order within the day isn't recorded.
+#
+# The counts are rounded to the midpoint of multiples of --min-count, as in
+# code_counts.py, before they are written. The mean and quantiles of an
+# interval are left out unless at least --min-count intervals lie below the
+# lowest quantile and above the highest, as each quantile is one patient's
+# interval.
+#
+# Usage (from the repo root):
+#   python -m analysis.code_usage.code_intervals [--input ...] [--output-dir output/tables/code_usage] \
+#       [--min-count 6]
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from analysis.code_usage.code_counts import EVENT_LEVEL_DATASET, iter_batches
+from analysis.lib.migration_categories import CATEGORY_LABELS, OTHER_LABEL
+from analysis.lib.rounding import MIN_COUNT, rounded_counts
+
+OUTPUT_DIR = "output/tables/code_usage"
+
+CATEGORIES = [*CATEGORY_LABELS.values(), OTHER_LABEL]
+
+INTERVALS = ["first_to_second_code", "consecutive_codes", "first_to_last_code"]
+
+# intervals longer than this are tallied as this long
+MAX_INTERVAL_DAYS = 120 * 366
+
+QUANTILES = {"p10": 0.1, "p25": 0.25, "median": 0.5, "p75": 0.75, "p90": 0.9}
+
+# (label, lower bound in days), each band running up to the next
+INTERVAL_BANDS = [
+    ("same day", 0),
+    ("1 day to 1 month", 1),
+    ("1 to 6 months", 31),
+    ("6 to 12 months", 183),
+    ("1 to 2 years", 366),
+    ("2 to 5 years", 731),
+    ("5 years or more", 1827),
+]
+
+
+class IntervalTallies:
+    """Histograms of each interval (in days), the number of patients whose
+    first code is in each category and the category transition counts."""
+
+    def __init__(self):
+        self.histograms = {name: np.zeros(MAX_INTERVAL_DAYS + 1, dtype=np.int64) for name in INTERVALS}
+        self.first_category = np.zeros(len(CATEGORIES), dtype=np.int64)
+        self.transitions = np.zeros((len(CATEGORIES), len(CATEGORIES)), dtype=np.int64)
+        self.codes_per_patient = np.zeros(0, dtype=np.int64)
+
+    def _add(self, name, days):
+        self.histograms[name] += np.bincount(np.minimum(days, MAX_INTERVAL_DAYS), minlength=MAX_INTERVAL_DAYS + 1)
+
+    def add_patients(self, patient_ids, days, categories):
+        """Tally whole patients' rows (in any order)."""
+        if len(patient_ids) == 0:
+            return
+        order = np.lexsort((categories, days, patient_ids))
+        patient_ids, days, categories = patient_ids[order], days[order], categories[order]
+
+        starts = np.flatnonzero(np.r_[True, patient_ids[1:] != patient_ids[:-1]])
+        ends = np.r_[starts[1:], len(patient_ids)]
+        # same_patient[i]: row i + 1 is another code of row i's patient
+        same_patient = patient_ids[1:] == patient_ids[:-1]
+        gaps = np.diff(days)
+
+        # the gap ending at each patient's second code
+        has_second = ends - starts > 1
+        self._add("first_to_second_code", gaps[starts[has_second]])
+        self._add("consecutive_codes", gaps[same_patient])
+        self._add("first_to_last_code", (days[ends - 1] - days[starts])[has_second])
+
+        self.first_category += np.bincount(categories[starts], minlength=len(CATEGORIES))
+        self.transitions += np.bincount(
+            categories[:-1][same_patient] * len(CATEGORIES) + categories[1:][same_patient],
+            minlength=len(CATEGORIES) ** 2,
+        ).reshape(len(CATEGORIES), len(CATEGORIES))
+
+        counts = np.bincount(ends - starts)
+        if len(counts) > len(self.codes_per_patient):
+            counts[:len(self.codes_per_patient)] += self.codes_per_patient
+            self.codes_per_patient = counts
+        else:
+            self.codes_per_patient[:len(counts)] += counts
+
+
+def _category_indices(column):
+    labels = pc.fill_null(column, OTHER_LABEL)
+    indices = pc.index_in(labels, value_set=pa.array(CATEGORIES)).fill_null(CATEGORIES.index(OTHER_LABEL))
+    return indices.to_numpy().astype(np.int64)
+
+
+def tally_intervals(path):
+    tallies = IntervalTallies()
+    carry = None
+    for batch in iter_batches(path, columns=["patient_id", "date", "migration_category"]):
+        # an event without a date can't be placed in the sequence
+        batch = batch.filter(pc.is_valid(batch.column("date")))
+        patient_ids = batch.column("patient_id").to_numpy()
+        days = pc.cast(batch.column("date"), pa.int32()).to_numpy(zero_copy_only=False).astype(np.int64)
+        categories = _category_indices(batch.column("migration_category"))
+        if carry is not None:
+            patient_ids, days, categories = (np.r_[old, new] for old, new in zip(carry, (patient_ids, days, categories)))
+        if len(patient_ids) == 0:
+            continue
+        if np.any(np.diff(patient_ids) < 0):
+            raise ValueError(f"{path} is not sorted by patient_id")
+
+        # the last patient may continue into the next batch
+        last_start = np.searchsorted(patient_ids, patient_ids[-1])
+        tallies.add_patients(patient_ids[:last_start], days[:last_start], categories[:last_start])
+        carry = (patient_ids[last_start:], days[last_start:], categories[last_start:])
+
+    if carry is not None:
+        tallies.add_patients(*carry)
+    return tallies
+
+
+def _quantile(cumulative, q):
+    # the smallest interval with at least a fraction q of the intervals at or below it
+    return int(np.searchsorted(cumulative, max(np.ceil(q * cumulative[-1]), 1)))
+
+
+def _enough_for_quantiles(n, min_count):
+    # at least min_count intervals below the lowest quantile (and, as the
+    # quantiles are symmetric, above the highest)
+    return n > 0 and n * min(QUANTILES.values()) >= min_count
+
+
+def interval_summary(tallies, min_count=MIN_COUNT):
+    rows = []
+    days = np.arange(MAX_INTERVAL_DAYS + 1)
+    for name, histogram in tallies.histograms.items():
+        n = int(histogram.sum())
+        row = {"interval": name, "number_of_intervals": int(rounded_counts(n, min_count))}
+        if _enough_for_quantiles(n, min_count):
+            cumulative = np.cumsum(histogram)
+            row["mean_days"] = round(float((histogram * days).sum() / n), 1)
+            row.update({label: _quantile(cumulative, q) for label, q in QUANTILES.items()})
+        rows.append(row)
+    return pd.DataFrame(rows, columns=["interval", "number_of_intervals", "mean_days", *QUANTILES])
+
+
+def interval_bands(tallies, min_count=MIN_COUNT):
+    lowers = [lower for _, lower in INTERVAL_BANDS]
+    uppers = [*lowers[1:], MAX_INTERVAL_DAYS + 1]
+    return pd.DataFrame(
+        [
+            {"interval": name, "band": label,
+             "number_of_intervals": int(rounded_counts(histogram[lower:upper].sum(), min_count))}
+            for name, histogram in tallies.histograms.items()
+            for (label, lower), upper in zip(INTERVAL_BANDS, uppers)
+        ],
+        columns=["interval", "band", "number_of_intervals"],
+    )
+
+
+def first_categories(tallies, min_count=MIN_COUNT):
+    return pd.DataFrame({
+        "migration_category": CATEGORIES,
+        "number_of_patients": rounded_counts(tallies.first_category, min_count),
+    })
+
+
+def category_transitions(tallies, min_count=MIN_COUNT):
+    """Long format: how often a code in from_category is followed by the
+    patient's next code in to_category."""
+    from_category, to_category = np.meshgrid(np.arange(len(CATEGORIES)), np.arange(len(CATEGORIES)), indexing="ij")
+    return pd.DataFrame({
+        "from_category": np.array(CATEGORIES)[from_category.ravel()],
+        "to_category": np.array(CATEGORIES)[to_category.ravel()],
+        "number_of_transitions": rounded_counts(tallies.transitions.ravel(), min_count),
+    })
+
+
+def codes_per_patient(tallies, min_count=MIN_COUNT):
+    counts = tallies.codes_per_patient
+    present = np.flatnonzero(counts)
+    return pd.DataFrame({"number_of_codes": present, "number_of_patients": rounded_counts(counts[present], min_count)})
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=EVENT_LEVEL_DATASET)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT)
+    args = parser.parse_args()
+
+    tallies = tally_intervals(args.input)
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    interval_summary(tallies, args.min_count).to_csv(output_dir / "code_intervals_summary.csv", index=False)
+    interval_bands(tallies, args.min_count).to_csv(output_dir / "code_intervals_bands.csv", index=False)
+    first_categories(tallies, args.min_count).to_csv(output_dir / "category_of_first_code.csv", index=False)
+    category_transitions(tallies, args.min_count).to_csv(output_dir / "category_transitions.csv", index=False)
+    codes_per_patient(tallies, args.min_count).to_csv(output_dir / "codes_per_patient.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ from ehrql.tables.tpp import (
 
 from analysis.create_cohorts.codelists import *
 
+from analysis.lib.migration_categories import category_labels
+
 from analysis.create_cohorts.dataset_definition_full_study_cohort import dataset
 
 # all migration-related codes 
@@ -20,16 +22,12 @@ migration_related_codes = (
   .sort_by(clinical_events.date)
 )
 
+# migration_category comes from one lookup in the code -> category table
+# (codes in more than one codelist take the first of: language, interpreter,
+# asylum/refugee, country of birth; codes in none of them are "Other")
+
 dataset.add_event_table(
   "migration_related_codes",
   date=migration_related_codes.date,
   snomedct_code=migration_related_codes.snomedct_code,
-  migration_category=case(
-    when(migration_related_codes.snomedct_code.is_in(language_migrant_codes)).then("Main/first language is not English"),
-    when(migration_related_codes.snomedct_code.is_in(interpreter_migrant_codes)).then("Interpreter required"),
-    when(migration_related_codes.snomedct_code.is_in(asylum_refugee_migrant_codes)).then("Asylum or refugee status"),
-    when(migration_related_codes.snomedct_code.is_in(cob_migrant_codes)).then("Country of birth")))
-
-dataset.migration_related_codes.migration_category = (
-    dataset.migration_related_codes.migration_category.fill_null("Other")
-)
+  migration_category=migration_related_codes.snomedct_code.to_category(category_labels()))
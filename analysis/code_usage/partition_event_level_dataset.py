@@ -0,0 +1,88 @@
+# script to export the migration event-level dataset as Parquet, partitioned
+# by event year and migration_category (year=2015/migration_category=.../*.parquet),
+# so that an analysis restricted to some years or categories only reads the
+# matching files (see the --years/--categories options of code_counts.py)
+#
+# Each record batch is sorted by year, category, date and code before it is
+# written, so the row-group min/max statistics on date and snomedct_code are
+# tight enough for filters on those columns to skip row groups too.
+#
+# Usage (from the repo root):
+#   python analysis/code_usage/partition_event_level_dataset.py \
+#       [--input output/cohorts/migration_event_level_dataset/migration_related_codes.arrow] \
+#       [--output-dir output/cohorts/migration_event_level_dataset_parquet]
+
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib.arrow_files import iter_batches, read_schema
+
+EVENT_LEVEL_DATASET = "output/cohorts/migration_event_level_dataset/migration_related_codes.arrow"
+OUTPUT_DIR = "output/cohorts/migration_event_level_dataset_parquet"
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("year", pa.int32()), ("migration_category", pa.string())]), flavor="hive"
+)
+STATISTICS_COLUMNS = ["date", "snomedct_code"]
+
+MAX_ROWS_PER_GROUP = 128 * 1024
+
+
+def partitioned_batches(path):
+    """The event-level dataset one record batch at a time, with a year column
+    and each batch sorted to keep the row-group statistics tight."""
+    names = read_schema(path).names
+    for batch in iter_batches(path, columns=names):
+        columns = {name: batch.column(name) for name in names}
+        columns["migration_category"] = pc.fill_null(columns["migration_category"], "Other")
+        columns["year"] = pc.cast(pc.year(columns["date"]), pa.int32())
+        table = pa.table(columns).sort_by([
+            ("year", "ascending"),
+            ("migration_category", "ascending"),
+            ("date", "ascending"),
+            ("snomedct_code", "ascending"),
+        ])
+        yield from table.to_batches()
+
+
+def write_partitioned_dataset(path, output_dir):
+    schema = pa.schema(
+        [pa.field(field.name, field.type.value_type if pa.types.is_dictionary(field.type) else field.type)
+         for field in read_schema(path)]
+        + [pa.field("year", pa.int32())]
+    )
+    file_format = ds.ParquetFileFormat()
+    ds.write_dataset(
+        pa.RecordBatchReader.from_batches(schema, partitioned_batches(path)),
+        output_dir,
+        format=file_format,
+        file_options=file_format.make_write_options(
+            compression="zstd", write_statistics=STATISTICS_COLUMNS
+        ),
+        partitioning=PARTITIONING,
+        max_rows_per_group=MAX_ROWS_PER_GROUP,
+        existing_data_behavior="delete_matching",
+    )
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=EVENT_LEVEL_DATASET)
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    args = parser.parse_args()
+
+    write_partitioned_dataset(args.input, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,16 @@
 ## Author: Yamina Boukari
 ####
 
-from ehrql import codelist_from_csv
+# The codelists themselves are defined once, in analysis/lib/codelist_registry.py.
+# Each one is only read (from the on-disk cache where possible) the first time
+# a script imports it from here.
 
-all_migrant_codes = codelist_from_csv("codelists/user-YaminaB-migration-status.csv", column="code")
+from analysis.lib.codelist_registry import CODELISTS, load_codelist
 
-cob_migrant_codes = codelist_from_csv("codelists/user-YaminaB-born-outside-the-uk.csv", column="code")
+__all__ = list(CODELISTS)
 
-asylum_refugee_migrant_codes = codelist_from_csv("codelists/user-YaminaB-asylum-seeker-or-refugee.csv", column="code")
 
-language_migrant_codes = codelist_from_csv("codelists/user-YaminaB-english-not-main-language.csv", column="code")
-
-interpreter_migrant_codes = codelist_from_csv("codelists/user-YaminaB-interpreter-required.csv", column="code")
-
-ethnicity_codelist =  codelist_from_csv(
-            "codelists/opensafely-ethnicity-snomed-0removed.csv",
-            column="code",
-            category_column="Label_6",
-        )
\ No newline at end of file
+def __getattr__(name):
+    if name in CODELISTS:
+        return load_codelist(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,160 @@
+## Script to rewrite cohort .arrow files in a more compact form:
+## - low-cardinality string columns (sex, ethnicity, year of birth band,
+##   region, MSOA, IMD...) are dictionary-encoded, with the narrowest index type
+## - integer columns (counts, ages, years...) get the narrowest integer type
+##   that holds their values
+## - record batches are compressed (zstd by default, or lz4)
+##
+## The logical schema is unchanged: the same columns in the same order with the
+## same values, and dictionary columns decode to the same strings. The
+## original schema is kept in the schema metadata, and restore_schema() casts
+## a compacted table back to it exactly.
+##
+## The input is read twice from a memory map (once for the value ranges and
+## dictionaries, once to write), a record batch at a time.
+##
+## Usage (from the repo root):
+##   python analysis/create_cohorts/compact_cohorts.py output/cohorts/full_study_cohort.arrow ... \
+##       --output-dir output/cohorts/compact [--compression lz4]
+####
+
+import base64
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib.arrow_files import decoded, iter_batches, read_schema
+
+# string columns with more distinct values than this are left as they are
+MAX_DICTIONARY_SIZE = 2**15
+
+# kept at their original width so they join cleanly with other files
+KEEP_TYPES = {"patient_id"}
+
+ORIGINAL_SCHEMA_KEY = b"original_schema"
+
+INTEGER_TYPES = [pa.int8(), pa.int16(), pa.int32(), pa.int64()]
+
+
+def _is_string(data_type):
+    return pa.types.is_string(data_type) or pa.types.is_large_string(data_type)
+
+
+def _narrowest_integer(minimum, maximum):
+    for data_type in INTEGER_TYPES:
+        info = np.iinfo(data_type.to_pandas_dtype())
+        if info.min <= minimum and maximum <= info.max:
+            return data_type
+    return pa.int64()
+
+
+def plan_columns(path):
+    """Work out the compact type of each column: returns (schema, {column:
+    dictionary}) for the compacted file."""
+    schema = read_schema(path)
+    logical_types = {
+        field.name: field.type.value_type if pa.types.is_dictionary(field.type) else field.type
+        for field in schema
+    }
+    ranges = {}
+    values = {
+        name: set() for name, data_type in logical_types.items()
+        if _is_string(data_type) and name not in KEEP_TYPES
+    }
+
+    for batch in iter_batches(path):
+        for name, data_type in logical_types.items():
+            if name in KEEP_TYPES:
+                continue
+            column = batch.column(name)
+            if pa.types.is_integer(data_type):
+                min_max = pc.min_max(column)
+                if min_max["min"].is_valid:
+                    low, high = ranges.get(name, (min_max["min"].as_py(), min_max["max"].as_py()))
+                    ranges[name] = (min(low, min_max["min"].as_py()), max(high, min_max["max"].as_py()))
+            elif name in values:
+                if pa.types.is_dictionary(column.type):
+                    column = column.dictionary
+                values[name].update(v for v in pc.unique(column).to_pylist() if v is not None)
+                if len(values[name]) > MAX_DICTIONARY_SIZE:
+                    del values[name]
+
+    fields, dictionaries = [], {}
+    for field in schema:
+        name, data_type = field.name, logical_types[field.name]
+        if name in ranges:
+            data_type = _narrowest_integer(*ranges[name])
+        elif name in values:
+            dictionaries[name] = pa.array(sorted(values[name]), pa.string())
+            index_type = _narrowest_integer(0, max(len(dictionaries[name]) - 1, 0))
+            data_type = pa.dictionary(index_type, pa.string())
+        fields.append(pa.field(name, data_type, nullable=field.nullable))
+
+    metadata = {
+        **(schema.metadata or {}),
+        ORIGINAL_SCHEMA_KEY: base64.b64encode(schema.serialize().to_pybytes()),
+    }
+    return pa.schema(fields, metadata=metadata), dictionaries
+
+
+def _compact_batch(batch, schema, dictionaries):
+    columns = []
+    for field in schema:
+        column = batch.column(field.name)
+        if field.name in dictionaries:
+            dictionary = dictionaries[field.name]
+            indices = pc.index_in(decoded(column).cast(pa.string()), dictionary)
+            column = pa.DictionaryArray.from_arrays(indices.cast(field.type.index_type), dictionary)
+        elif column.type != field.type:
+            column = decoded(column).cast(field.type)
+        columns.append(column)
+    return pa.record_batch(columns, schema=schema)
+
+
+def compact_cohort(path, output_path, compression="zstd"):
+    schema, dictionaries = plan_columns(path)
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = output_path.with_name(output_path.name + ".tmp")
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(str(temporary), "wb") as sink:
+        with pa.ipc.new_file(sink, schema, options=options) as writer:
+            for batch in iter_batches(path):
+                writer.write_batch(_compact_batch(batch, schema, dictionaries))
+    # the input may be the output (compacting in place)
+    temporary.replace(output_path)
+
+
+def original_schema(schema):
+    return pa.ipc.read_schema(pa.py_buffer(base64.b64decode(schema.metadata[ORIGINAL_SCHEMA_KEY])))
+
+
+def restore_schema(table):
+    """Cast a compacted table back to the schema it was written from."""
+    return table.cast(original_schema(table.schema))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("cohort_files", nargs="+")
+    parser.add_argument("--output-dir", help="write the compacted files here (default: in place)")
+    parser.add_argument("--compression", choices=["zstd", "lz4"], default="zstd")
+    args = parser.parse_args()
+
+    for cohort_file in args.cohort_files:
+        cohort_file = Path(cohort_file)
+        output_path = Path(args.output_dir) / cohort_file.name if args.output_dir else cohort_file
+        compact_cohort(cohort_file, output_path, args.compression)
+
+
+if __name__ == "__main__":
+    main()
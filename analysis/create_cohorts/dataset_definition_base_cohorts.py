@@ -0,0 +1,122 @@
+# This is a script to create the three study-start cohorts in one ehrQL run:
+# - the full study (migrant) cohort (dataset_definition_full_study_cohort.py)
+# - the population denominator cohort (population_denominator_cohort.py)
+# - the KM cohort (dataset_definition_km_time_to_first_migration_code.py)
+#
+# They share the same base population (non-disclosive sex, alive at the start
+# of the study in both patients and ons_deaths, not over 100 at the start of the
+# study), defined with the registration criteria in inclusion_criteria.py, and
+# most of their demographics. Here the shared criteria and variables
+# are evaluated once, for everyone in any of the three cohorts. Each cohort's
+# own criteria become an in_<cohort> flag. split_base_cohorts.py then writes
+# each cohort with the columns its own definition gives, joining on the
+# latest ethnicity and year of birth columns from the patient feature table
+# (dataset_definition_patient_features.py).
+#
+# The single-cohort definitions are kept for the benchmarks and import the same
+# criteria; the dataset definition tests (analysis/testing/test_base_cohorts_definition.py)
+# run against this definition and its in_<cohort> flags.
+
+from ehrql import create_dataset, show, case, when, days, minimum_of
+from ehrql.tables.tpp import addresses, patients, practice_registrations, ons_deaths
+from datetime import datetime
+
+from analysis.create_cohorts.inclusion_criteria import (
+    study_start_date,
+    study_end_date,
+    is_in_base_population,
+    is_registered_during_study,
+    is_registered_for_km,
+)
+from analysis.create_cohorts.migration_events import MIGRANT, COB, ASYLUM_REFUGEE, INTERPRETER, has_code, date_of_first_code, number_of_codes
+
+# Cohort-specific criteria
+
+has_any_migrant_code = has_code(MIGRANT)
+
+dataset = create_dataset()
+dataset.define_population(is_in_base_population &
+                          (is_registered_during_study | is_registered_for_km))
+
+dataset.in_full_study_cohort = has_any_migrant_code & is_registered_during_study
+dataset.in_population_denominator_cohort = is_registered_during_study
+dataset.in_km_cohort = is_registered_for_km
+
+show(dataset)
+
+# Shared demographics
+
+dataset.sex = patients.sex
+
+date_of_first_practice_registration = (
+    practice_registrations.sort_by(practice_registrations.start_date)
+    .first_for_patient().start_date
+)
+
+dataset.date_of_first_practice_registration = date_of_first_practice_registration
+
+# MSOA, IMD and practice region at study start
+
+address = addresses.for_patient_on(study_start_date)
+
+dataset.msoa_code = address.msoa_code
+dataset.imd_decile = address.imd_decile
+dataset.imd_quintile = address.imd_quintile
+
+dataset.region = practice_registrations.for_patient_on(study_start_date).practice_nuts1_region_name
+
+# Practice region at first registration (the KM cohort's region)
+
+dataset.region_at_first_registration = (
+    practice_registrations.sort_by(practice_registrations.start_date)
+    .first_for_patient().practice_nuts1_region_name
+)
+
+dataset.TPP_death_date = patients.date_of_death
+dataset.ons_death_date = ons_deaths.date
+
+# Migration codes (the KM cohort's all_migrant_codes is the MIGRANT category)
+
+date_of_first_migration_code = date_of_first_code(MIGRANT)
+
+dataset.has_a_migration_code = has_any_migrant_code
+dataset.date_of_first_migration_code = date_of_first_migration_code
+dataset.number_of_migration_codes = number_of_codes(MIGRANT)
+
+dataset.has_cob_migrant_code = has_code(COB)
+dataset.has_asylum_or_refugee_migrant_code = has_code(ASYLUM_REFUGEE)
+dataset.has_interpreter_migrant_code = has_code(INTERPRETER)
+
+dataset.time_to_first_migration_code = (date_of_first_migration_code - date_of_first_practice_registration).days
+
+# Follow-up for the KM cohort
+
+dataset.baseline_date = date_of_first_practice_registration - days(1)
+
+def date_deregistered_from_all_supported_practices():
+    max_dereg_date = practice_registrations.end_date.maximum_for_patient()
+    # In TPP currently active registrations are recorded as having an end date of
+    # 9999-12-31. We convert these, and any other far-future dates, to NULL.
+    return case(
+        when(max_dereg_date.is_before("3000-01-01")).then(max_dereg_date),
+        otherwise=None,
+    )
+
+dataset.date_of_deregistration = date_deregistered_from_all_supported_practices()
+
+dataset.censor_date = minimum_of(dataset.TPP_death_date,
+                                 dataset.ons_death_date,
+                                 dataset.date_of_deregistration,
+                                 datetime.strptime(study_end_date, "%Y-%m-%d").date()
+                                 )
+
+migration_code_before_practice_reg = date_of_first_migration_code < date_of_first_practice_registration
+
+dataset.processed_first_migration_code_date = case(
+    when(migration_code_before_practice_reg == False).then(date_of_first_migration_code),
+    when(migration_code_before_practice_reg == True).then(date_of_first_practice_registration)
+)
+
+show(dataset)
+
+dataset.configure_dummy_data(population_size=1000)
@@ -5,21 +5,49 @@
 #         3) who does not have a disclosive sex AND
 #         4) had not died before the start of the study period AND 
 #         5) was not over 100 years old at the Census  date 
+#
+# It takes one or more census dates (by default, every census_*_date in
+# analysis/lib/study-dates.json), in different years. The date-independent
+# variables are evaluated once and the point-in-time ones (cohort membership,
+# age, address and region) once per date, with a _<census year> suffix, however
+# many dates there are; split_census_cohorts.py then writes one cohort file per
+# census. The latest ethnicity and year of birth columns come
+# from the patient feature table (dataset_definition_patient_features.py),
+# which split_census_cohorts.py joins on.
+
+import json
 
 from ehrql import create_dataset, codelist_from_csv, show, case, when
 from ehrql.tables.tpp import addresses, patients, practice_registrations, clinical_events, ons_deaths
 from utilities import load_all_codelists 
+from analysis.create_cohorts.migration_events import MIGRANT, COB, ASYLUM_REFUGEE, INTERPRETER, migration_events, has_code, date_of_first_code, number_of_codes
 from argparse import ArgumentParser
 
 # Below code from https://github.com/opensafely/disease_incidence/blob/main/analysis/dataset_definition_demographics.py
 # Arguments (from project.yaml)
 
 parser = ArgumentParser()
-parser.add_argument("--census-date", type=str)
+parser.add_argument("--census-date", type=str, nargs="+", dest="census_dates")
 args = parser.parse_args()
 
 #######
-census_date = args.census_date
+with open("analysis/lib/study-dates.json") as f:
+    study_dates = json.load(f)
+
+census_dates = sorted(
+    args.census_dates
+    or [date for key, date in study_dates.items() if key.startswith("census_")]
+)
+
+# variables that depend on the census date get a _<census year> suffix, so
+# there can only be one census date in a year
+
+census_years = [census_date[:4] for census_date in census_dates]
+if len(set(census_years)) < len(census_years):
+    parser.error(f"--census-date has more than one date in the same year: {census_dates}")
+
+def column_name(name, census_date):
+    return f"{name}_{census_date[:4]}"
 
 # load codelists 
 (all_migrant_codes,
@@ -30,57 +58,62 @@ census_date = args.census_date
 ) = load_all_codelists().values()
 
 # define population
-has_any_migrant_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(all_migrant_codes)
-                          ).where(clinical_events.date.is_on_or_before(census_date)
-                                  ).exists_for_patient())
+# All migration-code variables come from one filtered frame of clinical_events
+# (see migration_events.py) rather than one filter per codelist
 
-was_registered_on_census_date = (
-    practice_registrations.exists_for_patient_on(census_date)
-)           
+def in_census_cohort(census_date):
+    has_any_migrant_code = has_code(
+        MIGRANT, migration_events.where(migration_events.date.is_on_or_before(census_date))
+    )
 
-has_non_disclosive_sex = (
-    (patients.sex == "male") | (patients.sex == "female")
-)
+    was_registered_on_census_date = (
+        practice_registrations.exists_for_patient_on(census_date)
+    )           
 
-was_alive_on_census_date = (
-    (patients.is_alive_on(census_date))
-)
+    has_non_disclosive_sex = (
+        (patients.sex == "male") | (patients.sex == "female")
+    )
 
-was_not_over_100_on_census_date = (
-    patients.age_on(census_date) <= 100
-)
+    was_alive_on_census_date = (
+        (patients.is_alive_on(census_date))
+    )
+
+    was_not_over_100_on_census_date = (
+        patients.age_on(census_date) <= 100
+    )
+
+    return (has_any_migrant_code & 
+            was_registered_on_census_date & 
+            has_non_disclosive_sex & 
+            was_alive_on_census_date & 
+            was_not_over_100_on_census_date)
+
+in_cohort = {census_date: in_census_cohort(census_date) for census_date in census_dates}
+
+population = in_cohort[census_dates[0]]
+for census_date in census_dates[1:]:
+    population = population | in_cohort[census_date]
 
 dataset = create_dataset()
-dataset.define_population(has_any_migrant_code & 
-                          was_registered_on_census_date & 
-                          has_non_disclosive_sex & 
-                          was_alive_on_census_date & 
-                          was_not_over_100_on_census_date)
+dataset.define_population(population)
 
 show(dataset)
 
 # add variables 
 
-date_of_first_migration_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(all_migrant_codes))
-    .sort_by(clinical_events.date)
-    .first_for_patient().date)
+date_of_first_migration_code = date_of_first_code(MIGRANT)
 
 dataset.date_of_first_migration_code = date_of_first_migration_code
 
-dataset.number_of_migration_codes = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(all_migrant_codes))
-    .count_for_patient()
-)
+dataset.number_of_migration_codes = number_of_codes(MIGRANT)
 
 dataset.sex = patients.sex
 
 # Add variables to indicate the type of migration code
 
-dataset.has_cob_migrant_code = clinical_events.where(clinical_events.snomedct_code.is_in(cob_migrant_codes)).exists_for_patient()
-dataset.has_asylum_or_refugee_migrant_code = clinical_events.where(clinical_events.snomedct_code.is_in(asylum_refugee_migrant_codes)).exists_for_patient()
-dataset.has_interpreter_migrant_code = clinical_events.where(clinical_events.snomedct_code.is_in(interpreter_migrant_codes)).exists_for_patient()
+dataset.has_cob_migrant_code = has_code(COB)
+dataset.has_asylum_or_refugee_migrant_code = has_code(ASYLUM_REFUGEE)
+dataset.has_interpreter_migrant_code = has_code(INTERPRETER)
 
 # Add first practice registration date
 
@@ -97,63 +130,46 @@ time_to_first_migration_code  = (date_of_first_migration_code - date_of_first_pr
 
 dataset.time_to_first_migration_code = time_to_first_migration_code
 
-# Add ethnicity variable
+# Point-in-time variables, for each census date
 
-dataset.latest_ethnicity_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(ethnicity_codelist))
-    .sort_by(clinical_events.date)
-    .last_for_patient()
-    .snomedct_code
-)
-dataset.latest_ethnicity_group = dataset.latest_ethnicity_code.to_category(
-    ethnicity_codelist
-)
+for census_date in census_dates:
 
-# Add year of birth variable and categorise into bands 
+    dataset.add_column(column_name("in_census_cohort", census_date), in_cohort[census_date])
 
-year_of_birth = (patients.date_of_birth).year
-dataset.year_of_birth = year_of_birth
+    # age 
 
-dataset.year_of_birth_band = case(
-    when((year_of_birth >= 1900) & (year_of_birth <= 1925)).then("1900-1925"),
-    when((year_of_birth > 1925) & (year_of_birth <= 1945)).then("1926-1945"),
-    when((year_of_birth > 1945) & (year_of_birth <= 1965)).then("1946-1965"),
-    when((year_of_birth > 1965) & (year_of_birth <= 1985)).then("1966-1985"),
-    when((year_of_birth > 1985) & (year_of_birth <= 2005)).then("1986-2005"),
-    when((year_of_birth > 2005) & (year_of_birth <= 2025)).then("2006-2025") 
-)
+    age_on_census_date = patients.age_on(census_date)
+    dataset.add_column(column_name("age_on_census_date", census_date), age_on_census_date)
 
-# age 
-
-age_on_census_date = patients.age_on(census_date)
-dataset.age_on_census_date  = age_on_census_date
-
-dataset.age_band = case(
-        when(age_on_census_date < 16).then("0-15"),
-        when((age_on_census_date >= 16) & (age_on_census_date < 25)).then("16-24"),
-        when((age_on_census_date >= 25) & (age_on_census_date < 35)).then("25-34"),
-        when((age_on_census_date >= 35) & (age_on_census_date < 50)).then("35-49"),
-        when((age_on_census_date >= 50) & (age_on_census_date < 65)).then("50-64"),
-        when((age_on_census_date >= 65) & (age_on_census_date < 75)).then("65-74"),
-        when((age_on_census_date >= 75) & (age_on_census_date < 85)).then("75-84"),
-        when(age_on_census_date >= 85).then("85 plus"),
-        otherwise="missing",
-)
+    dataset.add_column(column_name("age_band", census_date), case(
+            when(age_on_census_date < 16).then("0-15"),
+            when((age_on_census_date >= 16) & (age_on_census_date < 25)).then("16-24"),
+            when((age_on_census_date >= 25) & (age_on_census_date < 35)).then("25-34"),
+            when((age_on_census_date >= 35) & (age_on_census_date < 50)).then("35-49"),
+            when((age_on_census_date >= 50) & (age_on_census_date < 65)).then("50-64"),
+            when((age_on_census_date >= 65) & (age_on_census_date < 75)).then("65-74"),
+            when((age_on_census_date >= 75) & (age_on_census_date < 85)).then("75-84"),
+            when(age_on_census_date >= 85).then("85 plus"),
+            otherwise="missing",
+    ))
 
-# Add MSOA 
+    # Add MSOA 
 
-address = addresses.for_patient_on(census_date) 
+    address = addresses.for_patient_on(census_date) 
 
-dataset.msoa_code = address.msoa_code
+    dataset.add_column(column_name("msoa_code", census_date), address.msoa_code)
 
-# Add IMD based on patient's address 
+    # Add IMD based on patient's address 
 
-dataset.imd_decile = address.imd_decile
-dataset.imd_quintile = address.imd_quintile
+    dataset.add_column(column_name("imd_decile", census_date), address.imd_decile)
+    dataset.add_column(column_name("imd_quintile", census_date), address.imd_quintile)
 
-# Add practice region (at study start)
+    # Add practice region (on the census date)
 
-dataset.region = practice_registrations.for_patient_on(census_date).practice_nuts1_region_name
+    dataset.add_column(
+        column_name("region", census_date),
+        practice_registrations.for_patient_on(census_date).practice_nuts1_region_name,
+    )
 
 # Add date of death (if died)
 
@@ -22,12 +22,15 @@ from pathlib import Path
 from ehrql import create_dataset, codelist_from_csv, show, case, when
 from ehrql.tables.tpp import addresses, patients, practice_registrations, clinical_events, ons_deaths
 
-from analysis.create_cohorts.codelists import all_migrant_codes, cob_migrant_codes, asylum_refugee_migrant_codes, interpreter_migrant_codes, ethnicity_codelist
-
-# Dates
-
-study_start_date = "2009-01-01"
-study_end_date = "2024-12-31"
+from analysis.create_cohorts.demographics import latest_ethnicity_code, latest_ethnicity_group, year_of_birth, year_of_birth_band
+from analysis.create_cohorts.inclusion_criteria import (
+    study_start_date,
+    has_non_disclosive_sex,
+    is_alive_at_study_start,
+    was_not_over_100_at_study_start,
+    is_registered_during_study,
+)
+from analysis.create_cohorts.migration_events import MIGRANT, COB, ASYLUM_REFUGEE, INTERPRETER, has_code, date_of_first_code, number_of_codes
 
 # Select all individuals who:
 #          1) had a migrant code during the entire study period AND 
@@ -38,30 +41,11 @@ study_end_date = "2024-12-31"
 # Add a variable indicating the date of the first code 
 # Add a variable indicating how many migration-related codes they have
 
-has_any_migrant_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(all_migrant_codes))
-    .exists_for_patient())
-
-is_registered_during_study = (
-    practice_registrations
-    .where((practice_registrations.end_date.is_null()) | ((practice_registrations.end_date.is_on_or_before(study_end_date)) & (practice_registrations.end_date.is_after(study_start_date))))
-    .exists_for_patient()
-)           
+# All migration-code variables come from one filtered frame of clinical_events
+# (see migration_events.py) rather than one filter per codelist, and the other
+# criteria from inclusion_criteria.py
 
-has_non_disclosive_sex = (
-    (patients.sex == "male") | (patients.sex == "female")
-)
-
-is_alive_at_study_start = (
-    ((patients.date_of_death >= study_start_date) | (patients.date_of_death.is_null())) &
-    ((ons_deaths.date >= study_start_date) | (ons_deaths.date.is_null()))
-)
-
-was_not_over_100_at_study_start = (
-    patients.age_on(study_start_date) <= 100
-)
-
-show(was_not_over_100_at_study_start)
+has_any_migrant_code = has_code(MIGRANT)
 
 dataset = create_dataset()
 dataset.define_population(has_any_migrant_code & 
@@ -72,25 +56,19 @@ dataset.define_population(has_any_migrant_code &
 
 show(dataset)
 
-date_of_first_migration_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(all_migrant_codes))
-    .sort_by(clinical_events.date)
-    .first_for_patient().date)
+date_of_first_migration_code = date_of_first_code(MIGRANT)
 
 dataset.date_of_first_migration_code = date_of_first_migration_code
 
-dataset.number_of_migration_codes = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(all_migrant_codes))
-    .count_for_patient()
-)
+dataset.number_of_migration_codes = number_of_codes(MIGRANT)
 
 dataset.sex = patients.sex
 
 # Add variables to indicate the type of migration code
 
-dataset.has_cob_migrant_code = clinical_events.where(clinical_events.snomedct_code.is_in(cob_migrant_codes)).exists_for_patient()
-dataset.has_asylum_or_refugee_migrant_code = clinical_events.where(clinical_events.snomedct_code.is_in(asylum_refugee_migrant_codes)).exists_for_patient()
-dataset.has_interpreter_migrant_code = clinical_events.where(clinical_events.snomedct_code.is_in(interpreter_migrant_codes)).exists_for_patient()
+dataset.has_cob_migrant_code = has_code(COB)
+dataset.has_asylum_or_refugee_migrant_code = has_code(ASYLUM_REFUGEE)
+dataset.has_interpreter_migrant_code = has_code(INTERPRETER)
 
 # Add first practice registration date
 
@@ -109,29 +87,13 @@ dataset.time_to_first_migration_code = time_to_first_migration_code
 
 # Add ethnicity variable
 
-dataset.latest_ethnicity_code = (
-    clinical_events.where(clinical_events.snomedct_code.is_in(ethnicity_codelist))
-    .sort_by(clinical_events.date)
-    .last_for_patient()
-    .snomedct_code
-)
-dataset.latest_ethnicity_group = dataset.latest_ethnicity_code.to_category(
-    ethnicity_codelist
-)
+dataset.latest_ethnicity_code = latest_ethnicity_code
+dataset.latest_ethnicity_group = latest_ethnicity_group
 
 # Add year of birth variable and categorise into bands 
 
-year_of_birth = (patients.date_of_birth).year
 dataset.year_of_birth = year_of_birth
-
-dataset.year_of_birth_band = case(
-    when((year_of_birth >= 1900) & (year_of_birth <= 1925)).then("1900-1925"),
-    when((year_of_birth > 1925) & (year_of_birth <= 1945)).then("1926-1945"),
-    when((year_of_birth > 1945) & (year_of_birth <= 1965)).then("1946-1965"),
-    when((year_of_birth > 1965) & (year_of_birth <= 1985)).then("1966-1985"),
-    when((year_of_birth > 1985) & (year_of_birth <= 2005)).then("1986-2005"),
-    when((year_of_birth > 2005) & (year_of_birth <= 2025)).then("2006-2025") 
-)
+dataset.year_of_birth_band = year_of_birth_band
 
 # Add MSOA 
 
@@ -9,39 +9,21 @@ from ehrql import create_dataset, codelist_from_csv, show, case, when, days, min
 from ehrql.tables.tpp import addresses, patients, practice_registrations, clinical_events, ons_deaths
 from datetime import date, datetime
 
-all_migrant_codes = codelist_from_csv(
-    "codelists/user-YaminaB-migration-status.csv", column="code"
+from analysis.create_cohorts.codelists import all_migrant_codes
+from analysis.create_cohorts.demographics import year_of_birth, year_of_birth_band
+from analysis.create_cohorts.inclusion_criteria import (
+    study_start_date,
+    study_end_date,
+    has_non_disclosive_sex,
+    is_alive_at_study_start,
+    was_not_over_100_at_study_start,
+    is_registered_for_km,
 )
 
-# Dates
-
-study_start_date = "2009-01-01"
-study_end_date = "2024-12-31"
-
 # Dataset definitions
 
-is_registered_during_study = (practice_registrations.where((practice_registrations.start_date.is_on_or_before(study_start_date) | 
-                                    practice_registrations.start_date.is_between_but_not_on(study_start_date, study_end_date)) &
-                                    ((practice_registrations.end_date.is_null()) | 
-                                     (practice_registrations.end_date.is_between_but_not_on(study_start_date, study_end_date)) |
-                                     (practice_registrations.end_date.is_on_or_after(study_end_date)))
-).exists_for_patient())           
-
-has_non_disclosive_sex = (
-    (patients.sex == "male") | (patients.sex == "female")
-)
-
-is_alive_at_study_start = (
-    ((patients.date_of_death >= study_start_date) | (patients.date_of_death.is_null())) &
-    ((ons_deaths.date >= study_start_date) | (ons_deaths.date.is_null()))
-)
-
-was_not_over_100_at_study_start = (
-    patients.age_on(study_start_date) <= 100
-)
-
 dataset = create_dataset()
-dataset.define_population(is_registered_during_study & 
+dataset.define_population(is_registered_for_km & 
                           has_non_disclosive_sex & 
                           is_alive_at_study_start & 
                           was_not_over_100_at_study_start)
@@ -136,16 +118,14 @@ dataset.sex = patients.sex
 
 # Year of birth
 
-year_of_birth = (patients.date_of_birth).year
 dataset.year_of_birth = year_of_birth
+dataset.year_of_birth_band = year_of_birth_band
 
-dataset.year_of_birth_band = case(
-    when((year_of_birth >= 1900) & (year_of_birth <= 1925)).then("1900-1925"),
-    when((year_of_birth > 1925) & (year_of_birth <= 1945)).then("1926-1945"),
-    when((year_of_birth > 1945) & (year_of_birth <= 1965)).then("1946-1965"),
-    when((year_of_birth > 1965) & (year_of_birth <= 1985)).then("1966-1985"),
-    when((year_of_birth > 1985) & (year_of_birth <= 2005)).then("1986-2005"),
-    when((year_of_birth > 2005) & (year_of_birth <= 2025)).then("2006-2025") 
+# Practice region (at first practice registration, the start of follow-up)
+
+dataset.region = (
+    practice_registrations.sort_by(practice_registrations.start_date)
+    .first_for_patient().practice_nuts1_region_name
 )
 
 
@@ -0,0 +1,43 @@
+# This is a script to create the patient feature table: the derivations that
+# several cohorts only need as output columns, built once rather than in each
+# of them:
+# - latest ethnicity (code and group, using the SNOMED:2022 codelist)
+# - year of birth and year of birth band
+#
+# The latest ethnicity is the costly one (a scan of clinical_events against
+# the ethnicity codelist); split_base_cohorts.py, split_census_cohorts.py and
+# cumulative_counts.py join these columns on by patient_id (see
+# patient_features.py). Dates the cohorts compute with, such as the first
+# practice registration and death dates, stay in the cohort definitions.
+#
+# It has a row for everyone with a practice registration that hadn't ended
+# before the start of the study, which covers every cohort. Locally,
+# analysis/lib/action_cache.py only rebuilds it when this definition, the
+# modules it imports, the codelists or the dummy tables change; its key
+# doesn't cover the backend extract, so in the backend it runs with the
+# other actions.
+
+from ehrql import create_dataset
+from ehrql.tables.tpp import practice_registrations
+
+from analysis.create_cohorts.demographics import latest_ethnicity_code, latest_ethnicity_group, year_of_birth, year_of_birth_band
+
+study_start_date = "2009-01-01"
+
+dataset = create_dataset()
+dataset.define_population(
+    practice_registrations.except_where(practice_registrations.end_date < study_start_date)
+    .exists_for_patient()
+)
+
+# Latest ethnicity
+
+dataset.latest_ethnicity_code = latest_ethnicity_code
+dataset.latest_ethnicity_group = latest_ethnicity_group
+
+# Year of birth and year of birth band
+
+dataset.year_of_birth = year_of_birth
+dataset.year_of_birth_band = year_of_birth_band
+
+dataset.configure_dummy_data(population_size=1000)
@@ -0,0 +1,40 @@
+## ehrQL variables that several definitions derive the same way, defined once:
+## - latest ethnicity (code and group, using the SNOMED:2022 codelist)
+## - year of birth and year of birth band
+##
+## The cohorts take them from the patient feature table
+## (dataset_definition_patient_features.py, joined on by the split scripts),
+## so only that definition evaluates them in the cohort pipeline. The others
+## that import them can't use the feature table: the annual counts measures
+## (generate-measures has no step after extraction to join it on), and the
+## single-cohort definitions that the benchmarks compare the combined
+## definitions against, which must give the same columns as the split files.
+####
+
+from ehrql import case, when
+from ehrql.tables.tpp import patients, clinical_events
+
+from analysis.create_cohorts.codelists import ethnicity_codelist
+
+# Latest ethnicity
+
+latest_ethnicity_code = (
+    clinical_events.where(clinical_events.snomedct_code.is_in(ethnicity_codelist))
+    .sort_by(clinical_events.date)
+    .last_for_patient()
+    .snomedct_code
+)
+latest_ethnicity_group = latest_ethnicity_code.to_category(ethnicity_codelist)
+
+# Year of birth and year of birth band
+
+year_of_birth = (patients.date_of_birth).year
+
+year_of_birth_band = case(
+    when((year_of_birth >= 1900) & (year_of_birth <= 1925)).then("1900-1925"),
+    when((year_of_birth > 1925) & (year_of_birth <= 1945)).then("1926-1945"),
+    when((year_of_birth > 1945) & (year_of_birth <= 1965)).then("1946-1965"),
+    when((year_of_birth > 1965) & (year_of_birth <= 1985)).then("1966-1985"),
+    when((year_of_birth > 1985) & (year_of_birth <= 2005)).then("1986-2005"),
+    when((year_of_birth > 2005) & (year_of_birth <= 2025)).then("2006-2025")
+)
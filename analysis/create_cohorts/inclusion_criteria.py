@@ -0,0 +1,52 @@
+## The inclusion criteria that the study-start cohorts share, defined once for
+## every definition that uses them: the full study, population denominator
+## and KM cohorts, their combined definition (dataset_definition_base_cohorts.py)
+## and full_study_cohort_row_per_code.py
+####
+
+from ehrql.tables.tpp import patients, practice_registrations, ons_deaths
+
+# Dates
+
+study_start_date = "2009-01-01"
+study_end_date = "2024-12-31"
+
+# Base population: non-disclosive sex, alive at the start of the study in
+# both patients and ons_deaths, not over 100 at the start of the study
+
+has_non_disclosive_sex = (
+    (patients.sex == "male") | (patients.sex == "female")
+)
+
+is_alive_at_study_start = (
+    ((patients.date_of_death >= study_start_date) | (patients.date_of_death.is_null())) &
+    ((ons_deaths.date >= study_start_date) | (ons_deaths.date.is_null()))
+)
+
+was_not_over_100_at_study_start = (
+    patients.age_on(study_start_date) <= 100
+)
+
+is_in_base_population = (
+    has_non_disclosive_sex &
+    is_alive_at_study_start &
+    was_not_over_100_at_study_start
+)
+
+# Full study and population denominator cohorts: a registration that is
+# ongoing or ended during the study
+
+is_registered_during_study = (
+    practice_registrations
+    .where((practice_registrations.end_date.is_null()) | ((practice_registrations.end_date.is_on_or_before(study_end_date)) & (practice_registrations.end_date.is_after(study_start_date))))
+    .exists_for_patient()
+)
+
+# KM cohort: a registration that overlaps the study
+
+is_registered_for_km = (practice_registrations.where((practice_registrations.start_date.is_on_or_before(study_start_date) |
+                                    practice_registrations.start_date.is_between_but_not_on(study_start_date, study_end_date)) &
+                                    ((practice_registrations.end_date.is_null()) |
+                                     (practice_registrations.end_date.is_between_but_not_on(study_start_date, study_end_date)) |
+                                     (practice_registrations.end_date.is_on_or_after(study_end_date)))
+).exists_for_patient())
@@ -0,0 +1,52 @@
+## Helpers to derive every migration-code variable from one filtered frame of
+## clinical_events, using the code -> category bitmask table rather than
+## filtering clinical_events against each codelist separately
+##
+## Each variable is still its own aggregation of that frame: ehrQL has no
+## aggregation that gives several values per patient (or ORs the category
+## masks together), so the first date and the count of a category can't come
+## from one. has_code() is the count compared with 0, so it is the same
+## aggregation as number_of_codes() rather than another one.
+####
+
+from ehrql.tables.tpp import clinical_events
+
+from analysis.lib.migration_categories import (
+    ASYLUM_REFUGEE,
+    COB,
+    INTERPRETER,
+    LANGUAGE,
+    MIGRANT,
+    category_table,
+    masks_including,
+)
+
+migration_category_table = category_table()
+
+# All events with a code from any of the migration-related codelists
+
+migration_events = clinical_events.where(
+    clinical_events.snomedct_code.is_in(migration_category_table)
+)
+
+
+def events_in_category(category, events=migration_events):
+    category_mask = events.snomedct_code.to_category(migration_category_table)
+    return events.where(category_mask.is_in(masks_including(category)))
+
+
+def number_of_codes(category, events=migration_events):
+    return events_in_category(category, events).count_for_patient()
+
+
+def has_code(category, events=migration_events):
+    # count_for_patient() is 0, never NULL, for patients with no codes
+    return number_of_codes(category, events) > 0
+
+
+def date_of_first_code(category, events=migration_events):
+    return (
+        events_in_category(category, events)
+        .sort_by(events.date)
+        .first_for_patient().date
+    )
@@ -0,0 +1,39 @@
+## Helpers to join the patient feature table (the output of
+## dataset_definition_patient_features.py) onto a cohort by patient_id.
+##
+## The feature table holds the derivations several cohorts only need as
+## output columns (latest ethnicity, year of birth and its band). A definition
+## leaves them out, and the script that post-processes its output adds them
+## with join_features(). A definition that needs one of them in a criterion or
+## another variable still derives it in ehrQL.
+####
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+PATIENT_FEATURES = "output/patient_features/patient_features.arrow"
+
+FEATURE_COLUMNS = [
+    "latest_ethnicity_code",
+    "latest_ethnicity_group",
+    "year_of_birth",
+    "year_of_birth_band",
+]
+
+
+def read_features(path=PATIENT_FEATURES, columns=FEATURE_COLUMNS):
+    return feather.read_table(path, columns=["patient_id", *columns])
+
+
+def join_features(table, features, columns):
+    """Add `columns` of the feature table to `table`, matched on patient_id
+    (missing for patients the feature table doesn't have). The rows of
+    `table` keep their order."""
+    rows = pc.index_in(table.column("patient_id"), features.column("patient_id"))
+    for column in columns:
+        if column in table.column_names:
+            raise ValueError(f"{column} is already in the table")
+        values = features.column(column).take(rows)
+        table = table.append_column(pa.field(column, values.type), values)
+    return table
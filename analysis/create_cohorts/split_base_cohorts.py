@@ -0,0 +1,71 @@
+## Script to split the output of dataset_definition_base_cohorts.py into the
+## full study, population denominator and KM cohort files. Each file has the
+## same columns, in the same order, as its single-cohort definition gives: the
+## latest ethnicity and year of birth columns are joined on from the patient
+## feature table.
+####
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from patient_features import PATIENT_FEATURES, join_features, read_features
+
+# output file -> (membership column, columns in order); a (name, source)
+# pair takes the column from a differently named one in the combined file
+COHORTS = {
+    "full_study_cohort.arrow": ("in_full_study_cohort", [
+        "patient_id", "date_of_first_migration_code", "number_of_migration_codes", "sex",
+        "has_cob_migrant_code", "has_asylum_or_refugee_migrant_code", "has_interpreter_migrant_code",
+        "date_of_first_practice_registration", "time_to_first_migration_code",
+        "latest_ethnicity_code", "latest_ethnicity_group", "year_of_birth", "year_of_birth_band",
+        "msoa_code", "imd_decile", "imd_quintile", "region", "TPP_death_date", "ons_death_date",
+    ]),
+    "population_denominator_cohort.arrow": ("in_population_denominator_cohort", [
+        "patient_id", "sex", "latest_ethnicity_code", "year_of_birth", "year_of_birth_band",
+        "msoa_code", "imd_decile", "imd_quintile", "region", "TPP_death_date", "ons_death_date",
+    ]),
+    "km_time_to_first_migration_code_cohort.arrow": ("in_km_cohort", [
+        "patient_id", "date_of_first_practice_registration", "baseline_date", "date_of_deregistration",
+        "TPP_death_date", "ons_death_date", "censor_date", "has_a_migration_code",
+        "date_of_first_migration_code", "processed_first_migration_code_date",
+        "number_of_migration_codes", "sex", "year_of_birth", "year_of_birth_band",
+        ("region", "region_at_first_registration"),
+    ]),
+}
+
+# columns that come from the patient feature table
+JOINED_COLUMNS = ["latest_ethnicity_code", "latest_ethnicity_group", "year_of_birth", "year_of_birth_band"]
+
+
+def split_base_cohorts(table, features):
+    """Return {file name: cohort table} from the combined base cohorts table
+    and the patient feature table."""
+    table = join_features(table, features, JOINED_COLUMNS)
+    cohorts = {}
+    for file_name, (membership_column, columns) in COHORTS.items():
+        names = [column if isinstance(column, str) else column[0] for column in columns]
+        sources = [column if isinstance(column, str) else column[1] for column in columns]
+        in_cohort = pc.fill_null(table.column(membership_column), False)
+        cohorts[file_name] = table.filter(in_cohort).select(sources).rename_columns(names)
+    return cohorts
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default="output/cohorts/base_cohorts.arrow")
+    parser.add_argument("--features", default=PATIENT_FEATURES)
+    parser.add_argument("--output-dir", default="output/cohorts")
+    args = parser.parse_args()
+
+    table = feather.read_table(args.input)
+    features = read_features(args.features, JOINED_COLUMNS)
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    for file_name, cohort in split_base_cohorts(table, features).items():
+        feather.write_feather(cohort, Path(args.output_dir) / file_name)
+
+
+if __name__ == "__main__":
+    main()
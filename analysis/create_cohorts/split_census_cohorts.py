@@ -0,0 +1,78 @@
+## Script to split the output of dataset_definition_census_cohorts.py (for one
+## or more census dates) into one cohort file per census, with the census
+## year suffixes dropped (the latest ethnicity and year of birth columns are
+## joined on from the patient feature table)
+####
+
+import re
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.create_cohorts.patient_features import PATIENT_FEATURES, join_features, read_features
+
+MEMBERSHIP_COLUMN = re.compile(r"^in_census_cohort_(\d{4})$")
+
+# columns that come from the patient feature table, and the column they follow
+JOINED_COLUMNS = ["latest_ethnicity_code", "latest_ethnicity_group", "year_of_birth", "year_of_birth_band"]
+JOINED_AFTER = "time_to_first_migration_code"
+
+
+def with_features(table, features):
+    table = join_features(table, features, JOINED_COLUMNS)
+    names = [name for name in table.column_names if name not in JOINED_COLUMNS]
+    position = names.index(JOINED_AFTER) + 1
+    return table.select(names[:position] + JOINED_COLUMNS + names[position:])
+
+
+def census_years(table):
+    return [
+        match.group(1)
+        for match in map(MEMBERSHIP_COLUMN.match, table.column_names)
+        if match
+    ]
+
+
+def split_census_cohorts(table):
+    """Return {census year: cohort table} from the combined census table."""
+    years = census_years(table)
+    if not years:
+        raise ValueError("no in_census_cohort_<year> columns: is this dataset_definition_census_cohorts.py's output?")
+    suffixes = tuple(f"_{year}" for year in years)
+    cohorts = {}
+    for year in years:
+        suffix = f"_{year}"
+        columns = [
+            name for name in table.column_names
+            if not MEMBERSHIP_COLUMN.match(name)
+            and (name.endswith(suffix) or not name.endswith(suffixes))
+        ]
+        in_cohort = pc.fill_null(table.column(f"in_census_cohort{suffix}"), False)
+        cohort = table.filter(in_cohort).select(columns)
+        cohorts[year] = cohort.rename_columns([name.removesuffix(suffix) for name in columns])
+    return cohorts
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default="output/cohorts/census_cohorts.arrow")
+    parser.add_argument("--features", default=PATIENT_FEATURES)
+    parser.add_argument("--output-dir", default="output/cohorts")
+    args = parser.parse_args()
+
+    table = with_features(feather.read_table(args.input), read_features(args.features, JOINED_COLUMNS))
+    Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+    for year, cohort in split_census_cohorts(table).items():
+        feather.write_feather(cohort, Path(args.output_dir) / f"census_{year}_study_cohort.arrow")
+
+
+if __name__ == "__main__":
+    main()
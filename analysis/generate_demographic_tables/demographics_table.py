@@ -0,0 +1,378 @@
+####
+# A script for creating demographic tables (in the layout gtsummary's
+# tbl_summary gave them in the R scripts this replaces, demographics_table.r
+# and demographics_population_table.r) from a cohort .arrow file, without
+# loading the cohort into memory:
+# - the cohort is memory-mapped and read one record batch at a time
+# - the sub-cohorts (country of birth, interpreter, asylum seeker or refugee)
+#   are overlapping labels rather than copies of the cohort: every row gets a
+#   bitmask of the labels it has, and each stratum is counted once per
+#   (value, bitmask), so a patient with several codes isn't duplicated
+# - continuous variables are kept as counts of each value, so the medians and
+#   quartiles are exact; a column with too many distinct values for that (such
+#   as patient_id) has its quartiles found by re-reading it instead
+# Memory depends on the number of distinct values, not the number of patients.
+#
+# As in the R scripts, the subgroup tables summarise every column but the ones
+# demographics_table.r dropped, and the population denominator table
+# (--no-subgroups) summarises every column. Columns are typed as tbl_summary
+# does: strings are categorical, logicals and 0/1 numbers dichotomous, dates
+# continuous, and numbers continuous unless they have fewer than 10 values.
+#
+# Usage (from the repo root):
+#   python analysis/generate_demographic_tables/demographics_table.py <cohort_file> <output_file> [--no-subgroups]
+###
+
+import csv
+import math
+import sys
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib.arrow_files import decoded, iter_batches, read_schema
+
+# label -> (flag column, flag value) that puts a patient in it (None: everyone).
+# demographics_table.r filtered has_interpreter_migrant_code and
+# has_asylum_or_refugee_migrant_code == "FALSE", which put the patients
+# *without* those codes in the Interpreter and Asylum seeker or refugee columns
+SUBGROUPS = {
+    "All migrants": None,
+    "Country of birth": ("has_cob_migrant_code", True),
+    "Interpreter": ("has_interpreter_migrant_code", True),
+    "Asylum seeker or refugee": ("has_asylum_or_refugee_migrant_code", True),
+}
+
+# columns demographics_table.r dropped before summarising the subgroup tables
+NOT_SUMMARISED = [
+    "patient_id", "latest_ethnicity_code", "date_of_first_migration_code", "year_of_birth",
+    "TPP_death_date", "ons_death_date", "date_of_first_practice_registration", "msoa_code",
+    "imd_decile", "has_cob_migrant_code", "has_asylum_or_refugee_migrant_code",
+    "has_interpreter_migrant_code",
+]
+
+# columns demographics_table.r set to NA where blank
+BLANK_AS_MISSING = ["latest_ethnicity_group", "region"]
+
+# tbl_summary summarises numbers with fewer distinct values as categorical
+MIN_CONTINUOUS_VALUES = 10
+
+# integer and date columns with more distinct values than this stop being
+# counted by value; their quartiles are found by re-reading the column,
+# narrowing down to each quartile's value SELECTION_BUCKETS-fold per pass
+MAX_VALUE_COUNTS = 100_000
+SELECTION_BUCKETS = 2**16
+
+MISSING_LABEL = "Unknown"
+
+
+def _kind(data_type):
+    if pa.types.is_dictionary(data_type):
+        data_type = data_type.value_type
+    if pa.types.is_boolean(data_type):
+        return "logical"
+    if pa.types.is_date(data_type):
+        return "date"
+    if pa.types.is_integer(data_type):
+        return "integer"
+    if pa.types.is_floating(data_type):
+        return "number"
+    return "string"
+
+
+def _blank_to_null(column):
+    # as the R version did with trimws(...) == ""
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pc.if_else(pc.equal(pc.utf8_trim_whitespace(column), ""), None, column)
+    return column
+
+
+def _values(batch, name, kind, blank_as_missing):
+    column = decoded(batch.column(name))
+    if kind == "date":
+        # counted as days since 1970-01-01
+        return column.cast(pa.date32()).cast(pa.int32())
+    if name in blank_as_missing:
+        return _blank_to_null(column)
+    return column
+
+
+def label_masks(batch, subgroups):
+    """Bitmask of the subgroups each row belongs to (bit i = subgroup i)."""
+    masks = np.zeros(batch.num_rows, dtype=np.int64)
+    for i, flag in enumerate(subgroups.values()):
+        if flag is None:
+            masks |= 1 << i
+        else:
+            column, value = flag
+            # a missing flag is in neither subgroup, as R's filter() drops NAs
+            member = pc.fill_null(pc.equal(batch.column(column), value), False)
+            masks |= np.where(member.to_numpy(zero_copy_only=False), 1 << i, 0)
+    return masks
+
+
+def column_weights(masks, subgroups):
+    """How many times each row counts in each column of the table: once in
+    each subgroup it is in and, as add_overall() over the stacked sub-cohorts
+    did in the R version, once in the overall column for each of those. With
+    no subgroups there is one column of everyone."""
+    masks = np.asarray(masks, dtype=np.int64)
+    if not subgroups:
+        return np.ones((len(masks), 1), dtype=np.int64)
+    members = (masks[:, None] >> np.arange(len(subgroups))) & 1
+    return np.column_stack([members.sum(axis=1), members])
+
+
+def summarised_columns(schema, subgroups):
+    if not subgroups:
+        return list(schema.names)
+    return [name for name in schema.names if name not in NOT_SUMMARISED]
+
+
+def tabulate(path, subgroups=SUBGROUPS):
+    """Count, for each summarised column, every (value, subgroup bitmask) in
+    the cohort. Returns (kinds, counts, missing, ranges, rows): {column: kind},
+    {column: Counter of (value, mask), or None once it has too many values},
+    {column: Counter of masks of rows with no value}, {column: (min, max)} of
+    integer and date columns, and a Counter of every row's mask."""
+    schema = read_schema(path)
+    names = summarised_columns(schema, subgroups)
+    kinds = {name: _kind(schema.field(name).type) for name in names}
+    blank_as_missing = BLANK_AS_MISSING if subgroups else []
+    counts = {name: Counter() for name in names}
+    missing = {name: Counter() for name in names}
+    ranges = {}
+    rows = Counter()
+
+    for batch in iter_batches(path):
+        masks = label_masks(batch, subgroups) if subgroups else np.ones(batch.num_rows, dtype=np.int64)
+        rows.update(dict(zip(*np.unique(masks, return_counts=True))))
+        for name in names:
+            values = _values(batch, name, kinds[name], blank_as_missing)
+            if kinds[name] in ("integer", "date"):
+                min_max = pc.min_max(values)
+                if min_max["min"].is_valid:
+                    low, high = min_max["min"].as_py(), min_max["max"].as_py()
+                    low_so_far, high_so_far = ranges.get(name, (low, high))
+                    ranges[name] = (min(low, low_so_far), max(high, high_so_far))
+
+            valid = pc.is_valid(values).to_numpy(zero_copy_only=False)
+            missing[name].update(dict(zip(*np.unique(masks[~valid], return_counts=True))))
+            if counts[name] is None:
+                continue
+            grouped = pa.table({"value": values, "mask": masks}).filter(pa.array(valid)).group_by(
+                ["value", "mask"]
+            ).aggregate([([], "count_all")])
+            for row in grouped.to_pylist():
+                counts[name][(row["value"], row["mask"])] += row["count_all"]
+            if kinds[name] in ("integer", "date") and len(counts[name]) > MAX_VALUE_COUNTS:
+                counts[name] = None
+    return kinds, counts, missing, ranges, rows
+
+
+def _by_column(counter, subgroups):
+    """Collapse {(value, mask): n} into {value: [n in each table column]}."""
+    items = list(counter.items())
+    if not items:
+        return {}
+    masks = np.array([mask for (_, mask), _ in items], dtype=np.int64)
+    ns = np.array([n for _, n in items], dtype=np.int64)
+    weighted = column_weights(masks, subgroups) * ns[:, None]
+    by_value = defaultdict(lambda: np.zeros(weighted.shape[1], dtype=np.int64))
+    for ((value, _), _), row in zip(items, weighted):
+        by_value[value] = by_value[value] + row
+    return {value: [int(n) for n in row] for value, row in by_value.items()}
+
+
+def _column_totals(mask_counts, subgroups):
+    """The number of rows counted in each table column, from a Counter of
+    row masks."""
+    n_columns = len(subgroups) + 1 if subgroups else 1
+    if not mask_counts:
+        return [0] * n_columns
+    masks = np.array(list(mask_counts), dtype=np.int64)
+    ns = np.array(list(mask_counts.values()), dtype=np.int64)
+    return [int(n) for n in (column_weights(masks, subgroups) * ns[:, None]).sum(axis=0)]
+
+
+def _ranks(n, p):
+    # the 1-based ranks R's quantile(type = 2) takes (or averages) of n values
+    position = n * p
+    if position == int(position):
+        return [int(position), int(position) + 1]
+    return [math.ceil(position)]
+
+
+def _quantile(value_counts, p):
+    """R's quantile(type = 2) (the median, for p = 0.5) from value counts."""
+    values = sorted(value_counts)
+    total = sum(value_counts.values())
+    position = total * p
+    cumulative = 0
+    for i, value in enumerate(values):
+        cumulative += value_counts[value]
+        if cumulative > position:
+            return value
+        if cumulative == position:
+            # on a discontinuity: average with the next value
+            return (value + values[i + 1]) / 2 if i + 1 < len(values) else value
+    return values[-1]
+
+
+def _values_at_ranks(path, name, kind, subgroups, j, ranks, low, high):
+    """The values of an integer or date column at 1-based `ranks` among the
+    rows counted in table column j, without counting every value: each pass
+    over the file narrows a window around each rank SELECTION_BUCKETS-fold."""
+    windows = {rank: (low, high) for rank in ranks}
+    while any(lo < hi for lo, hi in windows.values()):
+        narrowing = {rank: window for rank, window in windows.items() if window[0] < window[1]}
+        widths = {rank: -(-(hi - lo + 1) // SELECTION_BUCKETS) for rank, (lo, hi) in narrowing.items()}
+        below = dict.fromkeys(narrowing, 0)
+        histograms = {rank: np.zeros(SELECTION_BUCKETS) for rank in narrowing}
+        for batch in iter_batches(path):
+            values = _values(batch, name, kind, [])
+            weights = column_weights(label_masks(batch, subgroups), subgroups)[:, j] if subgroups else None
+            valid = pc.is_valid(values).to_numpy(zero_copy_only=False)
+            values = pc.fill_null(values, 0).to_numpy(zero_copy_only=False).astype(np.int64)
+            weights = np.where(valid, 1 if weights is None else weights, 0)
+            for rank, (lo, hi) in narrowing.items():
+                below[rank] += weights[values < lo].sum()
+                inside = (values >= lo) & (values <= hi)
+                histograms[rank] += np.bincount(
+                    (values[inside] - lo) // widths[rank], weights=weights[inside], minlength=SELECTION_BUCKETS
+                )
+        for rank, (lo, hi) in narrowing.items():
+            bucket = int(np.searchsorted(np.cumsum(histograms[rank]) + below[rank], rank))
+            start = lo + bucket * widths[rank]
+            windows[rank] = (start, min(hi, start + widths[rank] - 1))
+    return [windows[rank][0] for rank in ranks]
+
+
+def _number(x):
+    if x == int(x):
+        return f"{int(x):,}"
+    return f"{x:,.1f}"
+
+
+def _format(value, kind):
+    if kind == "date":
+        return str(np.datetime64(math.floor(value), "D"))
+    return _number(value)
+
+
+def _percent(n, total):
+    # as gtsummary's style_percent()
+    p = n / total if total else 0
+    if n == 0:
+        return "0"
+    if p >= 0.1:
+        return f"{p * 100:.0f}"
+    if p >= 0.001:
+        return f"{p * 100:.1f}"
+    return "<0.1"
+
+
+def summary_type(kind, values):
+    """tbl_summary's default type for a column with these (non-missing) values."""
+    if kind == "logical":
+        return "dichotomous"
+    if kind == "string":
+        return "categorical"
+    if kind == "date" or values is None:
+        return "continuous"
+    if values and set(values) <= {0, 1}:
+        return "dichotomous"
+    if len(values) < MIN_CONTINUOUS_VALUES:
+        return "categorical"
+    return "continuous"
+
+
+def _quartiles(path, name, kind, subgroups, counts, non_missing, ranges, j):
+    if counts is not None:
+        value_counts = {value: ns[j] for value, ns in counts.items() if ns[j]}
+        return [_quantile(value_counts, p) for p in (0.5, 0.25, 0.75)]
+    quartiles = []
+    for p in (0.5, 0.25, 0.75):
+        ranks = _ranks(non_missing, p)
+        values = _values_at_ranks(path, name, kind, subgroups, j, ranks, *ranges[name])
+        quartiles.append(sum(values) / len(values) if len(values) > 1 else values[0])
+    return quartiles
+
+
+def table_rows(path, subgroups, tabulated):
+    kinds, counts, missing, ranges, rows_by_mask = tabulated
+    column_totals = _column_totals(rows_by_mask, subgroups)
+    n_columns = len(column_totals)
+    rows = []
+    for name, kind in kinds.items():
+        by_value = None if counts[name] is None else _by_column(counts[name], subgroups)
+        n_missing = _column_totals(missing[name], subgroups)
+        non_missing = [total - n for total, n in zip(column_totals, n_missing)]
+        label = f"__{name}__"
+
+        summary = summary_type(kind, by_value)
+        if summary == "continuous":
+            statistics = []
+            for j in range(n_columns):
+                if not non_missing[j]:
+                    statistics.append("NA (NA-NA)")
+                    continue
+                median, lower, upper = (
+                    _format(q, kind)
+                    for q in _quartiles(path, name, kind, subgroups, by_value, non_missing[j], ranges, j)
+                )
+                statistics.append(f"{median} ({lower}-{upper})")
+            rows.append([label, *statistics])
+        elif summary == "dichotomous":
+            ns = by_value.get(True, by_value.get(1, [0] * n_columns))
+            rows.append([label, *[f"{n:,} ({_percent(n, non_missing[j])}%)" for j, n in enumerate(ns)]])
+        else:
+            rows.append([label, *[""] * n_columns])
+            for value in sorted(by_value):
+                ns = by_value[value]
+                rows.append([str(value), *[f"{n:,} ({_percent(n, non_missing[j])}%)" for j, n in enumerate(ns)]])
+
+        if any(n_missing):
+            rows.append([MISSING_LABEL, *[f"{n:,}" for n in n_missing]])
+    return column_totals, rows
+
+
+def write_demographics_table(cohort_file, output_file, subgroups=SUBGROUPS):
+    column_totals, rows = table_rows(cohort_file, subgroups, tabulate(cohort_file, subgroups))
+
+    if subgroups:
+        header = ["**Characteristic**", f"**Overall**  \nN = {column_totals[0]:,}"] + [
+            f"**{label}**  \nN = {n:,}" for label, n in zip(subgroups, column_totals[1:])
+        ]
+    else:
+        header = ["**Characteristic**", f"**N = {column_totals[0]:,}**"]
+
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("cohort_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--no-subgroups", action="store_true",
+                        help="summarise the whole cohort only (e.g. the population denominator)")
+    args = parser.parse_args()
+
+    write_demographics_table(args.cohort_file, args.output_file, {} if args.no_subgroups else SUBGROUPS)
+
+
+if __name__ == "__main__":
+    main()
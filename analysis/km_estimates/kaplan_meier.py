@@ -0,0 +1,220 @@
+# script to estimate time from first practice registration to first migration
+# code (Kaplan-Meier), overall and stratified, from the KM cohort
+# (dataset_definition_km_time_to_first_migration_code.py)
+#
+# - follow-up runs from baseline_date to processed_first_migration_code_date
+#   (the event) or censor_date, whichever comes first, as in the
+#   kaplan-meier-function action
+# - only the needed columns are read, and the date columns straight out of the
+#   memory-mapped .arrow file as day numbers, without converting to dates.
+#   project.yaml gives it the uncompressed cohort written by
+#   split_base_cohorts.py, so nothing needs decompressing
+# - every stratification (overall, sex, year of birth band, region...) is
+#   stacked into one array of (stratification, stratum, time) keys and
+#   estimated in a single sort, with the survival curves from cumulative sums
+#   and products that restart at each stratum
+# - counts are rounded as the kaplan-meier-function action does with
+#   min_count: cumulative events and censorings are rounded up to a multiple of
+#   min_count, and the survival estimates are calculated from the rounded counts
+#
+# Usage (from the repo root):
+#   python analysis/km_estimates/kaplan_meier.py [--input ...] [--output ...] \
+#       [--strata "" sex year_of_birth_band region "sex,region"] [--min-count 6]
+
+import sys
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+if not __package__:
+    # run as a script (as the python:latest action does): the helpers below
+    # are imported from the repo root
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from analysis.lib.rounding import MIN_COUNT, roundmid_any
+
+KM_COHORT = "output/cohorts/km_time_to_first_migration_code_cohort.arrow"
+OUTPUT_FILE = "output/km_estimates/estimates_stratified.csv"
+
+ORIGIN_DATE = "baseline_date"
+EVENT_DATE = "processed_first_migration_code_date"
+CENSOR_DATE = "censor_date"
+
+# "" is the overall (unstratified) curve; a comma joins variables
+STRATA = ["", "sex", "year_of_birth_band", "region"]
+
+Z = 1.959964  # 95% confidence intervals
+
+
+def read_columns(path, columns):
+    """Read the needed columns of an Arrow IPC file from a memory map. Date
+    columns come back as (days, missing) numpy arrays; others as arrays of
+    strings (None where missing).
+
+    Only those columns are read: in a compressed file, the other columns'
+    buffers are never decompressed."""
+    with pa.memory_map(str(path), "r") as source:
+        schema = pa.ipc.open_file(source).schema
+        options = pa.ipc.IpcReadOptions(included_fields=[schema.get_field_index(name) for name in columns])
+        table = pa.ipc.open_file(source, options=options).read_all().select(columns)
+    result = {}
+    for name in columns:
+        column = table.column(name).combine_chunks()
+        if pa.types.is_date32(column.type):
+            # the date32 values buffer is int32 day numbers: read it in place
+            days = np.frombuffer(column.buffers()[1], dtype=np.int32)[
+                column.offset:column.offset + len(column)
+            ]
+            result[name] = (days.astype(np.int64), ~pc.is_valid(column).to_numpy(zero_copy_only=False))
+        else:
+            if pa.types.is_dictionary(column.type):
+                column = column.dictionary_decode()
+            result[name] = column.to_numpy(zero_copy_only=False)
+    return result
+
+
+def time_to_event(origin, event, censor):
+    """Days from origin to the event or censoring (whichever is first), whether
+    the event happened, and which rows have usable follow-up."""
+    (origin, missing_origin), (event, missing_event), (censor, missing_censor) = origin, event, censor
+    had_event = ~missing_event & (missing_censor | (event <= censor))
+    end = np.where(had_event, event, censor)
+    time = end - origin
+    usable = ~missing_origin & (had_event | ~missing_censor) & (time >= 0)
+    return time, had_event, usable
+
+
+def _ceiling_any(x, to):
+    return np.ceil(x / to) * to
+
+
+def _restart_cumsum(values, group_start):
+    """Cumulative sum that restarts where group_start is True."""
+    total = np.cumsum(values)
+    group_first = np.maximum.accumulate(np.where(group_start, np.arange(len(values)), 0))
+    return total - (total - values)[group_first]
+
+
+def estimate(time, had_event, keys, min_count=MIN_COUNT):
+    """Kaplan-Meier estimates for each stratum (rows of `keys`, an integer
+    array per row giving its stratum) at each time with an event or censoring.
+
+    Returns a DataFrame of stratum, time, n_risk, n_event, n_censor, surv,
+    surv_se, surv_ll and surv_ul.
+    """
+    # one row per (stratum, time) with the events and censorings at that time
+    order = np.lexsort([time, keys])
+    keys, time, had_event = keys[order], time[order], had_event[order]
+    new_step = np.r_[True, (keys[1:] != keys[:-1]) | (time[1:] != time[:-1])]
+    step = np.cumsum(new_step) - 1
+    step_key, step_time = keys[new_step], time[new_step]
+    n_event = np.bincount(step, weights=had_event, minlength=len(step_key))
+    n_total = np.bincount(step, minlength=len(step_key)).astype(float)
+    n_censor = n_total - n_event
+
+    stratum_start = np.r_[True, step_key[1:] != step_key[:-1]]
+    stratum = np.cumsum(stratum_start) - 1
+    n = np.bincount(stratum, weights=n_total)[stratum]
+
+    cml_event = _restart_cumsum(n_event, stratum_start)
+    cml_censor = _restart_cumsum(n_censor, stratum_start)
+    if min_count:
+        cml_event = _ceiling_any(cml_event, min_count)
+        cml_censor = _ceiling_any(cml_censor, min_count)
+        n = roundmid_any(n, min_count)
+        previous_event = np.where(stratum_start, 0, np.r_[0, cml_event[:-1]])
+        previous_censor = np.where(stratum_start, 0, np.r_[0, cml_censor[:-1]])
+        n_event = cml_event - previous_event
+        n_censor = cml_censor - previous_censor
+    # at risk: everyone in the stratum minus those who left at earlier times
+    left_before = np.where(stratum_start, 0, np.r_[0, (cml_event + cml_censor)[:-1]])
+    n_risk = n - left_before
+
+    # drop the steps that rounding has emptied
+    keep = (n_event > 0) | (n_censor > 0)
+    step_key, step_time = step_key[keep], step_time[keep]
+    n_risk, n_event, n_censor = n_risk[keep], n_event[keep], n_censor[keep]
+    stratum_start = np.r_[True, step_key[1:] != step_key[:-1]]
+
+    # the product of (1 - n_event / n_risk) as a sum of logs; once everyone
+    # left at risk has had the event the curve stays at 0
+    everyone = n_event >= n_risk
+    reached_zero = _restart_cumsum(everyone, stratum_start) > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_step = np.where(everyone, 0.0, np.log1p(-n_event / n_risk))
+        variance_step = np.where(everyone, 0.0, n_event / (n_risk * (n_risk - n_event)))
+    log_surv = _restart_cumsum(log_step, stratum_start)
+    greenwood = _restart_cumsum(variance_step, stratum_start)
+    surv = np.where(reached_zero, 0.0, np.exp(log_surv))
+    surv_se = surv * np.sqrt(greenwood)
+    # log-transformed confidence intervals, as survfit's default
+    surv_ll = np.where(reached_zero, np.nan, np.exp(log_surv - Z * np.sqrt(greenwood)))
+    surv_ul = np.where(reached_zero, np.nan, np.minimum(np.exp(log_surv + Z * np.sqrt(greenwood)), 1))
+
+    return pd.DataFrame({
+        "stratum": step_key,
+        "time": step_time,
+        "n_risk": n_risk.astype(np.int64),
+        "n_event": n_event.astype(np.int64),
+        "n_censor": n_censor.astype(np.int64),
+        "surv": surv,
+        "surv_se": surv_se,
+        "surv_ll": surv_ll,
+        "surv_ul": surv_ul,
+    })
+
+
+def stratify(columns, strata, usable):
+    """Stack every stratification into one set of keys: returns (row index
+    into the cohort, stratum key) for every (row, stratification), and a
+    DataFrame describing each stratum key."""
+    rows, keys, labels = [], [], []
+    for stratification in strata:
+        variables = [name for name in stratification.split(",") if name]
+        if variables:
+            values = np.stack(
+                [np.where(pd.isna(columns[name]), "missing", columns[name]).astype(str) for name in variables]
+            ).T
+            levels, codes = np.unique(values, axis=0, return_inverse=True)
+            codes = codes.ravel()
+        else:
+            levels, codes = np.empty((1, 0), dtype=str), np.zeros(len(usable), dtype=np.int64)
+        offset = len(labels)
+        for level in levels:
+            labels.append({"strata": stratification or "overall", **dict(zip(variables, level))})
+        rows.append(np.flatnonzero(usable))
+        keys.append(codes[usable] + offset)
+    return np.concatenate(rows), np.concatenate(keys), pd.DataFrame(labels)
+
+
+def kaplan_meier(path, strata=STRATA, min_count=MIN_COUNT):
+    variables = sorted({name for stratification in strata for name in stratification.split(",") if name})
+    columns = read_columns(path, [ORIGIN_DATE, EVENT_DATE, CENSOR_DATE, *variables])
+    time, had_event, usable = time_to_event(columns[ORIGIN_DATE], columns[EVENT_DATE], columns[CENSOR_DATE])
+
+    rows, keys, labels = stratify(columns, strata, usable)
+    estimates = estimate(time[rows], had_event[rows], keys, min_count)
+    estimates = labels.iloc[estimates.pop("stratum")].reset_index(drop=True).join(estimates)
+    return estimates
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--input", default=KM_COHORT)
+    parser.add_argument("--output", default=OUTPUT_FILE)
+    parser.add_argument("--strata", nargs="+", default=STRATA,
+                        help='stratifications ("" for overall; join variables with a comma)')
+    parser.add_argument("--min-count", type=int, default=MIN_COUNT)
+    args = parser.parse_args()
+
+    estimates = kaplan_meier(args.input, args.strata, args.min_count)
+    Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+    estimates.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+## Local, content-addressed cache for the ehrQL actions in project.yaml
+##
+## An action's outputs are stored under a key made from the hash of
+##   - its dataset/measures definition,
+##   - every local module that definition imports (followed recursively),
+##   - the codelist CSVs those files refer to,
+##   - any other data file they name by path (e.g. analysis/lib/study-dates.json),
+##   - the action's arguments, and
+##   - with --dummy-tables, the name, size and modification time of every table
+## so re-running an action whose inputs haven't changed just restores the
+## stored outputs instead of regenerating them.
+##
+## The key doesn't cover the data an action runs against in the backend:
+## outputs cached from one extract would be restored for the next, so this is
+## only for local runs against dummy tables.
+##
+## Usage (from the repo root):
+##   python -m analysis.lib.action_cache generate_dataset_for_census_cohorts \
+##       [--dummy-tables dummy_tables] [--force]
+####
+
+import argparse
+import ast
+import glob
+import hashlib
+import json
+import logging
+import shlex
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+from analysis.lib.codelist_registry import CODELISTS, codelist_path, file_sha
+
+PROJECT_FILE = Path("project.yaml")
+CACHE_DIR = Path(".cache") / "actions"
+LOG_FILE = Path("logs") / "action_cache.log"
+REGISTRY_MODULE = Path("analysis/lib/codelist_registry.py")
+
+# ehrQL commands whose outputs depend only on the definition and its arguments
+CACHEABLE_COMMANDS = {"generate-dataset", "generate-measures"}
+
+logger = logging.getLogger("action_cache")
+
+
+def load_action(name, project_file=PROJECT_FILE):
+    # only needed here, so that definition_fingerprint() can be used where
+    # PyYAML isn't installed
+    import yaml
+
+    with open(project_file) as f:
+        actions = yaml.safe_load(f)["actions"]
+    if name not in actions:
+        raise KeyError(f"No action called {name!r} in {project_file}")
+    action = actions[name]
+
+    image, command, definition, *args = shlex.split(action["run"])
+    if not image.startswith("ehrql:") or command not in CACHEABLE_COMMANDS:
+        raise ValueError(f"{name} is not an ehrQL generate-dataset/generate-measures action")
+
+    output_patterns = [
+        pattern
+        for outputs in action["outputs"].values()
+        for pattern in outputs.values()
+    ]
+    return {
+        "name": name,
+        "image": image,
+        "command": command,
+        "definition": Path(definition),
+        "args": args,
+        "output_patterns": output_patterns,
+    }
+
+
+def _resolve_module(module, importing_file):
+    # modules are either imported relative to the repo root
+    # (analysis.create_cohorts.codelists) or, as ehrQL puts the definition's
+    # directory on the path, relative to the importing file (utilities)
+    relative = Path(*module.split("."))
+    for base in (Path("."), importing_file.parent):
+        for candidate in (base / f"{relative}.py", base / relative / "__init__.py"):
+            if candidate.exists():
+                return candidate
+    return None
+
+
+def local_dependencies(definition):
+    """Return the definition and every local module it imports, recursively."""
+    seen = set()
+    to_visit = [Path(definition)]
+    while to_visit:
+        path = to_visit.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        tree = ast.parse(path.read_text(), filename=str(path))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+            else:
+                continue
+            for module in modules:
+                resolved = _resolve_module(module, path)
+                if resolved is not None:
+                    to_visit.append(resolved)
+    return sorted(seen)
+
+
+def codelist_dependencies(sources):
+    """Return the codelist files referred to, by name or filename, in any of
+    the given sources (other than the registry itself, which names them all)."""
+    text = "\n".join(
+        path.read_text() for path in sources if path.resolve() != REGISTRY_MODULE.resolve()
+    )
+    return sorted(
+        codelist_path(name)
+        for name, (filename, _, _) in CODELISTS.items()
+        if name in text or filename in text
+    )
+
+
+def data_dependencies(sources):
+    """Return the files other than Python modules that any of the given
+    sources names by a literal path, such as the study dates a definition
+    open()s."""
+    paths = set()
+    for path in sources:
+        for node in ast.walk(ast.parse(path.read_text(), filename=str(path))):
+            if isinstance(node, ast.Constant) and isinstance(node.value, str) and "\n" not in node.value:
+                candidate = Path(node.value)
+                if candidate.suffix and candidate.suffix != ".py" and candidate.is_file():
+                    paths.add(candidate)
+    return sorted(paths)
+
+
+def tables_stamp(tables_dir):
+    """{file name: [size, modification time]} of every file in a directory of
+    tables, to tell when they have been regenerated."""
+    return {
+        path.name: [path.stat().st_size, path.stat().st_mtime_ns]
+        for path in sorted(Path(tables_dir).iterdir()) if path.is_file()
+    }
+
+
+def dummy_tables_dir(args):
+    """The --dummy-tables directory in an action's arguments, if any."""
+    for i, arg in enumerate(args):
+        if arg == "--dummy-tables" and i + 1 < len(args):
+            return args[i + 1]
+        if arg.startswith("--dummy-tables="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+def _inputs_digest(definition):
+    sources = local_dependencies(definition)
+    inputs = sorted(set(sources + codelist_dependencies(sources) + data_dependencies(sources)))
+
+    digest = hashlib.sha256()
+    for path in inputs:
+        digest.update(f"{path.as_posix()}\0{file_sha(path)}\n".encode())
+    return digest
+
+
+def definition_fingerprint(definition):
+    """Hash of a definition, the local modules it imports and the codelists
+    and other data files they use (but not of any arguments it is run with,
+    or the tables it is run against)."""
+    return _inputs_digest(definition).hexdigest()
+
+
+def action_key(action):
+    digest = _inputs_digest(action["definition"])
+    digest.update(
+        shlex.join([action["image"], action["command"], *action["args"]]).encode()
+    )
+    tables_dir = dummy_tables_dir(action["args"])
+    if tables_dir is not None:
+        digest.update(json.dumps(tables_stamp(tables_dir), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _output_files(patterns):
+    return sorted(Path(p) for pattern in patterns for p in glob.glob(pattern))
+
+
+def _copy(files, source_root, destination_root):
+    for path in files:
+        destination = destination_root / path.relative_to(source_root)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(path, destination)
+
+
+def run_action(action):
+    command = ["opensafely", "exec", action["image"], action["command"],
+               str(action["definition"]), *action["args"]]
+    logger.info("running: %s", shlex.join(command))
+    subprocess.run(command, check=True)
+
+
+def run_cached(action, force=False, run=run_action):
+    key = action_key(action)
+    entry = CACHE_DIR / action["name"] / key
+
+    if entry.exists() and not force:
+        cached = sorted(p for p in entry.rglob("*") if p.is_file())
+        _copy(cached, entry, Path("."))
+        logger.info("%s: cache hit (%s), restored %d output(s)", action["name"], key[:12], len(cached))
+        return True
+
+    logger.info("%s: cache %s (%s)", action["name"], "bypassed" if force else "miss", key[:12])
+    run(action)
+
+    outputs = _output_files(action["output_patterns"])
+    if not outputs:
+        raise FileNotFoundError(f"{action['name']} produced none of {action['output_patterns']}")
+    tmp_entry = entry.with_name(f"{key}.tmp")
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    _copy(outputs, Path("."), tmp_entry)
+    shutil.rmtree(entry, ignore_errors=True)
+    tmp_entry.rename(entry)
+    return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("actions", nargs="+", help="names of ehrQL actions in project.yaml")
+    parser.add_argument("--dummy-tables", help="run against these tables (their contents are part of the key)")
+    parser.add_argument("--force", action="store_true", help="ignore and refresh the cache")
+    args = parser.parse_args(argv)
+
+    LOG_FILE.parent.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        handlers=[logging.StreamHandler(sys.stderr), logging.FileHandler(LOG_FILE)],
+    )
+
+    for name in args.actions:
+        action = load_action(name)
+        if args.dummy_tables:
+            # ehrQL's own options go before the "--" that starts the definition's
+            position = action["args"].index("--") if "--" in action["args"] else len(action["args"])
+            action["args"][position:position] = ["--dummy-tables", args.dummy_tables]
+        run_cached(action, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
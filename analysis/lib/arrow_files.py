@@ -0,0 +1,32 @@
+## Reading Arrow IPC files (as ehrQL and the cohort scripts write them) one
+## record batch at a time, straight out of a memory map without copying, so
+## memory depends on the size of a batch rather than of the file.
+####
+
+import pyarrow as pa
+
+
+def decoded(column):
+    if pa.types.is_dictionary(column.type):
+        return column.dictionary_decode()
+    return column
+
+
+def select_decoded(batch, columns):
+    """A record batch of just `columns`, with any dictionary columns decoded."""
+    return pa.record_batch([decoded(batch.column(name)) for name in columns], names=columns)
+
+
+def read_schema(path):
+    with pa.memory_map(str(path), "r") as source:
+        return pa.ipc.open_file(source).schema
+
+
+def iter_batches(path, columns=None):
+    """Yield each record batch of the file as it is stored or, given
+    `columns`, only those columns, decoded."""
+    with pa.memory_map(str(path), "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            yield batch if columns is None else select_decoded(batch, columns)
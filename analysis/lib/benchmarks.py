@@ -0,0 +1,256 @@
+## Benchmark every dataset/measures definition against synthetic tables of
+## increasing size (see dummy_tables.py), recording wall time, peak RSS and
+## output size for each run.
+##
+## Results are written to output/benchmarks/results.json and results.md, and
+## compared against output/benchmarks/baseline.json (if there is one) so that
+## regressions show up; --update-baseline replaces the baseline with this run.
+##
+## Peak RSS is that of the runner's process, so ehrQL runs in this environment
+## by default (python -m ehrql). With a runner that starts ehrQL in a container
+## (e.g. "opensafely exec ehrql:v1") that process is only the CLI that starts
+## it: wall time and output size are still recorded, but peak RSS isn't.
+##
+## The benchmarks only use ehrQL's command line (generate-dataset and
+## generate-measures with --dummy-tables), as of the ehrQL the actions in
+## project.yaml run (EHRQL_VERSION). analysis/testing/test_profiling.py runs
+## one of them whenever ehrQL is installed.
+##
+## Usage (from the repo root):
+##   python -m analysis.lib.benchmarks [--sizes 1000 100000] [--only full_study_cohort] \
+##       [--runner "python -m ehrql"] [--update-baseline]
+####
+
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+# the tables dummy_tables.py writes (not imported, see synthetic_tables())
+TABLES = ["patients", "practice_registrations", "clinical_events", "addresses", "ons_deaths"]
+
+OUTPUT_DIR = Path("output/benchmarks")
+TABLES_DIR = Path(".cache") / "benchmarks" / "tables"
+OUTPUTS_DIR = Path(".cache") / "benchmarks" / "outputs"
+BASELINE_FILE = OUTPUT_DIR / "baseline.json"
+
+SIZES = [1_000, 100_000, 1_000_000, 10_000_000]
+
+# name -> (ehrQL command, definition, output). Outputs ending in ":arrow" are
+# directories of tables, as for the actions in project.yaml that write them.
+
+BENCHMARKS = {
+    "full_study_cohort": (
+        "generate-dataset",
+        "analysis/create_cohorts/dataset_definition_full_study_cohort.py",
+        "full_study_cohort.arrow",
+    ),
+    "patient_features": (
+        "generate-dataset",
+        "analysis/create_cohorts/dataset_definition_patient_features.py",
+        "patient_features.arrow",
+    ),
+    "base_cohorts": (
+        "generate-dataset",
+        "analysis/create_cohorts/dataset_definition_base_cohorts.py",
+        "base_cohorts.arrow",
+    ),
+    "census_cohorts": (
+        "generate-dataset",
+        "analysis/create_cohorts/dataset_definition_census_cohorts.py",
+        "census_cohorts.arrow",
+    ),
+    "population_denominator_cohort": (
+        "generate-dataset",
+        "analysis/create_cohorts/population_denominator_cohort.py",
+        "population_denominator_cohort.arrow",
+    ),
+    "km_time_to_first_migration_code_cohort": (
+        "generate-dataset",
+        "analysis/create_cohorts/dataset_definition_km_time_to_first_migration_code.py",
+        "km_time_to_first_migration_code_cohort.arrow",
+    ),
+    "annual_migrant_counts": (
+        "generate-measures",
+        "analysis/annual_counts/generate_annual_migrant_counts.py",
+        "annual_migrant_counts.csv",
+    ),
+    "annual_migrant_counts_inputs": (
+        "generate-dataset",
+        "analysis/annual_counts/dataset_definition_annual_counts_inputs.py",
+        "annual_counts_inputs:arrow",
+    ),
+    "migration_event_level_dataset": (
+        "generate-dataset",
+        "analysis/code_usage/generate_migration_event_level_dataset.py",
+        "migration_event_level_dataset:arrow",
+    ),
+}
+
+# a run this much slower (or bigger) than the baseline counts as a regression
+REGRESSION_THRESHOLD = 1.2
+
+# the ehrQL these (and profiling.py) were written against: the image the
+# actions in project.yaml run
+EHRQL_VERSION = "v1"
+
+DEFAULT_RUNNER = "python -m ehrql"
+
+# runners that start ehrQL in a container, outside the process that is measured
+CONTAINER_RUNNERS = {"opensafely", "docker"}
+
+
+def measures_memory(runner):
+    """Whether the peak RSS of the runner's process is that of ehrQL."""
+    return Path(shlex.split(runner)[0]).name not in CONTAINER_RUNNERS
+
+
+def synthetic_tables(size, file_format="csv"):
+    """Generate (once) the synthetic tables for a population size. This runs
+    dummy_tables.py in its own process: the peak RSS of each benchmark run
+    starts from the size of the process that forked it, so this one stays
+    small by never loading the tables itself."""
+    tables_dir = TABLES_DIR / f"{size}-{file_format}"
+    if not all((tables_dir / f"{name}.{file_format}").exists() for name in TABLES):
+        subprocess.run(
+            [sys.executable, "-m", "analysis.lib.dummy_tables", "--population-size", str(size),
+             "--output-dir", str(tables_dir), "--format", file_format],
+            check=True,
+        )
+    return tables_dir
+
+
+def _output_size(output):
+    path = Path(output.split(":")[0])
+    if path.is_dir():
+        return sum(f.stat().st_size for f in path.iterdir())
+    return path.stat().st_size if path.exists() else None
+
+
+def run_benchmark(name, size, runner, tables_dir, output_dir=OUTPUTS_DIR):
+    command, definition, output_name = BENCHMARKS[name]
+    output = str(Path(output_dir) / str(size) / output_name)
+    output_path = Path(output.split(":")[0])
+    if output_path.is_dir():
+        shutil.rmtree(output_path)
+    elif output_path.exists():
+        output_path.unlink()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    argv = [*shlex.split(runner), command, definition,
+            "--dummy-tables", str(tables_dir), "--output", output]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    stderr = process.stderr.read().decode(errors="replace")
+    # wait4 gives the resource usage of this child alone (RUSAGE_CHILDREN would
+    # give the largest of every run so far)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall_time = time.perf_counter() - start
+    process.stderr.close()
+    returncode = os.waitstatus_to_exitcode(status)
+    output_size = _output_size(output)
+
+    return {
+        "benchmark": name,
+        "population_size": size,
+        "succeeded": returncode == 0,
+        "wall_time_s": round(wall_time, 3),
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1) if measures_memory(runner) else None,
+        "output_size_mb": None if output_size is None else round(output_size / 2**20, 3),
+        "error": None if returncode == 0 else stderr[-2000:],
+    }
+
+
+def compare_to_baseline(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Add each result's ratio to the matching baseline run and whether that
+    counts as a regression."""
+    baseline_runs = {
+        (run["benchmark"], run["population_size"]): run for run in baseline.get("results", [])
+    }
+    for result in results:
+        previous = baseline_runs.get((result["benchmark"], result["population_size"]))
+        result["regression"] = False
+        if previous is None or not (result["succeeded"] and previous["succeeded"]):
+            continue
+        for metric in ["wall_time_s", "peak_rss_mb", "output_size_mb"]:
+            if previous.get(metric) and result.get(metric) is not None:
+                ratio = result[metric] / previous[metric]
+                result[f"{metric}_vs_baseline"] = round(ratio, 2)
+                result["regression"] |= ratio > threshold
+    return results
+
+
+def markdown_table(results):
+    def ratio(result, metric):
+        value = result.get(f"{metric}_vs_baseline")
+        return "" if value is None else f" ({value}x)"
+
+    lines = [
+        "| Benchmark | Patients | Wall time (s) | Peak RSS (MB) | Output (MB) | Status |",
+        "|---|---:|---:|---:|---:|---|",
+    ]
+    for result in results:
+        if not result["succeeded"]:
+            status = "failed"
+        elif result.get("regression"):
+            status = "regression"
+        else:
+            status = "ok"
+        lines.append(
+            f"| {result['benchmark']} | {result['population_size']:,} "
+            f"| {result['wall_time_s']}{ratio(result, 'wall_time_s')} "
+            f"| {result['peak_rss_mb']}{ratio(result, 'peak_rss_mb')} "
+            f"| {result['output_size_mb']}{ratio(result, 'output_size_mb')} "
+            f"| {status} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--runner", default=DEFAULT_RUNNER,
+                        help="command that runs ehrQL; peak RSS isn't recorded for "
+                             "'opensafely exec ehrql:v1' or other container runners")
+    parser.add_argument("--table-format", choices=["csv", "arrow"], default="csv")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    if not measures_memory(args.runner):
+        print(f"{args.runner!r} runs ehrQL in a container: peak RSS won't be recorded")
+
+    results = []
+    for size in args.sizes:
+        tables_dir = synthetic_tables(size, args.table_format)
+        for name in args.only:
+            result = run_benchmark(name, size, args.runner, tables_dir)
+            memory = "" if result["peak_rss_mb"] is None else f", {result['peak_rss_mb']}MB"
+            print(f"{name} @ {size:,}: {result['wall_time_s']}s{memory}")
+            results.append(result)
+
+    baseline = json.loads(BASELINE_FILE.read_text()) if BASELINE_FILE.exists() else {}
+    results = compare_to_baseline(results, baseline)
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    report = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+    (OUTPUT_DIR / "results.json").write_text(json.dumps(report, indent=2))
+    (OUTPUT_DIR / "results.md").write_text(markdown_table(results))
+    if args.update_baseline:
+        BASELINE_FILE.write_text(json.dumps(report, indent=2))
+
+    regressions = [r for r in results if r.get("regression") or not r["succeeded"]]
+    if regressions:
+        print(f"{len(regressions)} benchmark run(s) failed or regressed; see {OUTPUT_DIR / 'results.md'}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
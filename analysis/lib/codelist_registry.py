@@ -0,0 +1,114 @@
+## Registry of the study codelists, shared by every cohort, measures and
+## code-usage script.
+## Each codelist CSV is compiled once into a compact index of its codes (and
+## categories, if it has them), cached on disk keyed by the file's hash and
+## only loaded the first time a script asks for it.
+####
+
+import csv
+import hashlib
+import json
+import os
+from functools import lru_cache
+from pathlib import Path
+
+CODELIST_DIR = Path("codelists")
+CODELIST_MANIFEST = CODELIST_DIR / "codelists.json"
+CACHE_DIR = Path(".cache") / "codelists"
+
+# name used in the analysis scripts -> (CSV file, code column, category column)
+
+CODELISTS = {
+    "all_migrant_codes": ("user-YaminaB-migration-status.csv", "code", None),
+    "cob_migrant_codes": ("user-YaminaB-born-outside-the-uk.csv", "code", None),
+    "asylum_refugee_migrant_codes": ("user-YaminaB-asylum-seeker-or-refugee.csv", "code", None),
+    "language_migrant_codes": ("user-YaminaB-english-not-main-language.csv", "code", None),
+    "interpreter_migrant_codes": ("user-YaminaB-interpreter-required.csv", "code", None),
+    "ethnicity_codelist": ("opensafely-ethnicity-snomed-0removed.csv", "code", "Label_6"),
+}
+
+
+def codelist_path(name):
+    filename, _, _ = CODELISTS[name]
+    return CODELIST_DIR / filename
+
+
+def file_sha(path):
+    return hashlib.sha1(Path(path).read_bytes().replace(b"\r\n", b"\n")).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _manifest():
+    with open(CODELIST_MANIFEST) as f:
+        return json.load(f)["files"]
+
+
+def _check_against_manifest(path):
+    # opencodelists hashes the file as downloaded, which doesn't always
+    # include the trailing newline, so accept either form
+    content = path.read_bytes().replace(b"\r\n", b"\n")
+    shas = {
+        hashlib.sha1(content).hexdigest(),
+        hashlib.sha1(content.rstrip(b"\n")).hexdigest(),
+    }
+    expected = _manifest()[path.name]["sha"]
+    if expected not in shas:
+        raise ValueError(
+            f"{path} does not match the sha recorded in {CODELIST_MANIFEST}; "
+            "run `opensafely codelists update` or revert the local edit"
+        )
+
+
+def compile_codelist(name):
+    """Parse a codelist CSV into its compact index: a sorted list of unique
+    codes, plus a code -> category mapping for categorised codelists."""
+    _, column, category_column = CODELISTS[name]
+    with open(codelist_path(name), newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row[column].strip()]
+
+    index = {"codes": sorted({row[column].strip() for row in rows})}
+    if category_column is not None:
+        index["categories"] = {
+            row[column].strip(): row[category_column] for row in rows
+        }
+    return index
+
+
+def _cached_index(name):
+    path = codelist_path(name)
+    _check_against_manifest(path)
+    cache_file = CACHE_DIR / f"{path.stem}-{file_sha(path)}.json"
+
+    if cache_file.exists():
+        with open(cache_file) as f:
+            return json.load(f)
+
+    index = compile_codelist(name)
+    # the cache is only an optimisation, so don't fail a run because the
+    # workspace happens to be read-only
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(index, f, separators=(",", ":"))
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        pass
+    return index
+
+
+@lru_cache(maxsize=None)
+def load_codelist(name):
+    """Return the named codelist in the form ehrQL's codelist_from_csv
+    gives it: a list of codes, or a code -> category dict if the codelist
+    has a category column."""
+    if name not in CODELISTS:
+        raise KeyError(f"Unknown codelist {name!r}; expected one of {list(CODELISTS)}")
+    index = _cached_index(name)
+    if "categories" in index:
+        return index["categories"]
+    return index["codes"]
+
+
+def load_codelists(*names):
+    return {name: load_codelist(name) for name in names}
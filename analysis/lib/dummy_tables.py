@@ -0,0 +1,311 @@
+## Generate synthetic versions of the tables in dummy_tables/ (patients,
+## practice_registrations, clinical_events, addresses and ons_deaths) at any
+## population size, for load testing the dataset definitions.
+##
+## Everything is generated with vectorised NumPy, a chunk of patients at a
+## time, and appended to the output files, so memory depends on the chunk size
+## rather than the population size. Output is seeded: the same seed, population
+## and chunk size always give the same tables.
+##
+## - Ethnicity and sex follow the Pathak et al. CPRD GOLD migrant cohort
+##   characteristics (as in analysis/scrapyard/generate_dummy_data.py)
+## - Migration-related codes are drawn from the real migration-status codelist
+##
+## Usage (from the repo root):
+##   python -m analysis.lib.dummy_tables --population-size 10000000 \
+##       --output-dir output/dummy_tables [--format arrow] [--seed 2025]
+####
+
+import csv
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+from analysis.lib.codelist_registry import load_codelist
+
+TABLES = ["patients", "practice_registrations", "clinical_events", "addresses", "ons_deaths"]
+
+# Column order of each table, as in dummy_tables/*.csv
+
+SCHEMAS = {
+    "patients": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date_of_birth", pa.date32()),
+        ("date_of_death", pa.date32()),
+        ("sex", pa.string()),
+    ]),
+    "practice_registrations": pa.schema([
+        ("patient_id", pa.int64()),
+        ("end_date", pa.date32()),
+        ("start_date", pa.date32()),
+    ]),
+    "clinical_events": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date", pa.date32()),
+        ("snomedct_code", pa.string()),
+    ]),
+    "addresses": pa.schema([
+        ("patient_id", pa.int64()),
+        ("address_id", pa.int64()),
+        ("end_date", pa.date32()),
+        ("has_postcode", pa.bool_()),
+        ("imd_rounded", pa.int64()),
+        ("msoa_code", pa.string()),
+        ("start_date", pa.date32()),
+    ]),
+    "ons_deaths": pa.schema([
+        ("patient_id", pa.int64()),
+        ("date", pa.date32()),
+    ]),
+}
+
+# generate ethnicities variable based on Pathak et al. CPRD GOLD migrant cohort characteristics
+
+ethnicities = ["White British", "White Non-British", "Mixed", "Asian/Asian British", "Black/African/Caribbean/Black British", "Other", "Unknown"]
+ethnicity_probabilities = [0.0152, 0.343, 0.0273, 0.267, 0.0919, 0.0779, 0.178] # don't add up to 1 so need to normalise them
+ethnicity_probabilities = np.array(ethnicity_probabilities) / np.sum(ethnicity_probabilities)
+
+# the ethnicity codelist categories each of the above is drawn from ("Unknown" has no code)
+
+ETHNICITY_CATEGORIES = {
+    "White British": lambda label_6, label_16: label_16 == "White - British",
+    "White Non-British": lambda label_6, label_16: label_6 == "White" and label_16 != "White - British",
+    "Mixed": lambda label_6, label_16: label_6 == "Mixed",
+    "Asian/Asian British": lambda label_6, label_16: label_6 == "Asian or Asian British",
+    "Black/African/Caribbean/Black British": lambda label_6, label_16: label_6 == "Black or Black British",
+    "Other": lambda label_6, label_16: label_6 == "Chinese or Other Ethnic Groups",
+}
+
+# generate sex based on Pathak et al. (plus a few disclosive values, which the
+# cohorts must exclude)
+
+sex = ["male", "female", "intersex", "unknown"]
+sex_probabilities = np.array([0.463, 0.537, 0.0005, 0.0015])
+sex_probabilities = sex_probabilities / sex_probabilities.sum()
+
+# Common codes that aren't in any study codelist, so that filtering has
+# something to exclude
+
+OTHER_CODES = np.array(["38341003", "44054006", "195967001", "22298006", "271737000", "35489007"])
+
+N_MSOAS = 7264
+
+EARLIEST_BIRTH = np.datetime64("1915-01-01", "M")
+LATEST_BIRTH = np.datetime64("2024-12-01", "M")
+EXTRACT_DATE = np.datetime64("2025-06-30", "D")
+
+
+def _ethnicity_code_pools():
+    with open("codelists/opensafely-ethnicity-snomed-0removed.csv", newline="") as f:
+        rows = list(csv.DictReader(f))
+    return {
+        group: np.array([row["code"] for row in rows if matches(row["Label_6"], row["Label_16"])])
+        for group, matches in ETHNICITY_CATEGORIES.items()
+    }
+
+
+def _random_dates(rng, start, end):
+    """A uniformly random date in [start, end] for each pair (as datetime64[D])."""
+    start = start.astype("datetime64[D]").astype(np.int64)
+    end = end.astype("datetime64[D]").astype(np.int64)
+    span = np.maximum(end - start, 0) + 1
+    return (start + (rng.random(len(start)) * span).astype(np.int64)).astype("datetime64[D]")
+
+
+def _spells(rng, patient_id, earliest, max_spells, ongoing_probability):
+    """Consecutive spells for each patient starting on or after `earliest`,
+    the last of which may be ongoing (no end date)."""
+    n_spells = rng.integers(1, max_spells + 1, len(patient_id))
+    spell_patient = np.repeat(patient_id, n_spells)
+    spell_earliest = np.repeat(earliest, n_spells).astype("datetime64[D]")
+    spell_number = np.arange(len(spell_patient)) - np.repeat(np.cumsum(n_spells) - n_spells, n_spells)
+
+    # spread each patient's spells out between their earliest date and the extract date
+    window = np.maximum((EXTRACT_DATE - spell_earliest).astype(np.int64), 1)
+    slot = window // np.repeat(n_spells, n_spells)
+    offset = (slot * spell_number + rng.random(len(spell_patient)) * slot * 0.5).astype(np.int64)
+    start = spell_earliest + offset
+    end = start + np.maximum((rng.random(len(spell_patient)) * slot * 0.5).astype(np.int64), 1) + (slot // 2)
+
+    is_last = spell_number == np.repeat(n_spells - 1, n_spells)
+    ongoing = is_last & (rng.random(len(spell_patient)) < ongoing_probability)
+    end = np.where(ongoing | (end > EXTRACT_DATE), np.datetime64("NaT"), end)
+    return spell_patient, start, end
+
+
+def generate_chunk(rng, first_patient_id, n, migrant_codes, ethnicity_pools, migrant_fraction=0.2):
+    """Return a dict of table name -> pyarrow Table for patients
+    first_patient_id, ..., first_patient_id + n - 1."""
+    patient_id = np.arange(first_patient_id, first_patient_id + n, dtype=np.int64)
+
+    # patients
+    months = (LATEST_BIRTH - EARLIEST_BIRTH).astype(np.int64) + 1
+    date_of_birth = (EARLIEST_BIRTH + rng.integers(0, months, n)).astype("datetime64[D]")
+    has_died = rng.random(n) < 0.1
+    death_date = _random_dates(rng, date_of_birth, np.full(n, EXTRACT_DATE))
+    date_of_death = np.where(has_died, death_date, np.datetime64("NaT"))
+    patient_sex = rng.choice(sex, size=n, p=sex_probabilities)
+
+    # ONS deaths: most TPP deaths (sometimes a few days out), plus some deaths
+    # only ONS knows about
+    in_ons = has_died & (rng.random(n) < 0.9)
+    ons_only = ~has_died & (rng.random(n) < 0.01)
+    ons_patient = patient_id[in_ons | ons_only]
+    ons_date = np.where(
+        has_died,
+        death_date + np.where(rng.random(n) < 0.8, 0, rng.integers(-7, 8, n)),
+        _random_dates(rng, date_of_birth, np.full(n, EXTRACT_DATE)),
+    )[in_ons | ons_only]
+    ons_date = np.maximum(ons_date, date_of_birth[in_ons | ons_only])
+
+    # registrations and addresses, from birth (or soon after)
+    earliest = date_of_birth + rng.integers(0, 365 * 30, n) * (rng.random(n) < 0.5)
+    reg_patient, reg_start, reg_end = _spells(rng, patient_id, earliest, 3, 0.8)
+    addr_patient, addr_start, addr_end = _spells(rng, patient_id, date_of_birth, 4, 0.7)
+    n_addresses = len(addr_patient)
+    msoa = rng.integers(1, N_MSOAS + 1, n_addresses)
+    has_postcode = rng.choice(np.array([True, False, None], dtype=object), n_addresses, p=[0.7, 0.2, 0.1])
+
+    # clinical events: ethnicity codes, migration-related codes for migrants
+    # and some unrelated codes
+    patient_ethnicity = rng.choice(ethnicities, size=n, p=ethnicity_probabilities)
+    ethnicity_patient, ethnicity_code = [], []
+    for group, pool in ethnicity_pools.items():
+        has_group = patient_ethnicity == group
+        ethnicity_patient.append(patient_id[has_group])
+        ethnicity_code.append(pool[rng.integers(0, len(pool), has_group.sum())])
+    ethnicity_patient = np.concatenate(ethnicity_patient)
+    ethnicity_code = np.concatenate(ethnicity_code)
+
+    is_migrant = rng.random(n) < migrant_fraction
+    n_migrant_codes = np.where(is_migrant, 1 + rng.poisson(1.5, n), 0)
+    migrant_patient = np.repeat(patient_id, n_migrant_codes)
+    migrant_code = migrant_codes[rng.integers(0, len(migrant_codes), len(migrant_patient))]
+
+    n_other_codes = rng.poisson(2, n)
+    other_patient = np.repeat(patient_id, n_other_codes)
+    other_code = OTHER_CODES[rng.integers(0, len(OTHER_CODES), len(other_patient))]
+
+    event_patient = np.concatenate([ethnicity_patient, migrant_patient, other_patient])
+    event_code = np.concatenate([ethnicity_code, migrant_code, other_code])
+    event_dob = date_of_birth[event_patient - first_patient_id]
+    event_date = _random_dates(rng, event_dob, np.full(len(event_patient), EXTRACT_DATE))
+    order = np.argsort(event_patient, kind="stable")
+
+    return {
+        "patients": pa.table(
+            [patient_id, date_of_birth, date_of_death, patient_sex],
+            schema=SCHEMAS["patients"],
+        ),
+        "practice_registrations": pa.table(
+            [reg_patient, reg_end, reg_start], schema=SCHEMAS["practice_registrations"]
+        ),
+        "clinical_events": pa.table(
+            [event_patient[order], event_date[order], event_code[order]],
+            schema=SCHEMAS["clinical_events"],
+        ),
+        "addresses": pa.table(
+            [
+                addr_patient,
+                rng.integers(-100, 100, n_addresses),
+                addr_end,
+                pa.array(has_postcode, type=pa.bool_()),
+                rng.integers(0, 329, n_addresses) * 100,
+                np.char.add("E02", np.char.zfill(msoa.astype(str), 6)),
+                addr_start,
+            ],
+            schema=SCHEMAS["addresses"],
+        ),
+        "ons_deaths": pa.table([ons_patient, ons_date], schema=SCHEMAS["ons_deaths"]),
+    }
+
+
+class _CSVTableWriter:
+    # booleans are written as T/F, as in dummy_tables/addresses.csv
+
+    def __init__(self, path, schema):
+        self.bool_columns = [field.name for field in schema if pa.types.is_boolean(field.type)]
+        for name in self.bool_columns:
+            schema = schema.set(schema.get_field_index(name), pa.field(name, pa.string()))
+        self.schema = schema
+        self.sink = pa.OSFile(str(path), "wb")
+        self.sink.write((",".join(schema.names) + "\n").encode())
+        self.writer = pa_csv.CSVWriter(
+            self.sink, schema,
+            write_options=pa_csv.WriteOptions(include_header=False, quoting_style="none"),
+        )
+
+    def write(self, table):
+        for name in self.bool_columns:
+            i = table.schema.get_field_index(name)
+            table = table.set_column(i, name, pc.if_else(table.column(name), "T", "F"))
+        self.writer.write_table(table.cast(self.schema))
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+class _ArrowTableWriter:
+    def __init__(self, path, schema):
+        self.sink = pa.OSFile(str(path), "wb")
+        self.writer = pa.ipc.new_file(self.sink, schema)
+
+    def write(self, table):
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+def write_dummy_tables(output_dir, population_size, chunk_size=500_000, seed=2025,
+                       file_format="csv", migrant_fraction=0.2):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    writer_class = {"csv": _CSVTableWriter, "arrow": _ArrowTableWriter}[file_format]
+    writers = {
+        name: writer_class(output_dir / f"{name}.{file_format}", SCHEMAS[name])
+        for name in TABLES
+    }
+
+    migrant_codes = np.array(load_codelist("all_migrant_codes"))
+    ethnicity_pools = _ethnicity_code_pools()
+    try:
+        for chunk_number, first in enumerate(range(0, population_size, chunk_size)):
+            rng = np.random.default_rng([seed, chunk_number])
+            n = min(chunk_size, population_size - first)
+            tables = generate_chunk(rng, first + 1, n, migrant_codes, ethnicity_pools, migrant_fraction)
+            for name, table in tables.items():
+                writers[name].write(table)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--population-size", type=int, default=1000)
+    parser.add_argument("--output-dir", default="output/dummy_tables")
+    parser.add_argument("--chunk-size", type=int, default=500_000)
+    parser.add_argument("--seed", type=int, default=2025)
+    parser.add_argument("--format", choices=["csv", "arrow"], default="csv")
+    parser.add_argument("--migrant-fraction", type=float, default=0.2)
+    args = parser.parse_args()
+
+    write_dummy_tables(
+        args.output_dir,
+        args.population_size,
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        file_format=args.format,
+        migrant_fraction=args.migrant_fraction,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+## Lookup table from each migration-related SNOMED code to the categories
+## (codelists) it belongs to, packed into a bitmask, so that a single pass over
+## the migration-related events can give every per-category flag, date and count
+####
+
+from functools import lru_cache
+
+from analysis.lib.codelist_registry import load_codelist
+
+# bit -> codelist; "migrant" is membership of the overall migration-status codelist
+
+MIGRANT = 1
+COB = 2
+ASYLUM_REFUGEE = 4
+LANGUAGE = 8
+INTERPRETER = 16
+
+CATEGORY_CODELISTS = {
+    MIGRANT: "all_migrant_codes",
+    COB: "cob_migrant_codes",
+    ASYLUM_REFUGEE: "asylum_refugee_migrant_codes",
+    LANGUAGE: "language_migrant_codes",
+    INTERPRETER: "interpreter_migrant_codes",
+}
+
+# Label given to a code in the event-level dataset, in order of priority for
+# codes that appear in more than one codelist
+
+CATEGORY_LABELS = {
+    LANGUAGE: "Main/first language is not English",
+    INTERPRETER: "Interpreter required",
+    ASYLUM_REFUGEE: "Asylum or refugee status",
+    COB: "Country of birth",
+}
+OTHER_LABEL = "Other"
+
+
+@lru_cache(maxsize=None)
+def category_table():
+    """Return a dict mapping every code in any migration-related codelist to
+    the bitmask of the codelists it appears in."""
+    table = {}
+    for bit, name in CATEGORY_CODELISTS.items():
+        for code in load_codelist(name):
+            table[code] = table.get(code, 0) | bit
+    return table
+
+
+@lru_cache(maxsize=None)
+def masks_including(bit):
+    """Return every bitmask in the table that has the given category bit set."""
+    return sorted({mask for mask in category_table().values() if mask & bit})
+
+
+def label_for_mask(mask):
+    for bit, label in CATEGORY_LABELS.items():
+        if mask & bit:
+            return label
+    return OTHER_LABEL
+
+
+@lru_cache(maxsize=None)
+def category_labels():
+    """Return a dict mapping each code in the migration-status codelist to its
+    single migration_category label."""
+    return {
+        code: label_for_mask(mask)
+        for code, mask in category_table().items()
+        if mask & MIGRANT
+    }
@@ -0,0 +1,105 @@
+## Point-in-time registrations and addresses, outside of ehrQL: which
+## registration practice_registrations.for_patient_on(date) and which address
+## addresses.for_patient_on(date) would pick, for a whole grid of patients and
+## dates at once.
+##
+## Each patient's spells are resolved once (with the same priority order as
+## ehrQL) into non-overlapping segments. cumulative_counts.py intersects and
+## counts these segments directly; lookup_on() indexes them, so that a grid
+## of, say, every census date x millions of patients is a single bulk lookup
+## (see spells.SpellIndex) instead of one search per patient per date. The
+## reference cohorts use it for their study start and census date lookups.
+####
+
+import numpy as np
+import pandas as pd
+
+from analysis.lib.spells import BEFORE_EVERYTHING, NEVER, SpellIndex, resolve_spells, to_days
+
+
+def _nulls_first(values):
+    # ehrQL sorts NULLs before everything else
+    days, missing = to_days(values)
+    return np.where(missing, BEFORE_EVERYTHING, days)
+
+
+def registration_segments(registrations, columns):
+    """Date ranges in which each patient is registered, with `columns` of the
+    registration practice_registrations.for_patient_on() picks."""
+    registrations = registrations.reset_index(drop=True)
+    start, missing_start = to_days(registrations["start_date"])
+    end, _ = to_days(registrations["end_date"], fill=NEVER)
+    keep = ~missing_start
+    registrations = registrations[keep].reset_index(drop=True)
+    sort_keys = [start[keep], _nulls_first(registrations["end_date"])]
+    if "practice_pseudo_id" in registrations:
+        sort_keys.append(registrations["practice_pseudo_id"].fillna(BEFORE_EVERYTHING).to_numpy())
+    segments = resolve_spells(registrations["patient_id"].to_numpy(), start[keep], end[keep], sort_keys)
+    for column in columns:
+        segments[column] = registrations[column].astype(object).to_numpy()[segments["row"].to_numpy()]
+    return segments.drop(columns="row")
+
+
+def address_segments(addresses, columns, patient_ids=None):
+    """Date ranges labelled with `columns` of the address
+    addresses.for_patient_on() picks. With `patient_ids`, every date is
+    covered for each of them: the columns are missing where there is no
+    address."""
+    addresses = addresses.reset_index(drop=True)
+    start, missing_start = to_days(addresses["start_date"])
+    end, _ = to_days(addresses["end_date"], fill=NEVER)
+    keep = ~missing_start
+    addresses = addresses[keep].reset_index(drop=True)
+
+    # a lowest-priority, never-ending "no address" spell for every patient
+    patient_ids = np.asarray([] if patient_ids is None else patient_ids, dtype=np.int64)
+    n, m = len(addresses), len(patient_ids)
+    segments = resolve_spells(
+        np.r_[addresses["patient_id"].to_numpy(), patient_ids],
+        np.r_[start[keep], np.full(m, BEFORE_EVERYTHING)],
+        np.r_[end[keep], np.full(m, NEVER)],
+        sort_keys=[
+            np.r_[np.ones(n), np.zeros(m)],
+            np.r_[addresses["has_postcode"].fillna(False).astype(int).to_numpy(), np.zeros(m)],
+            np.r_[start[keep], np.zeros(m)],
+            np.r_[_nulls_first(addresses["end_date"]), np.zeros(m)],
+            np.r_[addresses["address_id"].fillna(BEFORE_EVERYTHING).to_numpy(), np.zeros(m)],
+        ],
+    )
+    for column in columns:
+        values = np.r_[addresses[column].astype(object).to_numpy(), np.full(m, None)]
+        segments[column] = values[segments["row"].to_numpy()]
+    return segments.drop(columns="row")
+
+
+def registration_index(registrations, columns=("practice_nuts1_region_name",)):
+    columns = [column for column in columns if column in registrations]
+    return SpellIndex(registration_segments(registrations, columns), columns)
+
+
+def address_index(addresses, columns=("msoa_code", "imd_quintile")):
+    columns = [column for column in columns if column in addresses]
+    return SpellIndex(address_segments(addresses, columns), columns)
+
+
+def lookup_on(registrations, addresses, patient_ids, dates):
+    """For every patient on every date: whether they are registered, and the
+    columns of their registration and address on that date. `registrations`
+    and `addresses` are SpellIndexes. Returns a DataFrame of patient_id, date,
+    registered and the indexed columns, patient by patient."""
+    patient_ids = np.asarray(patient_ids)
+    days, _ = to_days(dates)
+    grid_patients = np.repeat(patient_ids, len(days))
+    grid_days = np.tile(days, len(patient_ids))
+
+    registered, registration_values = registrations.lookup(grid_patients, grid_days)
+    _, address_values = addresses.lookup(grid_patients, grid_days)
+    return pd.concat([
+        pd.DataFrame({
+            "patient_id": grid_patients,
+            "date": grid_days.astype("datetime64[D]"),
+            "registered": registered,
+        }),
+        registration_values,
+        address_values,
+    ], axis=1)
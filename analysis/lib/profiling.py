@@ -0,0 +1,184 @@
+## Opt-in profiling of a dataset definition, one variable at a time.
+##
+## The definition is compiled as ehrQL would for generate-dataset, then run
+## against dummy tables with the local-file query engine:
+##   - the population predicate on its own,
+##   - the population plus each variable (and each event table) on its own,
+##     so a variable's own cost is its run time minus the population's, and
+##   - for every event table a variable reads, the rows scanned (every row of
+##     the table) and the rows kept by the filters the variable applies to it.
+##
+## A JSON report and a hot-spot summary (variables sorted by their own cost)
+## are written to logs/. Nothing here runs as part of the normal actions.
+##
+## ehrQL's command line doesn't offer any of this, so it is built on ehrQL
+## internals rather than its public API: load_dataset_definition, the
+## local-file query engine and the query model's Dataset/Filter/SelectTable
+## nodes. These are as of benchmarks.EHRQL_VERSION, the ehrQL the actions in
+## project.yaml run (the ehrql:v1 image); ehrQL may change them in any
+## release, so analysis/testing/test_profiling.py runs a definition through
+## here whenever ehrQL is installed.
+##
+## Usage (from the repo root, with ehrQL installed):
+##   python -m analysis.lib.profiling analysis/create_cohorts/dataset_definition_full_study_cohort.py \
+##       [--dummy-tables dummy_tables] [--repeat 3] [-- <definition arguments>]
+####
+
+import json
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from ehrql.loaders import load_dataset_definition
+from ehrql.query_engines.local_file import LocalFileQueryEngine
+from ehrql.query_model.nodes import AggregateByPatient, Dataset, Filter, SelectTable, all_nodes
+
+LOG_DIR = Path("logs")
+
+
+def _run(engine, dataset):
+    """Evaluate a dataset, returning the number of result rows."""
+    return sum(1 for table in engine.get_results_tables(dataset) for _ in table)
+
+
+def time_dataset(engine, dataset, repeat=1):
+    """Best-of-`repeat` wall time, in seconds, to evaluate a dataset."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _run(engine, dataset)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _source_table(frame):
+    """The table a chain of filters reads from (None if it reads from
+    anything other than a table, e.g. a sorted or already-picked frame)."""
+    while isinstance(frame, Filter):
+        frame = frame.source
+    return frame if isinstance(frame, SelectTable) else None
+
+
+def filtered_frames(series):
+    """The event tables a variable reads, each with the outermost filtered
+    frames built on it."""
+    nodes = list(all_nodes(series))
+    tables = {node: [] for node in nodes if isinstance(node, SelectTable)}
+    inner_filters = {node.source for node in nodes if isinstance(node, Filter)}
+    for node in nodes:
+        if isinstance(node, Filter) and node not in inner_filters:
+            table = _source_table(node)
+            if table is not None:
+                tables[table].append(node)
+    return tables
+
+
+def count_rows(engine, frame):
+    """Total rows in an event frame, across all patients."""
+    dataset = Dataset(
+        population=AggregateByPatient.Exists(source=frame),
+        variables={"n": AggregateByPatient.Count(source=frame)},
+        events={},
+        measures=None,
+    )
+    return sum(row[1] for table in engine.get_results_tables(dataset) for row in table)
+
+
+def table_rows(engine, series, scanned_cache):
+    """Rows scanned and kept for each event table a variable reads. Where a
+    variable filters the same table in more than one way, the largest
+    filtered frame counts as the rows kept."""
+    rows = {}
+    for table, filters in filtered_frames(series).items():
+        if table.name not in scanned_cache:
+            scanned_cache[table.name] = count_rows(engine, table)
+        scanned = scanned_cache[table.name]
+        kept = max((count_rows(engine, frame) for frame in filters), default=scanned)
+        rows[table.name] = {"rows_scanned": scanned, "rows_kept": kept}
+    return rows
+
+
+def profile_dataset(dataset, engine, repeat=1):
+    scanned_cache = {}
+    population = Dataset(population=dataset.population, variables={}, events={}, measures=None)
+    population_time = time_dataset(engine, population, repeat)
+    report = {
+        "population": {
+            "seconds": round(population_time, 4),
+            "own_seconds": round(population_time, 4),
+            "tables": table_rows(engine, dataset.population, scanned_cache),
+        },
+        "variables": {},
+        "events": {},
+    }
+
+    for name, series in dataset.variables.items():
+        seconds = time_dataset(
+            engine,
+            Dataset(population=dataset.population, variables={name: series}, events={}, measures=None),
+            repeat,
+        )
+        report["variables"][name] = {
+            "seconds": round(seconds, 4),
+            "own_seconds": round(max(seconds - population_time, 0), 4),
+            "tables": table_rows(engine, series, scanned_cache),
+        }
+
+    for name, event_table in (dataset.events or {}).items():
+        seconds = time_dataset(
+            engine,
+            Dataset(population=dataset.population, variables={}, events={name: event_table}, measures=None),
+            repeat,
+        )
+        report["events"][name] = {
+            "seconds": round(seconds, 4),
+            "own_seconds": round(max(seconds - population_time, 0), 4),
+            "tables": table_rows(engine, event_table, scanned_cache),
+        }
+
+    return report
+
+
+def hot_spots(report):
+    """One line per population/variable/event table, most expensive first."""
+    entries = [("population", report["population"])]
+    entries += [(f"variable {name}", entry) for name, entry in report["variables"].items()]
+    entries += [(f"event table {name}", entry) for name, entry in report["events"].items()]
+    entries.sort(key=lambda item: item[1]["own_seconds"], reverse=True)
+    total = sum(entry["own_seconds"] for _, entry in entries) or 1
+
+    lines = [f"{'own seconds':>12} {'share':>6}  step (rows kept / scanned per table)"]
+    for label, entry in entries:
+        tables = ", ".join(
+            f"{table} {rows['rows_kept']:,}/{rows['rows_scanned']:,}"
+            for table, rows in entry["tables"].items()
+        )
+        lines.append(
+            f"{entry['own_seconds']:>12.4f} {entry['own_seconds'] / total:>6.1%}  {label}"
+            + (f" ({tables})" if tables else "")
+        )
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument("--dummy-tables", default="dummy_tables")
+    parser.add_argument("--repeat", type=int, default=1, help="report the best of this many runs")
+    parser.add_argument("definition_args", nargs="*")
+    args = parser.parse_args()
+
+    definition = Path(args.definition)
+    dataset, _ = load_dataset_definition(definition, args.definition_args, environ={})
+    report = profile_dataset(dataset, LocalFileQueryEngine(args.dummy_tables), args.repeat)
+    report = {"definition": str(definition), "dummy_tables": args.dummy_tables, **report}
+
+    LOG_DIR.mkdir(exist_ok=True)
+    (LOG_DIR / f"profile_{definition.stem}.json").write_text(json.dumps(report, indent=2))
+    summary = hot_spots(report)
+    (LOG_DIR / f"profile_{definition.stem}.txt").write_text(summary)
+    print(summary, end="")
+
+
+if __name__ == "__main__":
+    main()
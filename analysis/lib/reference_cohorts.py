@@ -0,0 +1,803 @@
+## A pandas re-implementation of the cohort definitions in
+## analysis/create_cohorts/ (full study, census, population denominator and
+## KM cohorts) and of the annual counts measures, evaluated straight from
+## dummy_tables/*.csv (or the .csv/.arrow tables dummy_tables.py writes) in a
+## fraction of the time an ehrQL run takes.
+##
+## It is meant for two things:
+##   - iterating on the logic of a definition locally, and
+##   - as a differential oracle: comparing its cohorts column by column with
+##     the .arrow files ehrQL generated from the same tables, so a change that
+##     alters the logic shows up without re-deriving the expected output by hand.
+##
+## It follows ehrQL's semantics: NULL-aware (three-valued) logic for the
+## inclusion criteria, NULLs sorting first in sort_by(), for_patient_on()
+## picking the last spanning row, and age_on() counting whole years. Dates are
+## held as nullable day numbers (see spells.py) until the output is built.
+## Registrations and addresses at the study start and census dates come from
+## one bulk point_in_time.lookup_on() per cohort; registration_on() and
+## address_on() are the plain per-date versions it is tested against.
+##
+## Usage (from the repo root):
+##   python -m analysis.lib.reference_cohorts --dummy-tables dummy_tables \
+##       [--cohorts full_study_cohort census_cohorts] [--compare-dir output/cohorts] \
+##       [--output-dir output/reference_cohorts] [--annual-counts-output annual_migrant_counts.csv]
+####
+
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from analysis.lib.codelist_registry import load_codelist
+from analysis.lib.migration_categories import ASYLUM_REFUGEE, COB, INTERPRETER, MIGRANT, category_table
+from analysis.lib.point_in_time import address_index, lookup_on, registration_index
+from analysis.lib.spells import from_days, to_days
+
+with open("analysis/lib/study-dates.json") as f:
+    study_dates = json.load(f)
+
+STUDY_START = to_days([study_dates["study_start_date"]])[0][0]
+STUDY_END = to_days([study_dates["study_end_date"]])[0][0]
+CENSUS_DATES = sorted(date for key, date in study_dates.items() if key.startswith("census_"))
+
+# Columns holding dates in each table
+DATE_COLUMNS = {
+    "patients": ["date_of_birth", "date_of_death"],
+    "practice_registrations": ["start_date", "end_date"],
+    "clinical_events": ["date"],
+    "addresses": ["start_date", "end_date"],
+    "ons_deaths": ["date"],
+}
+STRING_COLUMNS = {"sex", "snomedct_code", "msoa_code", "practice_nuts1_region_name"}
+
+YEAR_OF_BIRTH_BANDS = [
+    (1900, 1925, "1900-1925"),
+    (1926, 1945, "1926-1945"),
+    (1946, 1965, "1946-1965"),
+    (1966, 1985, "1966-1985"),
+    (1986, 2005, "1986-2005"),
+    (2006, 2025, "2006-2025"),
+]
+_ANY_AGE = np.iinfo(np.int64).max
+CENSUS_AGE_BANDS = [
+    (-_ANY_AGE, 15, "0-15"),
+    (16, 24, "16-24"),
+    (25, 34, "25-34"),
+    (35, 49, "35-49"),
+    (50, 64, "50-64"),
+    (65, 74, "65-74"),
+    (75, 84, "75-84"),
+    (85, _ANY_AGE, "85 plus"),
+]
+
+# addresses.imd_rounded is cut into quantiles of this maximum rank, as in
+# ehrQL's addresses.imd_decile and imd_quintile
+MAX_IMD = 32844
+
+# Columns where ehrQL's choice between rows that tie on the sort key (several
+# ethnicity codes on the latest date) is arbitrary, so they aren't compared
+# for patients with such a tie
+TIE_SENSITIVE_COLUMNS = {"latest_ethnicity_code", "latest_ethnicity_group"}
+
+# columns the base cohorts definition leaves to a join on the patient feature
+# table
+JOINED_FEATURES = ["latest_ethnicity_code", "latest_ethnicity_group", "year_of_birth", "year_of_birth_band"]
+
+
+# Reading the tables ------------------------------------------------------
+
+def _nullable_days(values):
+    days, missing = to_days(values)
+    return pd.Series(pd.arrays.IntegerArray(days, missing))
+
+
+def read_tables(tables_dir):
+    """Read each table (.arrow if there is one, otherwise .csv) with dates as
+    nullable day numbers."""
+    tables_dir = Path(tables_dir)
+    tables = {}
+    for name, date_columns in DATE_COLUMNS.items():
+        if (tables_dir / f"{name}.arrow").exists():
+            frame = feather.read_table(tables_dir / f"{name}.arrow").to_pandas()
+        else:
+            frame = pd.read_csv(
+                tables_dir / f"{name}.csv",
+                dtype={column: str for column in STRING_COLUMNS},
+                true_values=["T"],
+                false_values=["F"],
+            )
+        for column in date_columns:
+            frame[column] = _nullable_days(frame[column]).array
+        if "has_postcode" in frame:
+            frame["has_postcode"] = frame["has_postcode"].astype("boolean")
+        tables[name] = frame.reset_index(drop=True)
+    return tables
+
+
+# ehrQL building blocks ---------------------------------------------------
+
+def _per_patient(values, patient_index, fill=None):
+    values = values.reindex(patient_index)
+    return values if fill is None else values.fillna(fill)
+
+
+def _exists(frame, patient_index):
+    return pd.Series(patient_index.isin(frame["patient_id"]), index=patient_index, dtype="boolean")
+
+
+def _count(frame, patient_index):
+    return _per_patient(frame.groupby("patient_id").size(), patient_index, fill=0).astype("Int64")
+
+
+def _pick(frame, sort_by, column, patient_index, last=False):
+    """sort_by(*sort_by).first_for_patient() (or last_for_patient()).column;
+    NULLs sort first."""
+    ordered = frame.sort_values(["patient_id", *sort_by], na_position="first", kind="stable")
+    picked = ordered.drop_duplicates("patient_id", keep="last" if last else "first")
+    return _per_patient(picked.set_index("patient_id")[column], patient_index)
+
+
+def _where(frame, condition):
+    # ehrQL's where() drops rows whose condition is NULL
+    return frame[condition.fillna(False).to_numpy(dtype=bool)]
+
+
+def _spanning(frame, date):
+    """Rows with start_date <= date, except those with end_date < date."""
+    frame = _where(frame, frame["start_date"] <= date)
+    return frame[~(frame["end_date"] < date).fillna(False).to_numpy(dtype=bool)]
+
+
+def registration_on(registrations, date, column, patient_index):
+    registrations = _spanning(registrations, date)
+    sort_by = ["start_date", "end_date"]
+    if "practice_pseudo_id" in registrations:
+        sort_by.append("practice_pseudo_id")
+    return _pick(registrations, sort_by, column, patient_index, last=True)
+
+
+def address_on(addresses, date, patient_index):
+    """The row of addresses.for_patient_on(date) for each patient."""
+    addresses = _spanning(addresses, date).assign(
+        postcode_rank=lambda frame: frame["has_postcode"].fillna(False).astype(int)
+    )
+    ordered = addresses.sort_values(
+        ["patient_id", "postcode_rank", "start_date", "end_date", "address_id"],
+        na_position="first", kind="stable",
+    )
+    picked = ordered.drop_duplicates("patient_id", keep="last").set_index("patient_id")
+    return picked.reindex(patient_index)
+
+
+def imd_quantile(imd_rounded, n):
+    """addresses.imd_decile (n=10) or imd_quintile (n=5)."""
+    imd = imd_rounded.astype("Float64")
+    labels = pd.Series("unknown", index=imd.index, dtype="string")
+    # the first matching band wins, so apply them from the last to the first
+    for i in range(n, 0, -1):
+        if i == 1:
+            in_band, label = (imd >= 0) & (imd < int(MAX_IMD / n)), "1 (most deprived)"
+        elif i == n:
+            in_band, label = imd <= MAX_IMD, f"{n} (least deprived)"
+        else:
+            in_band, label = imd < int(MAX_IMD * i / n), str(i)
+        labels = labels.mask(in_band.fillna(False), label)
+    return labels
+
+
+def _ymd(days):
+    dates = pd.to_datetime(from_days(days.fillna(0).to_numpy()))
+    missing = days.isna().to_numpy()
+    def nullable(values):
+        return pd.Series(pd.arrays.IntegerArray(np.asarray(values, dtype=np.int64), missing), index=days.index)
+    return nullable(dates.year), nullable(dates.month), nullable(dates.day)
+
+
+def age_on(date_of_birth, date):
+    birth_year, birth_month, birth_day = _ymd(date_of_birth)
+    year, month, day = _ymd(pd.Series(date, index=date_of_birth.index, dtype="Int64"))
+    not_had_birthday = (month < birth_month) | ((month == birth_month) & (day < birth_day))
+    return year - birth_year - not_had_birthday.astype("Int64")
+
+
+def _band(values, bands, otherwise=None):
+    """case(when(lower <= value <= upper).then(label), ...) for (lower, upper, label) bands."""
+    labels = pd.Series(otherwise, index=values.index, dtype="string")
+    for lower, upper, label in bands:
+        labels = labels.mask(((values >= lower) & (values <= upper)).fillna(False), label)
+    return labels
+
+
+def _as_dates(days):
+    return pd.Series(
+        from_days(days.fillna(0).to_numpy()).astype("datetime64[s]"), index=days.index
+    ).mask(days.isna().to_numpy())
+
+
+def _minimum_of(*values):
+    # ehrQL's minimum_of() ignores NULLs
+    return pd.concat(values, axis=1).min(axis=1, skipna=True).astype("Int64")
+
+
+# Shared variables --------------------------------------------------------
+
+def migration_events(tables):
+    events = tables["clinical_events"]
+    masks = events["snomedct_code"].map(category_table())
+    events = events[masks.notna().to_numpy()]
+    return events.assign(mask=masks[masks.notna()].astype(int).to_numpy())
+
+
+def events_in_category(events, category):
+    return events[(events["mask"] & category).astype(bool).to_numpy()]
+
+
+def latest_ethnicity(tables, patient_index):
+    """latest_ethnicity_code and _group, plus which patients have more than
+    one ethnicity code on their latest date."""
+    codelist = load_codelist("ethnicity_codelist")
+    events = tables["clinical_events"]
+    events = events[events["snomedct_code"].isin(codelist).to_numpy()]
+    code = _pick(events, ["date"], "snomedct_code", patient_index, last=True)
+
+    latest_date = _pick(events, ["date"], "date", patient_index, last=True)
+    on_latest = events.assign(latest=events["patient_id"].map(latest_date))
+    on_latest = on_latest[
+        (on_latest["date"] == on_latest["latest"]).fillna(False).to_numpy(dtype=bool)
+        | (on_latest["date"].isna() & on_latest["latest"].isna()).to_numpy()
+    ]
+    codes_on_latest = on_latest.groupby("patient_id")["snomedct_code"].nunique()
+    tied = set(codes_on_latest.index[codes_on_latest > 1])
+
+    return code.astype("string"), code.map(codelist).astype("string"), tied
+
+
+def _base(tables):
+    patients = tables["patients"].drop_duplicates("patient_id").set_index("patient_id")
+    patient_index = patients.index
+    ons_date = _per_patient(
+        tables["ons_deaths"].drop_duplicates("patient_id").set_index("patient_id")["date"], patient_index
+    )
+    return patients, patient_index, ons_date
+
+
+def has_non_disclosive_sex(patients):
+    sex = patients["sex"].astype("string")
+    return ((sex == "male") | (sex == "female")).astype("boolean")
+
+
+def is_alive_at_study_start(patients, ons_date):
+    return (
+        ((patients["date_of_death"] >= STUDY_START) | patients["date_of_death"].isna())
+        & ((ons_date >= STUDY_START) | ons_date.isna())
+    )
+
+
+def is_registered_during_study(registrations, patient_index):
+    end = registrations["end_date"]
+    return _exists(
+        _where(registrations, end.isna() | ((end <= STUDY_END) & (end > STUDY_START))), patient_index
+    )
+
+
+def year_of_birth_variables(cohort, patients):
+    year_of_birth = _ymd(patients["date_of_birth"])[0]
+    cohort["year_of_birth"] = year_of_birth
+    cohort["year_of_birth_band"] = _band(year_of_birth, YEAR_OF_BIRTH_BANDS)
+
+
+def _with_dates(frame):
+    # point_in_time works on dates rather than day numbers
+    return frame.assign(start_date=_as_dates(frame["start_date"]), end_date=_as_dates(frame["end_date"]))
+
+
+def point_in_time(tables, days, patient_index):
+    """Each patient's registration and address on each of `days`, from one
+    bulk lookup: {day: DataFrame of registered, practice_nuts1_region_name (if
+    the table has it), msoa_code and imd_rounded, indexed by patient_id}."""
+    registrations = registration_index(_with_dates(tables["practice_registrations"]))
+    addresses = address_index(_with_dates(tables["addresses"]), ("msoa_code", "imd_rounded"))
+    grid = lookup_on(registrations, addresses, patient_index, from_days(days))
+    return {day: grid.iloc[i::len(days)].set_index("patient_id") for i, day in enumerate(days)}
+
+
+def address_variables(cohort, on_date, suffix=""):
+    cohort[f"msoa_code{suffix}"] = on_date["msoa_code"].astype("string")
+    cohort[f"imd_decile{suffix}"] = imd_quantile(on_date["imd_rounded"], 10)
+    cohort[f"imd_quintile{suffix}"] = imd_quantile(on_date["imd_rounded"], 5)
+
+
+def region_variable(on_date):
+    if "practice_nuts1_region_name" not in on_date:
+        return pd.Series(pd.NA, index=on_date.index, dtype="string")
+    return on_date["practice_nuts1_region_name"].astype("string")
+
+
+def first_registration_date(tables, patient_index):
+    return _pick(tables["practice_registrations"], ["start_date"], "start_date", patient_index)
+
+
+def migration_code_variables(cohort, events, patient_index):
+    migrant_events = events_in_category(events, MIGRANT)
+    first_code = _pick(migrant_events, ["date"], "date", patient_index)
+    cohort["date_of_first_migration_code"] = _as_dates(first_code)
+    cohort["number_of_migration_codes"] = _count(migrant_events, patient_index)
+    return first_code
+
+
+def category_flags(cohort, events, patient_index):
+    cohort["has_cob_migrant_code"] = _exists(events_in_category(events, COB), patient_index)
+    cohort["has_asylum_or_refugee_migrant_code"] = _exists(events_in_category(events, ASYLUM_REFUGEE), patient_index)
+    cohort["has_interpreter_migrant_code"] = _exists(events_in_category(events, INTERPRETER), patient_index)
+
+
+def _in_population(cohort, population, tied):
+    cohort = cohort[population.fillna(False).to_numpy(dtype=bool)].reset_index()
+    cohort.attrs["tied"] = tied & set(cohort["patient_id"])
+    return cohort
+
+
+# Cohorts -----------------------------------------------------------------
+
+def _full_study_variables(tables):
+    patients, patient_index, ons_date = _base(tables)
+    events = migration_events(tables)
+
+    population = (
+        _exists(events_in_category(events, MIGRANT), patient_index)
+        & is_registered_during_study(tables["practice_registrations"], patient_index)
+        & has_non_disclosive_sex(patients)
+        & is_alive_at_study_start(patients, ons_date)
+        & (age_on(patients["date_of_birth"], STUDY_START) <= 100)
+    )
+
+    cohort = pd.DataFrame(index=patient_index)
+    first_registration = first_registration_date(tables, patient_index)
+    first_code = migration_code_variables(cohort, events, patient_index)
+    cohort["sex"] = patients["sex"].astype("string")
+    category_flags(cohort, events, patient_index)
+    cohort["date_of_first_practice_registration"] = _as_dates(first_registration)
+    cohort["time_to_first_migration_code"] = first_code - first_registration
+    cohort["latest_ethnicity_code"], cohort["latest_ethnicity_group"], tied = latest_ethnicity(tables, patient_index)
+    year_of_birth_variables(cohort, patients)
+    at_study_start = point_in_time(tables, [STUDY_START], patient_index)[STUDY_START]
+    address_variables(cohort, at_study_start)
+    cohort["region"] = region_variable(at_study_start)
+    cohort["TPP_death_date"] = _as_dates(patients["date_of_death"])
+    cohort["ons_death_date"] = _as_dates(ons_date)
+    return cohort, population, tied
+
+
+def full_study_cohort(tables):
+    """dataset_definition_full_study_cohort.py"""
+    return _in_population(*_full_study_variables(tables))
+
+
+def census_cohorts(tables, census_dates=CENSUS_DATES):
+    """dataset_definition_census_cohorts.py with --census-date census_dates"""
+    patients, patient_index, ons_date = _base(tables)
+    events = migration_events(tables)
+    date_of_birth = patients["date_of_birth"]
+    date_of_death = patients["date_of_death"]
+
+    census_years = [census_date[:4] for census_date in census_dates]
+    if len(set(census_years)) < len(census_years):
+        raise ValueError(f"more than one census date in the same year: {census_dates}")
+
+    def column_name(name, census_date):
+        return f"{name}_{census_date[:4]}"
+
+    census_days = {census_date: to_days([census_date])[0][0] for census_date in census_dates}
+    on_census_date = point_in_time(tables, list(census_days.values()), patient_index)
+
+    migrant_events = events_in_category(events, MIGRANT)
+    in_cohort = {}
+    for census_date, day in census_days.items():
+        in_cohort[census_date] = (
+            _exists(_where(migrant_events, migrant_events["date"] <= day), patient_index)
+            & on_census_date[day]["registered"].astype("boolean")
+            & has_non_disclosive_sex(patients)
+            & ((date_of_birth <= day) & ((date_of_death > day) | date_of_death.isna()))
+            & (age_on(date_of_birth, day) <= 100)
+        )
+    population = in_cohort[census_dates[0]]
+    for census_date in census_dates[1:]:
+        population = population | in_cohort[census_date]
+
+    cohort = pd.DataFrame(index=patient_index)
+    first_registration = first_registration_date(tables, patient_index)
+    first_code = migration_code_variables(cohort, events, patient_index)
+    cohort["sex"] = patients["sex"].astype("string")
+    category_flags(cohort, events, patient_index)
+    cohort["date_of_first_practice_registration"] = _as_dates(first_registration)
+    cohort["time_to_first_migration_code"] = first_code - first_registration
+
+    for census_date, day in census_days.items():
+        cohort[column_name("in_census_cohort", census_date)] = in_cohort[census_date]
+        age = age_on(date_of_birth, day)
+        cohort[column_name("age_on_census_date", census_date)] = age
+        cohort[column_name("age_band", census_date)] = _band(age, CENSUS_AGE_BANDS, otherwise="missing")
+        suffix = column_name("", census_date)
+        address_variables(cohort, on_census_date[day], suffix=suffix)
+        cohort[column_name("region", census_date)] = region_variable(on_census_date[day])
+
+    cohort["TPP_death_date"] = _as_dates(date_of_death)
+    cohort["ons_death_date"] = _as_dates(ons_date)
+    return _in_population(cohort, population, set())
+
+
+def _population_denominator_variables(tables):
+    patients, patient_index, ons_date = _base(tables)
+
+    population = (
+        is_registered_during_study(tables["practice_registrations"], patient_index)
+        & has_non_disclosive_sex(patients)
+        & is_alive_at_study_start(patients, ons_date)
+        & (age_on(patients["date_of_birth"], STUDY_START) <= 100)
+    )
+
+    cohort = pd.DataFrame(index=patient_index)
+    cohort["sex"] = patients["sex"].astype("string")
+    cohort["latest_ethnicity_code"], _, tied = latest_ethnicity(tables, patient_index)
+    year_of_birth_variables(cohort, patients)
+    at_study_start = point_in_time(tables, [STUDY_START], patient_index)[STUDY_START]
+    address_variables(cohort, at_study_start)
+    cohort["region"] = region_variable(at_study_start)
+    cohort["TPP_death_date"] = _as_dates(patients["date_of_death"])
+    cohort["ons_death_date"] = _as_dates(ons_date)
+    return cohort, population, tied
+
+
+def population_denominator_cohort(tables):
+    """population_denominator_cohort.py"""
+    return _in_population(*_population_denominator_variables(tables))
+
+
+def _km_variables(tables):
+    patients, patient_index, ons_date = _base(tables)
+    registrations = tables["practice_registrations"]
+    start, end = registrations["start_date"], registrations["end_date"]
+
+    is_registered = _exists(_where(registrations, (
+        ((start <= STUDY_START) | ((start > STUDY_START) & (start < STUDY_END)))
+        & (end.isna() | ((end > STUDY_START) & (end < STUDY_END)) | (end >= STUDY_END))
+    )), patient_index)
+    population = (
+        is_registered
+        & has_non_disclosive_sex(patients)
+        & is_alive_at_study_start(patients, ons_date)
+        & (age_on(patients["date_of_birth"], STUDY_START) <= 100)
+    )
+
+    cohort = pd.DataFrame(index=patient_index)
+    first_registration = first_registration_date(tables, patient_index)
+    cohort["date_of_first_practice_registration"] = _as_dates(first_registration)
+    cohort["baseline_date"] = _as_dates(first_registration - 1)
+
+    max_end = _per_patient(registrations.groupby("patient_id")["end_date"].max(), patient_index)
+    deregistration = max_end.where((max_end < to_days(["3000-01-01"])[0][0]).fillna(False))
+    cohort["date_of_deregistration"] = _as_dates(deregistration)
+    cohort["TPP_death_date"] = _as_dates(patients["date_of_death"])
+    cohort["ons_death_date"] = _as_dates(ons_date)
+    cohort["censor_date"] = _as_dates(_minimum_of(
+        patients["date_of_death"], ons_date, deregistration,
+        pd.Series(STUDY_END, index=patient_index, dtype="Int64"),
+    ))
+
+    migrant_codes = set(load_codelist("all_migrant_codes"))
+    events = tables["clinical_events"]
+    events = events[events["snomedct_code"].isin(migrant_codes).to_numpy()]
+    cohort["has_a_migration_code"] = _exists(events, patient_index)
+    first_code = _pick(events, ["date"], "date", patient_index)
+    cohort["date_of_first_migration_code"] = _as_dates(first_code)
+    code_before_registration = first_code < first_registration
+    cohort["processed_first_migration_code_date"] = _as_dates(
+        first_code.where(code_before_registration.eq(False).fillna(False))
+        .fillna(first_registration.where(code_before_registration.eq(True).fillna(False)))
+    )
+    cohort["number_of_migration_codes"] = _count(events, patient_index)
+    cohort["sex"] = patients["sex"].astype("string")
+    year_of_birth_variables(cohort, patients)
+    if "practice_nuts1_region_name" in registrations:
+        cohort["region"] = _pick(
+            registrations, ["start_date"], "practice_nuts1_region_name", patient_index
+        ).astype("string")
+    else:
+        cohort["region"] = pd.Series(pd.NA, index=patient_index, dtype="string")
+    return cohort, population, set()
+
+
+def km_cohort(tables):
+    """dataset_definition_km_time_to_first_migration_code.py"""
+    return _in_population(*_km_variables(tables))
+
+
+def base_cohorts(tables):
+    """dataset_definition_base_cohorts.py"""
+    full, in_full, _ = _full_study_variables(tables)
+    denominator, in_denominator, _ = _population_denominator_variables(tables)
+    km, in_km, _ = _km_variables(tables)
+
+    # every variable is evaluated for everyone; each cohort's own columns
+    # come from its single-cohort evaluation
+    cohort = pd.DataFrame({
+        "in_full_study_cohort": in_full,
+        "in_population_denominator_cohort": in_denominator,
+        "in_km_cohort": in_km,
+    })
+    cohort = cohort.join(full).join(km.drop(columns=[*full.columns.intersection(km.columns), "region"]))
+    cohort["region_at_first_registration"] = km["region"]
+    return _in_population(cohort.drop(columns=JOINED_FEATURES), in_denominator | in_km, set())
+
+
+def patient_features(tables):
+    """dataset_definition_patient_features.py"""
+    patients, patient_index, _ = _base(tables)
+    registrations = tables["practice_registrations"]
+    population = _exists(
+        registrations[~(registrations["end_date"] < STUDY_START).fillna(False).to_numpy(dtype=bool)],
+        patient_index,
+    )
+
+    cohort = pd.DataFrame(index=patient_index)
+    cohort["latest_ethnicity_code"], cohort["latest_ethnicity_group"], tied = latest_ethnicity(tables, patient_index)
+    year_of_birth_variables(cohort, patients)
+    return _in_population(cohort, population, tied)
+
+
+# Annual counts -----------------------------------------------------------
+
+# numerator -> category, as generate_annual_migrant_counts.py names them
+ANNUAL_NUMERATORS = {
+    "any_migrant": MIGRANT,
+    "cob_migrant": COB,
+    "asylum_refugee_migrant": ASYLUM_REFUGEE,
+    "interpreter_migrant": INTERPRETER,
+}
+ANNUAL_SUBGROUPS = {"": None, "age": "age_band", "sex": "sex", "ethnicity": "ethnicity", "imd": "imd_quintile", "region": "region"}
+ANNUAL_COLUMNS = [
+    "measure", "interval_start", "interval_end", "ratio", "numerator", "denominator",
+    "age_band", "sex", "ethnicity", "imd_quintile", "region",
+]
+
+
+def yearly_intervals():
+    """years(16).starting_on(study_start_date), as day numbers."""
+    first_year = int(study_dates["study_start_date"][:4])
+    last_year = int(study_dates["study_end_date"][:4])
+    return [
+        (to_days([f"{year}-01-01"])[0][0], to_days([f"{year}-12-31"])[0][0])
+        for year in range(first_year, last_year + 1)
+    ]
+
+
+def _column_or_missing(frame, column):
+    if column in frame:
+        return frame[column]
+    return pd.Series(pd.NA, index=frame.index, dtype="object")
+
+
+def annual_counts_inputs(tables):
+    """dataset_definition_annual_counts_inputs.py, with the latest ethnicity
+    group joined on as cumulative_counts.read_inputs() does: (patients,
+    registrations, addresses) with dates as dates."""
+    patients, patient_index, _ = _base(tables)
+    registrations = tables["practice_registrations"]
+    last_interval_start = to_days([study_dates["study_end_date"][:4] + "-01-01"])[0][0]
+    registered = _where(registrations, registrations["start_date"] <= last_interval_start)
+    registered = registered[~(registered["end_date"] < STUDY_START).fillna(False).to_numpy(dtype=bool)]
+    population = has_non_disclosive_sex(patients) & _exists(registered, patient_index)
+    population = population.fillna(False).to_numpy(dtype=bool)
+
+    events = migration_events(tables)
+    cohort = pd.DataFrame(index=patient_index)
+    cohort["date_of_birth"] = _as_dates(patients["date_of_birth"])
+    cohort["date_of_death"] = _as_dates(patients["date_of_death"])
+    cohort["sex"] = patients["sex"].astype("string")
+    for name, category in ANNUAL_NUMERATORS.items():
+        cohort[f"first_{name}_code_date"] = _as_dates(
+            _pick(events_in_category(events, category), ["date"], "date", patient_index)
+        )
+    cohort["ethnicity"] = latest_ethnicity(tables, patient_index)[1].fillna("unknown")
+    cohort = cohort[population].reset_index()
+
+    in_population = registrations["patient_id"].isin(cohort["patient_id"]).to_numpy()
+    registrations = registrations[in_population]
+    registrations = pd.DataFrame({
+        "patient_id": registrations["patient_id"],
+        "start_date": _as_dates(registrations["start_date"]),
+        "end_date": _as_dates(registrations["end_date"]),
+        "practice_pseudo_id": _column_or_missing(registrations, "practice_pseudo_id"),
+        "region": _column_or_missing(registrations, "practice_nuts1_region_name"),
+    }).reset_index(drop=True)
+
+    addresses = tables["addresses"]
+    addresses = addresses[addresses["patient_id"].isin(cohort["patient_id"]).to_numpy()]
+    addresses = pd.DataFrame({
+        "patient_id": addresses["patient_id"],
+        "start_date": _as_dates(addresses["start_date"]),
+        "end_date": _as_dates(addresses["end_date"]),
+        "address_id": addresses["address_id"],
+        "has_postcode": addresses["has_postcode"],
+        "imd_quintile": imd_quantile(addresses["imd_rounded"], 5),
+    }).reset_index(drop=True)
+    return cohort, registrations, addresses
+
+
+def annual_counts(tables, intervals=None):
+    """generate_annual_migrant_counts.py's measures, evaluated interval by
+    interval: one row per measure, interval and group with a non-zero
+    denominator."""
+    patients, patient_index, _ = _base(tables)
+    registrations = tables["practice_registrations"]
+    events = migration_events(tables)
+    date_of_birth = patients["date_of_birth"]
+    date_of_death = patients["date_of_death"]
+    ethnicity = latest_ethnicity(tables, patient_index)[1].fillna("unknown")
+    first_code = {
+        name: _pick(events_in_category(events, category), ["date"], "date", patient_index)
+        for name, category in ANNUAL_NUMERATORS.items()
+    }
+
+    rows = []
+    for start, end in intervals or yearly_intervals():
+        age = age_on(date_of_birth, start)
+        denominator = (
+            ((date_of_birth <= start) & ((date_of_death > start) | date_of_death.isna()))
+            & _exists(_spanning(registrations, start), patient_index)
+            & has_non_disclosive_sex(patients)
+            & (age <= 100)
+        ).fillna(False).to_numpy(dtype=bool)
+
+        address = address_on(tables["addresses"], start, patient_index)
+        # no address is NULL, an address without an IMD rank is "unknown"
+        imd_quintile = imd_quantile(address["imd_rounded"], 5).astype(object).where(address["address_id"].notna())
+        groups = pd.DataFrame({
+            "age_band": _band(age, CENSUS_AGE_BANDS, otherwise="missing"),
+            "sex": patients["sex"].astype("string"),
+            "ethnicity": ethnicity,
+            "imd_quintile": imd_quintile,
+            "region": (
+                registration_on(registrations, start, "practice_nuts1_region_name", patient_index)
+                if "practice_nuts1_region_name" in registrations
+                else pd.Series(pd.NA, index=patient_index, dtype="object")
+            ).fillna("unknown"),
+        }, index=patient_index).astype(object)
+        groups = groups.where(groups.notna(), None)[denominator]
+
+        for name, first in first_code.items():
+            in_numerator = (first <= end).fillna(False).to_numpy(dtype=bool)[denominator]
+            for suffix, column in ANNUAL_SUBGROUPS.items():
+                keys = groups[column] if column else pd.Series("", index=groups.index)
+                counts = pd.DataFrame({"key": keys.to_numpy(), "numerator": in_numerator}).groupby(
+                    "key", dropna=False, sort=False
+                )["numerator"].agg(["sum", "size"])
+                for value, (numerator, denominator_count) in counts.iterrows():
+                    row = {
+                        "measure": name if suffix == "" else f"{name}_{suffix}",
+                        "interval_start": str(from_days([start])[0]),
+                        "interval_end": str(from_days([end])[0]),
+                        "ratio": numerator / denominator_count,
+                        "numerator": int(numerator),
+                        "denominator": int(denominator_count),
+                    }
+                    if column:
+                        row[column] = None if pd.isna(value) else value
+                    rows.append(row)
+    return pd.DataFrame(rows, columns=ANNUAL_COLUMNS)
+
+
+# cohort -> (function, file name of the ehrQL output in output/cohorts)
+COHORTS = {
+    "full_study_cohort": (full_study_cohort, "full_study_cohort.arrow"),
+    "census_cohorts": (census_cohorts, "census_cohorts.arrow"),
+    "population_denominator_cohort": (population_denominator_cohort, "population_denominator_cohort.arrow"),
+    "km_time_to_first_migration_code_cohort": (km_cohort, "km_time_to_first_migration_code_cohort.arrow"),
+    "base_cohorts": (base_cohorts, "base_cohorts.arrow"),
+    "patient_features": (patient_features, "patient_features.arrow"),
+}
+
+
+# Differential comparison -------------------------------------------------
+
+def _comparable(values, like):
+    if pd.api.types.is_datetime64_any_dtype(like):
+        return pd.to_datetime(values).dt.strftime("%Y-%m-%d").astype("string")
+    if pd.api.types.is_bool_dtype(like):
+        return values.astype("boolean")
+    if pd.api.types.is_integer_dtype(like):
+        return values.astype("Float64")
+    return values.astype("string")
+
+
+def compare_cohorts(reference, actual):
+    """Compare a reference cohort with ehrQL's output, returning a dict of
+    patients missing from either side and mismatching values per column."""
+    for name in actual.columns:
+        if isinstance(actual[name].dtype, pd.CategoricalDtype):
+            actual[name] = actual[name].astype(object)
+    reference_ids = set(reference["patient_id"])
+    actual_ids = set(actual["patient_id"])
+    both = reference.merge(actual, on="patient_id", suffixes=("", "_actual"))
+    tied = both["patient_id"].isin(reference.attrs.get("tied", set())).to_numpy()
+
+    columns = {}
+    for name in reference.columns.drop("patient_id"):
+        if name not in actual.columns:
+            columns[name] = "missing from the ehrQL output"
+            continue
+        expected = _comparable(both[name], reference[name])
+        got = _comparable(both[f"{name}_actual"], reference[name])
+        same = (expected == got).fillna(False) | (expected.isna() & got.isna())
+        if name in TIE_SENSITIVE_COLUMNS:
+            same |= tied
+        mismatched = both["patient_id"][~same.to_numpy(dtype=bool)]
+        if len(mismatched):
+            columns[name] = f"{len(mismatched)} mismatches (e.g. patients {sorted(mismatched)[:5]})"
+    for name in actual.columns.drop("patient_id").difference(reference.columns):
+        columns[name] = "not in the reference cohort"
+
+    return {
+        "only_in_reference": sorted(reference_ids - actual_ids),
+        "only_in_ehrql": sorted(actual_ids - reference_ids),
+        "columns": columns,
+    }
+
+
+def to_arrow(cohort):
+    """The cohort as an Arrow table with ehrQL's column types (dates as date32)."""
+    cohort = cohort.copy()
+    cohort.attrs = {}
+    table = pa.Table.from_pandas(cohort, preserve_index=False).replace_schema_metadata()
+    schema = pa.schema([
+        pa.field(field.name, pa.date32()) if pa.types.is_timestamp(field.type)
+        else pa.field(field.name, pa.string()) if pa.types.is_large_string(field.type)
+        else field
+        for field in table.schema
+    ])
+    return table.cast(schema)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--dummy-tables", default="dummy_tables")
+    parser.add_argument("--cohorts", nargs="+", choices=list(COHORTS), default=list(COHORTS))
+    parser.add_argument("--compare-dir", help="directory of ehrQL cohort .arrow files to compare against")
+    parser.add_argument("--output-dir", help="write the reference cohorts here as .arrow files")
+    parser.add_argument("--annual-counts-output", help="write the annual counts measures to this .csv file")
+    args = parser.parse_args()
+
+    tables = read_tables(args.dummy_tables)
+    if args.annual_counts_output:
+        annual_counts(tables).to_csv(args.annual_counts_output, index=False)
+    differences = 0
+    for name in args.cohorts:
+        function, file_name = COHORTS[name]
+        cohort = function(tables)
+        print(f"{name}: {len(cohort):,} patients")
+
+        if args.output_dir:
+            Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+            feather.write_feather(to_arrow(cohort), Path(args.output_dir) / file_name)
+
+        if args.compare_dir:
+            actual = feather.read_table(Path(args.compare_dir) / file_name).to_pandas()
+            result = compare_cohorts(cohort, actual)
+            for side in ["only_in_reference", "only_in_ehrql"]:
+                if result[side]:
+                    print(f"  {len(result[side])} patients {side.replace('_', ' ')} (e.g. {result[side][:5]})")
+            for column, problem in result["columns"].items():
+                print(f"  {column}: {problem}")
+            differences += bool(result["only_in_reference"] or result["only_in_ehrql"] or result["columns"])
+
+    if differences:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+## Rounding of the counts that are released, as the kaplan-meier-function
+## action does with min_count: to the midpoint of multiples of min_count, so
+## 0 stays 0, 1-6 become 3, 7-12 become 9 and so on.
+####
+
+import numpy as np
+
+MIN_COUNT = 6
+
+
+def roundmid_any(x, to):
+    # like ceiling_any, but centred on the midpoint of the rounding points
+    return np.ceil(x / to) * to - (np.floor(to / 2) * (x != 0))
+
+
+def rounded_counts(counts, min_count=MIN_COUNT):
+    """Integer counts rounded with roundmid_any (unchanged if min_count is 0
+    or None)."""
+    counts = np.asarray(counts, dtype=np.int64)
+    return roundmid_any(counts, min_count).astype(np.int64) if min_count else counts
@@ -0,0 +1,286 @@
+## Local runner for the actions in project.yaml that runs independent actions
+## at the same time
+##
+## - the `needs:` of each action give the dependency graph; an action starts
+##   once everything it needs has finished
+## - at most --workers actions run at once; with --local, an action also only
+##   starts if its expected peak memory (its peak RSS last time, or
+##   --default-memory-gb) fits in what is left of --memory-gb
+## - when more actions are ready than can start, the ones with the longest
+##   chain of (previously timed) work after them go first
+## - each action's output goes to logs/actions/<action>.log
+## - at the end, the timings of every action and the critical path (the chain
+##   of dependent actions that took longest, which bounds the whole run) are
+##   written to logs/run_actions.md and kept in logs/run_actions.json for the
+##   next run's scheduling
+## If an action fails, the actions that need it are skipped and the rest go on.
+##
+## Usage (from the repo root):
+##   python -m analysis.lib.run_actions [action ...] [--workers 4] [--memory-gb 16] \
+##       [--default-memory-gb 1] [--local] [--dry-run]
+## With action names, only those actions and the ones they need are run.
+## --local runs ehrQL and python:latest actions with this Python instead of
+## through `opensafely exec`. Peak RSS is only recorded, and the memory budget
+## only applied, for actions run that way: through `opensafely exec` or
+## `opensafely run` the action runs in a container, and the process measured
+## here is just the CLI that starts it.
+##
+## Reusable actions (such as kaplan-meier-function) can only go through
+## `opensafely run`, which runs again any action they need that it has no
+## record of running, as with anything run through `opensafely exec` or
+## --local. So everything a reusable action needs goes through `opensafely
+## run` too, and is only run once.
+####
+
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import yaml
+
+PROJECT_FILE = Path("project.yaml")
+LOG_DIR = Path("logs") / "actions"
+TIMINGS_FILE = Path("logs") / "run_actions.json"
+REPORT_FILE = Path("logs") / "run_actions.md"
+
+DEFAULT_MEMORY_GB = 1.0
+
+# images that `opensafely exec` can run directly; other actions (reusable
+# actions such as kaplan-meier-function) go through `opensafely run`
+EXEC_IMAGES = {"ehrql", "python", "r"}
+LOCAL_COMMANDS = {"ehrql": [sys.executable, "-m", "ehrql"], "python": [sys.executable]}
+
+
+def load_actions(project_file=PROJECT_FILE):
+    """Return {action: list of the actions it needs}, in project.yaml order."""
+    with open(project_file) as f:
+        actions = yaml.safe_load(f)["actions"]
+    return {name: list(action.get("needs") or []) for name, action in actions.items()}, actions
+
+
+def with_needs(targets, needs):
+    """The target actions and everything they need, recursively."""
+    selected = set()
+    to_visit = list(targets)
+    while to_visit:
+        name = to_visit.pop()
+        if name not in needs:
+            raise KeyError(f"No action called {name!r} in {PROJECT_FILE}")
+        if name not in selected:
+            selected.add(name)
+            to_visit.extend(needs[name])
+    return selected
+
+
+def _image_name(action):
+    return shlex.split(action["run"])[0].split(":")[0]
+
+
+def run_through_opensafely(needs, actions):
+    """The actions to run with `opensafely run`: every reusable action and
+    everything it needs, recursively."""
+    reusable = [name for name, action in actions.items() if _image_name(action) not in EXEC_IMAGES]
+    return with_needs(reusable, needs)
+
+
+def command(name, action, local=False, through_opensafely=False):
+    image, *args = shlex.split(action["run"])
+    image_name = image.split(":")[0]
+    if through_opensafely or image_name not in EXEC_IMAGES:
+        return ["opensafely", "run", name]
+    if local and image_name in LOCAL_COMMANDS:
+        return [*LOCAL_COMMANDS[image_name], *args]
+    return ["opensafely", "exec", image, *args]
+
+
+def runs_locally(argv):
+    """Whether the action runs in the process started here (rather than in a
+    container), so that its peak RSS is the action's own."""
+    return argv[0] == sys.executable
+
+
+def chain_lengths(needs, durations, default=1.0):
+    """For each action, the longest total duration of it and the actions that
+    (directly or indirectly) need it."""
+    needed_by = {name: [] for name in needs}
+    for name, requirements in needs.items():
+        for requirement in requirements:
+            needed_by[requirement].append(name)
+
+    lengths = {}
+
+    def length(name):
+        if name not in lengths:
+            after = max((length(dependent) for dependent in needed_by[name]), default=0.0)
+            lengths[name] = durations.get(name, default) + after
+        return lengths[name]
+
+    for name in needs:
+        length(name)
+    return lengths
+
+
+def critical_path(needs, finished):
+    """The chain of dependent actions that ended last: follow, from the action
+    that finished last, the requirement that finished last."""
+    if not finished:
+        return []
+    name = max(finished, key=lambda name: finished[name]["end"])
+    path = [name]
+    while True:
+        requirements = [r for r in needs[name] if r in finished]
+        if not requirements:
+            break
+        name = max(requirements, key=lambda requirement: finished[requirement]["end"])
+        path.append(name)
+    return path[::-1]
+
+
+def run_actions(needs, actions, selected, workers, memory_gb, local=False, history=None,
+                default_memory_gb=DEFAULT_MEMORY_GB, log_dir=LOG_DIR):
+    """Run the selected actions, returning {action: result}."""
+    history = history or {}
+    durations = {name: run["wall_time_s"] for name, run in history.items() if run.get("succeeded")}
+    priority = chain_lengths(needs, durations)
+    through_opensafely = run_through_opensafely(needs, actions)
+    expected_memory = {
+        name: history[name]["peak_rss_mb"] / 1024 if history.get(name, {}).get("peak_rss_mb") else default_memory_gb
+        for name in selected
+    }
+
+    log_dir.mkdir(parents=True, exist_ok=True)
+    waiting = set(selected)
+    running = {}  # pid -> (action, start time, log file, runs locally)
+    results = {}
+    started_at = time.perf_counter()
+
+    while waiting or running:
+        # skip anything needing an action that failed or was skipped
+        for name in sorted(waiting):
+            if any(results.get(r, {}).get("succeeded") is False for r in needs[name]):
+                waiting.discard(name)
+                results[name] = {"succeeded": False, "skipped": True}
+                print(f"skipped {name}: a needed action failed")
+
+        ready = sorted(
+            (name for name in waiting if all(results.get(r, {}).get("succeeded") for r in needs[name] if r in selected)),
+            key=lambda name: -priority[name],
+        )
+        memory_in_use = sum(expected_memory[name] for name, _, _, measured in running.values() if measured)
+        for name in ready:
+            if len(running) >= workers:
+                break
+            argv = command(name, actions[name], local, name in through_opensafely)
+            measured = runs_locally(argv)
+            # something always runs, even if it alone is over the budget
+            if measured and running and memory_in_use + expected_memory[name] > memory_gb:
+                continue
+            log_file = open(log_dir / f"{name}.log", "w")
+            log_file.write(f"$ {shlex.join(argv)}\n")
+            log_file.flush()
+            process = subprocess.Popen(argv, stdout=log_file, stderr=subprocess.STDOUT)
+            running[process.pid] = (name, time.perf_counter(), log_file, measured)
+            waiting.discard(name)
+            if measured:
+                memory_in_use += expected_memory[name]
+            print(f"started {name}")
+
+        if not running:
+            break
+        # wait4 gives the resource usage of the child that finished alone
+        pid, status, usage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        name, start, log_file, measured = running.pop(pid)
+        log_file.close()
+        end = time.perf_counter()
+        returncode = os.waitstatus_to_exitcode(status)
+        results[name] = {
+            "succeeded": returncode == 0,
+            "start": round(start - started_at, 3),
+            "end": round(end - started_at, 3),
+            "wall_time_s": round(end - start, 3),
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1) if measured else None,
+        }
+        print(f"{'finished' if returncode == 0 else 'FAILED'} {name} in {end - start:.1f}s")
+
+    return results
+
+
+def report(needs, results):
+    finished = {name: result for name, result in results.items() if "end" in result}
+    path = critical_path(needs, finished)
+    lines = [
+        "| Action | Start (s) | Wall time (s) | Peak RSS (MB) | Status | Critical path |",
+        "|---|---:|---:|---:|---|---|",
+    ]
+    for name, result in sorted(results.items(), key=lambda item: item[1].get("start", float("inf"))):
+        if result.get("skipped"):
+            lines.append(f"| {name} | | | | skipped | |")
+            continue
+        lines.append(
+            f"| {name} | {result['start']} | {result['wall_time_s']} | {result['peak_rss_mb'] or ''} "
+            f"| {'ok' if result['succeeded'] else 'failed'} | {'*' if name in path else ''} |"
+        )
+    total = max((result["end"] for result in finished.values()), default=0)
+    lines += [
+        "",
+        f"Total wall time: {total:.1f}s",
+        f"Critical path ({sum(finished[name]['wall_time_s'] for name in path):.1f}s): "
+        + " -> ".join(path),
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("actions", nargs="*", help="run only these actions and the ones they need")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--memory-gb", type=float, default=16.0,
+                        help="memory budget for the actions running at once (only applied with --local)")
+    parser.add_argument("--default-memory-gb", type=float, default=DEFAULT_MEMORY_GB,
+                        help="expected peak memory of an action that hasn't been run before")
+    parser.add_argument("--local", action="store_true",
+                        help="run ehrQL and python:latest actions with this Python, not opensafely exec")
+    parser.add_argument("--dry-run", action="store_true", help="print the actions in a possible order and stop")
+    args = parser.parse_args()
+
+    needs, actions = load_actions()
+    selected = with_needs(args.actions, needs) if args.actions else set(needs)
+    history = json.loads(TIMINGS_FILE.read_text()) if TIMINGS_FILE.exists() else {}
+
+    if args.dry_run:
+        priority = chain_lengths(needs, {name: run["wall_time_s"] for name, run in history.items() if "wall_time_s" in run})
+        through_opensafely = run_through_opensafely(needs, actions)
+        done = set()
+        while len(done) < len(selected):
+            ready = [name for name in selected - done if all(r in done for r in needs[name] if r in selected)]
+            for name in sorted(ready, key=lambda name: -priority[name]):
+                argv = command(name, actions[name], args.local, name in through_opensafely)
+                print(f"{name}: {shlex.join(argv)}")
+            done.update(ready)
+        return
+
+    results = run_actions(
+        needs, actions, selected, args.workers, args.memory_gb, args.local, history, args.default_memory_gb
+    )
+
+    TIMINGS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    TIMINGS_FILE.write_text(json.dumps({**history, **{
+        name: result for name, result in results.items() if not result.get("skipped")
+    }}, indent=2))
+    REPORT_FILE.write_text(report(needs, results))
+    print(REPORT_FILE.read_text())
+
+    if not all(result["succeeded"] for result in results.values()):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+## Run a dataset definition in N patient shards at once and merge the results
+## into one .arrow file, for local runs against large (e.g. synthetic) tables.
+##
+## - every table in --dummy-tables is split into N hash partitions on
+##   patient_id, so each shard holds all the rows of its patients
+## - the definition is run on each shard in its own process, at most
+##   --workers at a time; each shard's output and log go to --work-dir
+## - the shard outputs are merged by concatenating their record batches
+##   (memory-mapped, so they aren't copied before being written out)
+##
+## A patient's variables only depend on their own rows, so the merged output
+## has the same rows as a single run, grouped by shard rather than sorted by
+## patient_id. Measures aggregate across patients, so only generate-dataset
+## definitions can be sharded.
+##
+## A manifest in --work-dir records which shards have finished, for which
+## definition (its action_cache fingerprint) and which tables (their sizes and
+## modification times). Running again only re-runs the shards that failed or
+## are missing (or just --shard i, or every shard with --force); if the
+## definition, its modules or data files, the tables or the arguments have
+## changed, every shard is re-run. The tables are only re-partitioned if they
+## or the number of shards changed.
+##
+## Usage (from the repo root):
+##   python -m analysis.lib.sharded_dataset analysis/create_cohorts/population_denominator_cohort.py \
+##       --dummy-tables output/dummy_tables --output output/population_denominator_cohort.arrow \
+##       [--shards 8] [--workers 8] [--shard 3] [--force] \
+##       [--runner "opensafely exec ehrql:v1"] [-- definition args]
+####
+
+import json
+import os
+import shlex
+import subprocess
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+
+from analysis.lib.action_cache import definition_fingerprint
+
+WORK_DIR = Path(".cache") / "sharded_dataset"
+
+TABLE_SUFFIXES = {".csv", ".arrow"}
+
+
+def shard_of(patient_id, n_shards):
+    """The shard of each patient: a splitmix64 hash of their id modulo
+    n_shards, so that shards are balanced however the ids are allocated."""
+    z = np.asarray(patient_id, dtype=np.int64).astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z % np.uint64(n_shards)).astype(np.int64)
+
+
+def _read_table(path):
+    if path.suffix == ".arrow":
+        return feather.read_table(path)
+    # every column as it's written, so the shards' files read the same way
+    with open(path) as f:
+        header = f.readline().rstrip("\r\n").split(",")
+    return pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={name: pa.string() for name in header}, strings_can_be_null=False,
+    ))
+
+
+def _write_table(table, path):
+    if path.suffix == ".arrow":
+        feather.write_feather(table, path, compression="uncompressed")
+        return
+    with pa.OSFile(str(path), "wb") as sink:
+        sink.write((",".join(table.schema.names) + "\n").encode())
+        pa_csv.write_csv(table, sink, pa_csv.WriteOptions(include_header=False, quoting_style="none"))
+
+
+def _tables_stamp(tables_dir):
+    return {
+        path.name: [path.stat().st_size, path.stat().st_mtime_ns]
+        for path in sorted(Path(tables_dir).iterdir()) if path.suffix in TABLE_SUFFIXES
+    }
+
+
+def partition_tables(tables_dir, n_shards, shards_dir):
+    """Split every table in tables_dir into n_shards directories of the same
+    tables (shards_dir/<i>/), unless that's already been done for these
+    tables. Returns the shard directories."""
+    shards_dir = Path(shards_dir)
+    shard_dirs = [shards_dir / str(shard) for shard in range(n_shards)]
+    stamp_file = shards_dir / "tables.json"
+    stamp = {"tables_dir": str(tables_dir), "shards": n_shards, "tables": _tables_stamp(tables_dir)}
+    if stamp_file.exists() and json.loads(stamp_file.read_text()) == stamp:
+        return shard_dirs
+
+    for shard_dir in shard_dirs:
+        shard_dir.mkdir(parents=True, exist_ok=True)
+    for path in sorted(Path(tables_dir).iterdir()):
+        if path.suffix not in TABLE_SUFFIXES:
+            continue
+        table = _read_table(path)
+        patient_id = table.column("patient_id").cast(pa.int64()).to_numpy(zero_copy_only=False)
+        shards = shard_of(patient_id, n_shards)
+        # one stable sort by shard, then each shard is a slice (in the
+        # table's original order)
+        order = np.argsort(shards, kind="stable")
+        bounds = np.searchsorted(shards[order], np.arange(n_shards + 1))
+        table = table.take(order)
+        for shard, shard_dir in enumerate(shard_dirs):
+            _write_table(table.slice(bounds[shard], bounds[shard + 1] - bounds[shard]), shard_dir / path.name)
+    stamp_file.write_text(json.dumps(stamp, indent=2))
+    return shard_dirs
+
+
+def run_shards(definition, shard_dirs, shards_to_run, work_dir, runner, workers, definition_args=()):
+    """Run the definition on each of shards_to_run, at most `workers` at a
+    time, returning {shard: result}."""
+    outputs_dir = Path(work_dir) / "outputs"
+    outputs_dir.mkdir(parents=True, exist_ok=True)
+    waiting = list(shards_to_run)
+    running = {}  # pid -> (shard, start time, log file)
+    results = {}
+
+    while waiting or running:
+        while waiting and len(running) < workers:
+            shard = waiting.pop(0)
+            output = outputs_dir / f"{shard}.arrow"
+            output.unlink(missing_ok=True)
+            argv = [*shlex.split(runner), "generate-dataset", definition,
+                    "--dummy-tables", str(shard_dirs[shard]), "--output", str(output)]
+            if definition_args:
+                argv += ["--", *definition_args]
+            log_file = open(outputs_dir / f"{shard}.log", "w")
+            process = subprocess.Popen(argv, stdout=log_file, stderr=subprocess.STDOUT)
+            running[process.pid] = (shard, time.perf_counter(), log_file)
+
+        # wait4 gives the resource usage of the child that finished alone
+        pid, status, usage = os.wait4(-1, 0)
+        if pid not in running:
+            continue
+        shard, start, log_file = running.pop(pid)
+        log_file.close()
+        returncode = os.waitstatus_to_exitcode(status)
+        results[shard] = {
+            "succeeded": returncode == 0 and (outputs_dir / f"{shard}.arrow").exists(),
+            "wall_time_s": round(time.perf_counter() - start, 3),
+            # ru_maxrss is in kilobytes on Linux
+            "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+        }
+        print(f"shard {shard}: {'finished' if results[shard]['succeeded'] else 'FAILED'} "
+              f"in {results[shard]['wall_time_s']}s")
+    return results
+
+
+def merge_outputs(shard_outputs, output):
+    """Write the shards' record batches one after another to a single .arrow
+    file. Batches are read from memory-mapped files and written as they are;
+    string columns that ehrQL dictionary-encodes get one unified dictionary,
+    as the Arrow file format has one dictionary per column."""
+    sources = [pa.memory_map(str(path)) for path in shard_outputs]
+    tables = [pa.ipc.open_file(source).read_all() for source in sources]
+    schema = tables[0].schema
+    for path, table in zip(shard_outputs, tables):
+        if table.schema != schema:
+            raise ValueError(f"{path} has different columns from {shard_outputs[0]}")
+    merged = pa.concat_tables(tables)
+    if any(pa.types.is_dictionary(field.type) for field in schema):
+        merged = merged.unify_dictionaries()
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    temporary = output.with_name(output.name + ".tmp")
+    with pa.OSFile(str(temporary), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for batch in merged.to_batches():
+            writer.write_batch(batch)
+    temporary.replace(output)
+    for source in sources:
+        source.close()
+    return merged.num_rows
+
+
+def run_sharded(definition, tables_dir, output, n_shards, workers, runner, work_dir=WORK_DIR,
+                only_shards=None, force=False, definition_args=()):
+    work_dir = Path(work_dir) / Path(definition).stem
+    shard_dirs = partition_tables(tables_dir, n_shards, work_dir / "tables")
+
+    manifest_file = work_dir / "manifest.json"
+    # anything that changes the shards' outputs, so that old ones aren't merged
+    run = {"definition": definition, "fingerprint": definition_fingerprint(definition),
+           "tables_dir": str(tables_dir), "tables": _tables_stamp(tables_dir), "shards": n_shards,
+           "definition_args": list(definition_args)}
+    manifest = json.loads(manifest_file.read_text()) if manifest_file.exists() else {}
+    if manifest and manifest.get("run") != run and not force:
+        print("the definition, tables or arguments have changed since the last run: re-running every shard")
+    finished = manifest.get("finished", {}) if manifest.get("run") == run and not force else {}
+    finished = {int(shard): result for shard, result in finished.items()}
+
+    if only_shards is not None:
+        to_run = sorted(only_shards)
+    else:
+        to_run = [shard for shard in range(n_shards) if not finished.get(shard, {}).get("succeeded")]
+    results = run_shards(definition, shard_dirs, to_run, work_dir, runner, workers, definition_args)
+    finished.update(results)
+    manifest_file.write_text(json.dumps({"run": run, "finished": finished}, indent=2, sort_keys=True))
+
+    failed = [shard for shard in range(n_shards) if not finished.get(shard, {}).get("succeeded")]
+    if failed:
+        print(f"shard(s) {failed} failed or haven't run (logs in {work_dir / 'outputs'}); "
+              f"re-run with --shard {' '.join(map(str, failed))}")
+        return False
+    rows = merge_outputs([work_dir / "outputs" / f"{shard}.arrow" for shard in range(n_shards)], output)
+    print(f"merged {n_shards} shards into {output}: {rows:,} rows")
+    return True
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("definition")
+    parser.add_argument("--dummy-tables", required=True, help="directory of the tables to run against")
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--shards", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shard", type=int, nargs="+", help="re-run only these shards")
+    parser.add_argument("--force", action="store_true", help="re-run every shard")
+    parser.add_argument("--runner", default="opensafely exec ehrql:v1",
+                        help='how to run ehrQL, e.g. "python -m ehrql"')
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument("definition_args", nargs="*", help="arguments for the definition, after --")
+    args = parser.parse_args()
+
+    succeeded = run_sharded(
+        args.definition, args.dummy_tables, args.output, args.shards, args.workers, args.runner,
+        work_dir=args.work_dir, only_shards=args.shard, force=args.force, definition_args=args.definition_args,
+    )
+    if not succeeded:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
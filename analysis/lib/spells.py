@@ -0,0 +1,243 @@
+## Helpers for working with per-patient spells (practice registrations,
+## addresses, periods of being alive/under 100, age bands...) as sorted,
+## non-overlapping [start, end) ranges of days, outside of ehrQL.
+##
+## Dates are held as int64 days since 1970-01-01. A missing start date is never
+## in range and a missing end date is open-ended, as in ehrQL's for_patient_on().
+####
+
+import numpy as np
+import pandas as pd
+
+NEVER = np.iinfo(np.int64).max
+BEFORE_EVERYTHING = np.iinfo(np.int64).min
+
+
+def to_days(values, fill=None):
+    """Convert dates to int64 days since 1970-01-01, returning the days and a
+    mask of which dates were missing (replaced with `fill`, if given)."""
+    dates = pd.to_datetime(pd.Series(values), errors="coerce").to_numpy().astype("datetime64[D]")
+    days = dates.astype(np.int64)
+    missing = np.isnat(dates)
+    if fill is not None:
+        days = np.where(missing, fill, days)
+    return days, missing
+
+
+def from_days(days):
+    return np.asarray(days, dtype=np.int64).astype("datetime64[D]")
+
+
+def resolve_spells(patient_id, start, end, sort_keys):
+    """Turn possibly overlapping spells into non-overlapping segments, each
+    labelled with the row that ehrQL's for_patient_on() would pick on any date
+    in it: among the spells with start <= date and not (end < date), the last
+    when sorted by `sort_keys` (a list of arrays, most significant first).
+
+    `start` and `end` are inclusive dates in days (missing end = NEVER, rows
+    with a missing start should already have been dropped). Returns a
+    DataFrame of patient_id, start, end (half-open) and row.
+    """
+    rows = pd.DataFrame({
+        "patient_id": np.asarray(patient_id),
+        "start": np.asarray(start, dtype=np.int64),
+        # inclusive end date -> exclusive end
+        "end": np.where(np.asarray(end) == NEVER, NEVER, np.asarray(end, dtype=np.int64) + 1),
+        "row": np.arange(len(patient_id)),
+    })
+    rows = rows[rows["start"] < rows["end"]]
+    if rows.empty:
+        return pd.DataFrame({"patient_id": [], "start": [], "end": [], "row": []}, dtype=np.int64)
+
+    # rank of each row in the priority order (higher wins)
+    order = np.lexsort([np.asarray(k)[rows["row"]] for k in reversed(sort_keys)])
+    rows["rank"] = np.empty(len(rows), dtype=np.int64)
+    rows.iloc[order, rows.columns.get_loc("rank")] = np.arange(len(rows))
+
+    # elementary segments between consecutive boundaries of each patient's
+    # spells; each spell covers a contiguous run [first, last) of them
+    patient_id = rows["patient_id"].to_numpy()
+    patient_ids, position = np.unique(patient_id, return_inverse=True)
+    start_keys = _keys(position, rows["start"])
+    end_keys = _keys(position, rows["end"])
+    boundaries, first_seen = np.unique(np.concatenate([start_keys, end_keys]), return_index=True)
+    boundary_days = np.concatenate([rows["start"].to_numpy(), rows["end"].to_numpy()])[first_seen]
+    first = np.searchsorted(boundaries, start_keys)
+    last = np.searchsorted(boundaries, end_keys)
+
+    # the highest-ranked spell covering each elementary segment
+    winner = _range_max(len(boundaries) - 1, first, last, rows["rank"].to_numpy())
+    segment_position = boundaries[:-1] >> 32
+    covered = (winner >= 0) & (segment_position == boundaries[1:] >> 32)
+    row_of_rank = np.empty(len(rows), dtype=np.int64)
+    row_of_rank[rows["rank"].to_numpy()] = rows["row"].to_numpy()
+    winners = pd.DataFrame({
+        "patient_id": patient_ids[segment_position[covered]],
+        "start": boundary_days[:-1][covered],
+        "end": boundary_days[1:][covered],
+        "row": row_of_rank[winner[covered]],
+    })
+    return _merge_adjacent(winners, "row")
+
+
+def _range_max(n, first, last, values):
+    """For each of n slots, the largest of `values` whose [first, last) range
+    covers it (-1 where none does).
+
+    Each range is written to the two power-of-two blocks that cover it, one
+    level per block size, and the levels are then pushed down to single slots,
+    so the work grows with the log of the longest range rather than its length.
+    """
+    lengths = last - first
+    levels = int(lengths.max()).bit_length() if len(lengths) else 1
+    best = np.full((levels, max(n, 0)), -1, dtype=np.int64)
+    level = np.log2(np.maximum(lengths, 1)).astype(np.int64)
+    size = np.left_shift(1, level)
+    np.maximum.at(best, (level, first), values)
+    np.maximum.at(best, (level, last - size), values)
+    for j in range(levels - 1, 0, -1):
+        half = 1 << (j - 1)
+        np.maximum(best[j - 1], best[j], out=best[j - 1])
+        np.maximum(best[j - 1, half:], best[j, :n - half], out=best[j - 1, half:])
+    return best[0]
+
+
+def _merge_adjacent(segments, value_column):
+    """Merge touching segments of the same patient that carry the same value."""
+    segments = segments.reset_index(drop=True)
+    if segments.empty:
+        return segments
+    patient_id = segments["patient_id"].to_numpy()
+    values = segments[value_column].to_numpy()
+    continues = np.r_[
+        False,
+        (patient_id[1:] == patient_id[:-1])
+        & (segments["start"].to_numpy()[1:] == segments["end"].to_numpy()[:-1])
+        & (values[1:] == values[:-1]),
+    ]
+    group = np.cumsum(~continues)
+    return segments.groupby(group).agg(
+        patient_id=("patient_id", "first"),
+        start=("start", "first"),
+        end=("end", "last"),
+        **{value_column: (value_column, "first")},
+    ).reset_index(drop=True)
+
+
+def intersect(left, right):
+    """Intersect two sets of segments per patient, keeping the other columns
+    of both (clashing names from `right` get a `_right` suffix).
+
+    `right` must not overlap itself within a patient. Sorted by patient and
+    start, its starts and ends are then both in order, so the run of `right`
+    segments overlapping each `left` one is found with two binary searches.
+    """
+    right = right.sort_values(["patient_id", "start"], kind="stable").reset_index(drop=True)
+    patient_ids = np.unique(np.concatenate([left["patient_id"].to_numpy(), right["patient_id"].to_numpy()]))
+    left_position = np.searchsorted(patient_ids, left["patient_id"].to_numpy())
+    right_position = np.searchsorted(patient_ids, right["patient_id"].to_numpy())
+
+    # right segments ending after the left one starts, up to the first
+    # starting on or after it ends
+    first = np.searchsorted(_keys(right_position, right["end"]), _keys(left_position, left["start"]), side="right")
+    last = np.searchsorted(_keys(right_position, right["start"]), _keys(left_position, left["end"]), side="left")
+    counts = np.maximum(last - first, 0)
+    left_index = np.repeat(np.arange(len(left)), counts)
+    right_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+
+    pairs = left.iloc[left_index].reset_index(drop=True)
+    right_columns = right.drop(columns=["patient_id"]).iloc[right_index].reset_index(drop=True)
+    right_columns.columns = [f"{c}_right" if c in pairs.columns else c for c in right_columns.columns]
+    pairs = pd.concat([pairs, right_columns], axis=1)
+    pairs["start"] = np.maximum(pairs["start"], pairs["start_right"])
+    pairs["end"] = np.minimum(pairs["end"], pairs["end_right"])
+    pairs = pairs[pairs["start"] < pairs["end"]]
+    return pairs.drop(columns=["start_right", "end_right"]).reset_index(drop=True)
+
+
+def anniversaries(dob_days, years):
+    """Return the date (in days) on which each patient turns `years` old, as
+    ehrQL's age_on() counts it (someone born on 29 Feb turns a year older on
+    1 Mar in non-leap years)."""
+    dob = pd.to_datetime(from_days(dob_days))
+    target = pd.DataFrame({"year": dob.year + years, "month": dob.month, "day": dob.day})
+    result = pd.to_datetime(target, errors="coerce")
+    leap_day = result.isna()
+    result[leap_day] = pd.to_datetime(
+        pd.DataFrame({"year": target["year"][leap_day], "month": 3, "day": 1})
+    )
+    return result.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+def age_band_segments(patient_id, dob_days, bands):
+    """Split each patient's life into segments by age band.
+
+    `bands` is a list of (lower age, label) in increasing order; each band runs
+    until the next lower age (the last one is open-ended).
+    """
+    frames = []
+    lowers = [lower for lower, _ in bands]
+    for i, (lower, label) in enumerate(bands):
+        start = anniversaries(dob_days, lower) if lower > 0 else np.asarray(dob_days)
+        end = anniversaries(dob_days, lowers[i + 1]) if i + 1 < len(bands) else np.full(len(dob_days), NEVER)
+        frames.append(pd.DataFrame({"patient_id": patient_id, "start": start, "end": end, "value": label}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def count_active(starts, ends, query_days):
+    """Count the segments covering each query date with a sorted sweep:
+    the number that have started by then minus the number that have ended."""
+    starts = np.sort(np.asarray(starts, dtype=np.int64))
+    ends = np.sort(np.asarray(ends, dtype=np.int64))
+    query_days = np.asarray(query_days, dtype=np.int64)
+    return (
+        np.searchsorted(starts, query_days, side="right")
+        - np.searchsorted(ends, query_days, side="right")
+    )
+
+
+# a patient's position and a day packed into one sortable int64: the position
+# in the high 32 bits and the day (clipped to +/- 2**31 days) in the low 32
+_DAY_OFFSET = 2**31
+
+
+def _keys(position, days):
+    days = np.clip(np.asarray(days, dtype=np.int64), -_DAY_OFFSET, _DAY_OFFSET - 1) + _DAY_OFFSET
+    return (np.asarray(position, dtype=np.int64) << 32) | days
+
+
+class SpellIndex:
+    """Each patient's non-overlapping spells (as resolve_spells() gives them),
+    sorted by patient and start, with the values of some columns. lookup()
+    finds the spell covering any number of (patient, date) pairs with one
+    vectorised binary search, rather than re-searching each patient's spells
+    for every date."""
+
+    def __init__(self, segments, columns):
+        segments = segments.sort_values(["patient_id", "start"], kind="stable")
+        patient_id = segments["patient_id"].to_numpy()
+        self.patient_ids = np.unique(patient_id)
+        self.keys = _keys(np.searchsorted(self.patient_ids, patient_id), segments["start"].to_numpy())
+        self.ends = segments["end"].to_numpy(dtype=np.int64)
+        self.values = {column: segments[column].to_numpy() for column in columns}
+
+    def lookup(self, patient_id, days):
+        """Return whether a spell covers each (patient_id, day) and a DataFrame
+        of its column values (None where none does)."""
+        patient_id = np.asarray(patient_id)
+        days = np.asarray(days, dtype=np.int64)
+        position = np.minimum(np.searchsorted(self.patient_ids, patient_id), max(len(self.patient_ids) - 1, 0))
+        known = (self.patient_ids[position] == patient_id) if len(self.patient_ids) else np.zeros(len(patient_id), bool)
+
+        # the last spell starting on or before the day, if it's the patient's
+        # and hasn't ended
+        i = np.searchsorted(self.keys, _keys(position, days), side="right") - 1
+        found = known & (i >= 0)
+        i = np.maximum(i, 0)
+        found[found] = (self.keys[i[found]] >> 32 == position[found]) & (days[found] < self.ends[i[found]])
+
+        values = pd.DataFrame({
+            column: np.where(found, column_values[i], None) if len(column_values) else np.full(len(days), None)
+            for column, column_values in self.values.items()
+        })
+        return found, values
@@ -0,0 +1,173 @@
+## Table-driven boundary cases for the base cohorts definition.
+##
+## Each case below is a patient template (the dates that sit on a boundary of
+## the inclusion criteria) plus whether it should be in the full study and KM
+## cohorts (every patient has a migration code, so the population denominator
+## cohort is the full study cohort, and the population is either). Every
+## case is expanded into `copies` synthetic patients that differ only in their
+## migration code (taken in turn from the migration-status codelist) and sex,
+## so the whole codelist is exercised too. The expected columns are worked out
+## from the template, and everything is checked in a single `assure` run.
+##
+## Patients for case i get ids (i + 1) * CASE_ID_BLOCK + copy, so a failing
+## patient id identifies its case; running this module runs assure and reports
+## mismatches grouped by case.
+##
+## Usage (from the repo root):
+##   python -m analysis.testing.edge_cases [--runner "opensafely exec ehrql:v1"]
+####
+
+import re
+import shlex
+import subprocess
+from argparse import ArgumentParser
+from collections import Counter
+from datetime import date, timedelta
+
+from analysis.lib.codelist_registry import load_codelist
+from analysis.lib.migration_categories import ASYLUM_REFUGEE, COB, INTERPRETER, category_table
+
+TEST_FILE = "analysis/testing/test_base_cohorts_definition.py"
+CASE_ID_BLOCK = 100_000
+
+study_start_date = date(2009, 1, 1)
+study_end_date = date(2024, 12, 31)
+
+# case name -> (template, in_full_study_cohort, in_km_cohort). Anything not
+# given in the template comes from DEFAULTS.
+
+DEFAULTS = {
+    "date_of_birth": date(1980, 6, 15),
+    "date_of_death": None,
+    "ons_death_date": None,
+    "registration_start": date(2005, 3, 1),
+    "registration_end": None,
+    "migration_code_date": date(2012, 5, 1),
+}
+
+CASES = {
+    # death on the study start date
+    "tpp_death_on_study_start": ({"date_of_death": study_start_date}, True, True),
+    "tpp_death_day_before_study_start": ({"date_of_death": date(2008, 12, 31)}, False, False),
+    "ons_death_on_study_start": ({"ons_death_date": study_start_date}, True, True),
+    "ons_death_day_before_study_start": ({"ons_death_date": date(2008, 12, 31)}, False, False),
+    # age exactly 100 at the study start
+    "age_exactly_100": ({"date_of_birth": date(1909, 1, 1)}, True, True),
+    "age_100_turning_101_next_day": ({"date_of_birth": date(1908, 1, 2)}, True, True),
+    "age_exactly_101": ({"date_of_birth": date(1908, 1, 1)}, False, False),
+    "born_29_february_aged_100": ({"date_of_birth": date(1908, 2, 29)}, True, True),
+    # registration ending on a study boundary
+    "registration_ends_on_study_end": ({"registration_end": study_end_date}, True, True),
+    "registration_ends_day_after_study_end": ({"registration_end": date(2025, 1, 1)}, False, True),
+    "registration_ends_on_study_start": ({"registration_end": study_start_date}, False, False),
+    "registration_ends_day_after_study_start": ({"registration_end": date(2009, 1, 2)}, True, True),
+    # a migration code on the registration date
+    "code_on_registration_date": ({"migration_code_date": date(2005, 3, 1)}, True, True),
+    "code_day_before_registration": ({"migration_code_date": date(2005, 2, 28)}, True, True),
+    # TPP and ONS disagree about the death
+    "tpp_death_only_before_start": ({"date_of_death": date(2007, 4, 1)}, False, False),
+    "ons_death_only_before_start": ({"ons_death_date": date(2007, 4, 1)}, False, False),
+    "tpp_after_start_ons_before_start": (
+        {"date_of_death": date(2015, 1, 1), "ons_death_date": date(2008, 6, 1)}, False, False),
+    "tpp_before_start_ons_after_start": (
+        {"date_of_death": date(2008, 6, 1), "ons_death_date": date(2015, 1, 1)}, False, False),
+    "tpp_and_ons_after_start_on_different_dates": (
+        {"date_of_death": date(2015, 1, 1), "ons_death_date": date(2015, 2, 3)}, True, True),
+}
+
+
+def _patient(template, code, sex, in_full_study_cohort, in_km_cohort):
+    mask = category_table()[code]
+    first_code = template["migration_code_date"]
+    registration_start = template["registration_start"]
+    deaths_and_deregistration = [
+        template["date_of_death"], template["ons_death_date"], template["registration_end"],
+    ]
+    return {
+        "patients": {
+            "date_of_birth": template["date_of_birth"],
+            "sex": sex,
+            "date_of_death": template["date_of_death"],
+        },
+        "practice_registrations": [
+            {"start_date": registration_start, "end_date": template["registration_end"]},
+        ],
+        "clinical_events": [
+            {"date": first_code, "snomedct_code": code},
+        ],
+        "addresses": [],
+        "ons_deaths": {"date": template["ons_death_date"]},
+        "expected_in_population": in_full_study_cohort or in_km_cohort,
+        "expected_columns": {
+            "in_full_study_cohort": in_full_study_cohort,
+            "in_population_denominator_cohort": in_full_study_cohort,
+            "in_km_cohort": in_km_cohort,
+            "date_of_first_migration_code": first_code,
+            "number_of_migration_codes": 1,
+            "sex": sex,
+            "has_cob_migrant_code": bool(mask & COB),
+            "has_asylum_or_refugee_migrant_code": bool(mask & ASYLUM_REFUGEE),
+            "has_interpreter_migrant_code": bool(mask & INTERPRETER),
+            "date_of_first_practice_registration": registration_start,
+            "time_to_first_migration_code": (first_code - registration_start).days,
+            "TPP_death_date": template["date_of_death"],
+            "ons_death_date": template["ons_death_date"],
+            "baseline_date": registration_start - timedelta(days=1),
+            "date_of_deregistration": template["registration_end"],
+            "censor_date": min(
+                [d for d in deaths_and_deregistration if d is not None] + [study_end_date]
+            ),
+            "processed_first_migration_code_date": max(first_code, registration_start),
+        },
+    }
+
+
+def edge_case_test_data(copies=200):
+    """Return assure test data for every case, `copies` patients each."""
+    codes = load_codelist("all_migrant_codes")
+    test_data = {}
+    n = 0
+    for i, (name, (overrides, in_full_study_cohort, in_km_cohort)) in enumerate(CASES.items()):
+        template = {**DEFAULTS, **overrides}
+        for copy in range(copies):
+            code = codes[n % len(codes)]
+            sex = "male" if copy % 2 else "female"
+            test_data[(i + 1) * CASE_ID_BLOCK + copy] = _patient(
+                template, code, sex, in_full_study_cohort, in_km_cohort
+            )
+            n += 1
+    return test_data
+
+
+def case_for_patient(patient_id):
+    return list(CASES)[patient_id // CASE_ID_BLOCK - 1]
+
+
+def mismatches_by_case(assure_output):
+    """Count the failing patients in assure's output by case (the hand-written
+    patients in the test file, with small ids, are left out)."""
+    failing = {int(patient_id) for patient_id in re.findall(r"Patient (\d+)", assure_output)}
+    return Counter(
+        case_for_patient(patient_id) for patient_id in failing if patient_id >= CASE_ID_BLOCK
+    )
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--runner", default="opensafely exec ehrql:v1")
+    args = parser.parse_args()
+
+    result = subprocess.run(
+        [*shlex.split(args.runner), "assure", TEST_FILE], capture_output=True, text=True
+    )
+    output = result.stdout + result.stderr
+    mismatches = mismatches_by_case(output)
+    if result.returncode != 0 and not mismatches:
+        print(output)
+    for name in CASES:
+        print(f"{'FAIL' if mismatches[name] else 'ok':>4}  {name} ({mismatches[name]} mismatches)")
+    raise SystemExit(result.returncode)
+
+
+if __name__ == "__main__":
+    main()
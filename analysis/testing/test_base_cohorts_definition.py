@@ -1,5 +1,7 @@
 from datetime import date
-from dataset_definition_full_study_cohort import dataset
+from dataset_definition_base_cohorts import dataset
+
+from analysis.testing.edge_cases import edge_case_test_data
 
 test_data = {
     # Expected in population 
@@ -39,6 +41,9 @@ test_data = {
         },
         "expected_in_population": True,
         "expected_columns": {
+            "in_full_study_cohort": True,
+            "in_population_denominator_cohort": True,
+            "in_km_cohort": True,
             "date_of_first_migration_code": date(2010, 1, 1),
             "number_of_migration_codes": 1,
             "sex": "male",
@@ -47,9 +52,6 @@ test_data = {
             "has_interpreter_migrant_code": False,
             "date_of_first_practice_registration": date(2003, 1, 1),
             "time_to_first_migration_code": 2557,
-            "latest_ethnicity_code": "10292001",
-            "latest_ethnicity_group": "Chinese or Other Ethnic Groups",
-            "year_of_birth": 1999,
             "msoa_code": "E02000864",
             "TPP_death_date": None,
             "ons_death_date": None
@@ -91,6 +93,9 @@ test_data = {
         },
         "expected_in_population": False,
         "expected_columns": {
+            "in_full_study_cohort": True,
+            "in_population_denominator_cohort": True,
+            "in_km_cohort": True,
             "date_of_first_migration_code": date(2010, 1, 1),
             "number_of_migration_codes": 1,
             "sex": "intersex",
@@ -99,9 +104,6 @@ test_data = {
             "has_interpreter_migrant_code": False,
             "date_of_first_practice_registration": date(2003, 1, 1),
             "time_to_first_migration_code": 2557,
-            "latest_ethnicity_code": "10292001",
-            "latest_ethnicity_group": "Chinese or Other Ethnic Groups",
-            "year_of_birth": 1999,
             "msoa_code": "E02000864",
             "imd_decile": "3",
             "imd_quintile": "2",
@@ -109,4 +111,9 @@ test_data = {
             "ons_death_date": None
             }
     }
-}
\ No newline at end of file
+}
+
+# Boundary cases (death on the study start, age exactly 100, registration
+# ending on the study end...), generated in bulk; see edge_cases.py
+
+test_data.update(edge_case_test_data())
@@ -0,0 +1,95 @@
+from collections import Counter
+
+import numpy as np
+import pyarrow as pa
+
+from analysis.code_usage.code_combinations import CodeBitsets, count_combinations, top_combinations, venn_counts
+from analysis.lib.migration_categories import ASYLUM_REFUGEE, COB
+
+COB_CODE = "1193634005"
+ASYLUM_CODE = "1057331000000104"
+OTHER_CODE = "999"
+
+
+def _write_batches(path, batches):
+    """An event-level file with one record batch per list of (patient_id, code)."""
+    schema = pa.schema([("patient_id", pa.int64()), ("snomedct_code", pa.string())])
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for rows in batches:
+            writer.write_batch(pa.record_batch(
+                [pa.array([row[0] for row in rows], pa.int64()), pa.array([row[1] for row in rows], pa.string())],
+                schema=schema,
+            ))
+    return path
+
+
+def _patients(path, batches):
+    code_bitsets = CodeBitsets([COB_CODE, ASYLUM_CODE])
+    combinations, venn = count_combinations(_write_batches(path, batches), code_bitsets)
+    by_codes = {tuple(code_bitsets.decode(bitset)): n for bitset, n in combinations.items()}
+    assert sum(venn.values()) == sum(combinations.values())
+    return by_codes
+
+
+def test_batch_with_no_codes_in_the_codelist(tmp_path):
+    patients = _patients(tmp_path / "events.arrow", [
+        [(1, COB_CODE), (2, COB_CODE)],
+        [(3, OTHER_CODE)],
+    ])
+    assert patients == {(COB_CODE,): 2}
+
+
+def test_patient_split_across_batches(tmp_path):
+    patients = _patients(tmp_path / "events.arrow", [
+        [(1, COB_CODE), (2, COB_CODE)],
+        [(2, ASYLUM_CODE), (3, ASYLUM_CODE)],
+    ])
+    assert patients == {(COB_CODE,): 1, tuple(sorted([COB_CODE, ASYLUM_CODE])): 1, (ASYLUM_CODE,): 1}
+
+
+def test_patient_split_across_an_empty_batch(tmp_path):
+    patients = _patients(tmp_path / "events.arrow", [
+        [(1, COB_CODE), (2, COB_CODE)],
+        [],
+        [(2, ASYLUM_CODE)],
+    ])
+    assert patients == {(COB_CODE,): 1, tuple(sorted([COB_CODE, ASYLUM_CODE])): 1}
+
+
+def test_patient_split_across_a_batch_of_only_their_other_codes(tmp_path):
+    patients = _patients(tmp_path / "events.arrow", [
+        [(1, COB_CODE), (2, COB_CODE)],
+        [(2, OTHER_CODE)],
+        [(2, ASYLUM_CODE), (3, OTHER_CODE)],
+    ])
+    assert patients == {(COB_CODE,): 1, tuple(sorted([COB_CODE, ASYLUM_CODE])): 1}
+
+
+def test_venn_counts(tmp_path):
+    code_bitsets = CodeBitsets([COB_CODE, ASYLUM_CODE])
+    _, venn = count_combinations(_write_batches(tmp_path / "events.arrow", [
+        [(1, COB_CODE), (2, COB_CODE), (2, ASYLUM_CODE)],
+        [(3, ASYLUM_CODE)],
+    ]), code_bitsets)
+    venn = venn_counts(venn, min_count=0).set_index(["has_cob_migrant_code", "has_asylum_or_refugee_migrant_code"])
+    assert venn["number_of_patients"].groupby(level=[0, 1]).sum().to_dict() == {
+        (True, False): 1, (True, True): 1, (False, True): 1,
+    }
+
+
+def test_numbers_of_patients_are_rounded(tmp_path):
+    code_bitsets = CodeBitsets([COB_CODE, ASYLUM_CODE])
+    cob, asylum = (code_bitsets.fold(
+        np.array([1]), code_bitsets.positions(pa.array([code]))
+    )[1][0].tobytes() for code in [COB_CODE, ASYLUM_CODE])
+    combinations = Counter({cob: 7, asylum: 6})
+
+    top = top_combinations(combinations, code_bitsets, top_n=2)
+    assert top["number_of_patients"].tolist() == [9, 3]
+    assert top["codes"].tolist() == [COB_CODE, ASYLUM_CODE]
+    assert top_combinations(combinations, code_bitsets, top_n=2, min_count=0)["number_of_patients"].tolist() == [7, 6]
+
+    # summed over the masks with the same four categories, then rounded
+    venn = venn_counts(Counter({COB: 4, COB | 1: 3, ASYLUM_REFUGEE: 1}))
+    assert venn.set_index(["has_cob_migrant_code", "has_asylum_or_refugee_migrant_code"])[
+        "number_of_patients"].to_dict() == {(True, False): 9, (False, True): 3}
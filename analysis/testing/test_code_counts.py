@@ -0,0 +1,21 @@
+from collections import Counter
+
+from analysis.code_usage.code_counts import counts_to_frame
+
+
+def test_counts_are_rounded_to_the_midpoint_of_multiples_of_min_count():
+    counter = Counter({("a",): 1, ("b",): 6, ("c",): 7, ("d",): 12, ("e",): 100})
+    frame = counts_to_frame(counter, ["snomedct_code"])
+    assert frame["number_of_codes"].tolist() == [3, 3, 9, 9, 99]
+
+
+def test_counts_are_not_rounded_without_min_count():
+    counter = Counter({("a", 2010): 1, ("a", 2011): 7})
+    frame = counts_to_frame(counter, ["snomedct_code", "year"], min_count=0)
+    assert frame["number_of_codes"].tolist() == [1, 7]
+
+
+def test_no_counts():
+    frame = counts_to_frame(Counter(), ["migration_category"])
+    assert frame.columns.tolist() == ["migration_category", "number_of_codes"]
+    assert frame.empty
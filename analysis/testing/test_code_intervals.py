@@ -0,0 +1,104 @@
+import datetime
+
+import numpy as np
+import pyarrow as pa
+
+from analysis.code_usage.code_intervals import (
+    CATEGORIES,
+    IntervalTallies,
+    _quantile,
+    category_transitions,
+    codes_per_patient,
+    first_categories,
+    interval_summary,
+    tally_intervals,
+)
+from analysis.lib.migration_categories import ASYLUM_REFUGEE, CATEGORY_LABELS, OTHER_LABEL
+from analysis.lib.migration_categories import COB as COB_BIT
+
+COB = CATEGORY_LABELS[COB_BIT]
+ASYLUM = CATEGORY_LABELS[ASYLUM_REFUGEE]
+DAY = datetime.date(2020, 1, 1)
+
+
+def _write_batches(path, batches):
+    """An event-level file with one record batch per list of (patient_id, day, category)."""
+    schema = pa.schema([("patient_id", pa.int64()), ("date", pa.date32()), ("migration_category", pa.string())])
+    with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for rows in batches:
+            writer.write_batch(pa.record_batch(
+                [
+                    pa.array([row[0] for row in rows], pa.int64()),
+                    pa.array([None if row[1] is None else DAY + datetime.timedelta(row[1]) for row in rows], pa.date32()),
+                    pa.array([row[2] for row in rows], pa.string()),
+                ],
+                schema=schema,
+            ))
+    return path
+
+
+def _intervals(tallies, name):
+    histogram = tallies.histograms[name]
+    return np.repeat(np.arange(len(histogram)), histogram).tolist()
+
+
+def test_patient_split_across_batches(tmp_path):
+    tallies = tally_intervals(_write_batches(tmp_path / "events.arrow", [
+        [(1, 0, COB), (1, 10, COB), (2, 0, ASYLUM)],
+        [(2, 5, COB)],
+        [],
+        [(2, 7, None), (3, 3, ASYLUM)],
+    ]))
+    assert _intervals(tallies, "first_to_second_code") == [5, 10]
+    assert _intervals(tallies, "consecutive_codes") == [2, 5, 10]
+    assert _intervals(tallies, "first_to_last_code") == [7, 10]
+    assert tallies.first_category[CATEGORIES.index(COB)] == 1
+    assert tallies.first_category[CATEGORIES.index(ASYLUM)] == 2
+    assert tallies.transitions[CATEGORIES.index(ASYLUM), CATEGORIES.index(COB)] == 1
+    assert tallies.transitions[CATEGORIES.index(COB), CATEGORIES.index(OTHER_LABEL)] == 1
+    assert tallies.codes_per_patient.tolist() == [0, 1, 1, 1]
+
+
+def test_codes_without_a_date_are_dropped(tmp_path):
+    tallies = tally_intervals(_write_batches(tmp_path / "events.arrow", [
+        [(1, 0, COB), (1, None, COB)],
+        [(1, None, ASYLUM), (1, 4, ASYLUM)],
+    ]))
+    assert _intervals(tallies, "first_to_second_code") == [4]
+    assert tallies.codes_per_patient.tolist() == [0, 0, 1]
+
+
+def test_quantile():
+    # intervals of 1, 2, 2, 3 and 10 days
+    cumulative = np.cumsum(np.bincount([1, 2, 2, 3, 10]))
+    assert [_quantile(cumulative, q) for q in [0.1, 0.2, 0.25, 0.5, 0.8, 0.9, 1]] == [1, 1, 2, 2, 3, 10, 10]
+    # an interval at the top of the histogram
+    assert _quantile(np.cumsum(np.bincount([0, 5])), 0.9) == 5
+
+
+def _tallies(intervals):
+    tallies = IntervalTallies()
+    days = np.cumsum(np.r_[0, intervals])
+    tallies.add_patients(np.zeros(len(days), dtype=np.int64), days, np.zeros(len(days), dtype=np.int64))
+    return tallies
+
+
+def test_counts_are_rounded_and_small_quantiles_left_out():
+    summary = interval_summary(_tallies(np.arange(1, 60))).set_index("interval")
+    # 59 consecutive intervals: too few for a 10th centile with 6 below it
+    assert summary.loc["consecutive_codes", "number_of_intervals"] == 57
+    assert summary.loc[["consecutive_codes", "first_to_second_code"], ["mean_days", "median"]].isna().all().all()
+
+    summary = interval_summary(_tallies(np.arange(1, 61))).set_index("interval")
+    assert summary.loc["consecutive_codes", "number_of_intervals"] == 57
+    assert summary.loc["consecutive_codes", "median"] == 30
+    assert summary.loc["consecutive_codes", "p10"] == 6
+
+    unrounded = interval_summary(_tallies([4]), min_count=0).set_index("interval")
+    assert unrounded.loc["first_to_second_code", ["number_of_intervals", "median"]].tolist() == [1, 4]
+
+    # one patient with three codes in the first category
+    tallies = _tallies([1, 2])
+    assert first_categories(tallies)["number_of_patients"].tolist() == [3] + [0] * (len(CATEGORIES) - 1)
+    assert category_transitions(tallies)["number_of_transitions"].tolist() == [3] + [0] * (len(CATEGORIES) ** 2 - 1)
+    assert codes_per_patient(tallies).values.tolist() == [[3, 3]]
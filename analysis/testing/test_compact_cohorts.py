@@ -0,0 +1,59 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from analysis.create_cohorts.compact_cohorts import MAX_DICTIONARY_SIZE, compact_cohort, restore_schema
+
+N = MAX_DICTIONARY_SIZE + 1
+
+
+def _cohort(path):
+    """A cohort in several record batches, as ehrQL writes them: int64,
+    string (some already dictionary-encoded), date and boolean columns with
+    missing values."""
+    rows = range(N)
+    table = pa.table({
+        "patient_id": pa.array(rows, pa.int64()),
+        "number_of_codes": pa.array([None if i % 7 == 0 else i % 100 for i in rows], pa.int64()),
+        "days": pa.array([i * 100_000 - 10_000_000 for i in rows], pa.int64()),
+        "never_known": pa.array([None] * N, pa.int64()),
+        "sex": pa.array([None if i % 11 == 0 else ["male", "female"][i % 2] for i in rows]),
+        "region": pa.array([["London", "North East", "South West"][i % 3] for i in rows]).dictionary_encode(),
+        # MAX_DICTIONARY_SIZE distinct values (and a missing one) is
+        # dictionary encoded; one more is not
+        "msoa_code": pa.array([f"E{i:08d}" if i < MAX_DICTIONARY_SIZE else None for i in rows]),
+        "practice": pa.array([f"P{i:08d}" for i in rows]),
+        "date_of_birth": pa.array(
+            [None if i % 13 == 0 else datetime.date(1920, 1, 1) + datetime.timedelta(i) for i in rows], pa.date32()
+        ),
+        "has_code": pa.array([None if i % 17 == 0 else i % 2 == 0 for i in rows]),
+    })
+    feather.write_feather(table, path, compression="uncompressed", chunksize=10_000)
+    return table
+
+
+def test_compacting_and_restoring_gives_the_original_table(tmp_path):
+    original = _cohort(tmp_path / "cohort.arrow")
+    compact_cohort(tmp_path / "cohort.arrow", tmp_path / "compact.arrow")
+
+    compacted = feather.read_table(tmp_path / "compact.arrow")
+    types = dict(zip(compacted.column_names, compacted.schema.types))
+    assert types["patient_id"] == pa.int64()
+    assert types["number_of_codes"] == pa.int8()
+    assert types["days"] == pa.int64()
+    assert types["sex"] == pa.dictionary(pa.int8(), pa.string())
+    assert types["region"] == pa.dictionary(pa.int8(), pa.string())
+    assert types["msoa_code"] == pa.dictionary(pa.int16(), pa.string())
+    assert types["practice"] == pa.string()
+
+    restored = restore_schema(compacted)
+    assert restored.schema.equals(original.schema)
+    assert restored.equals(original)
+
+
+def test_compacting_in_place(tmp_path):
+    original = _cohort(tmp_path / "cohort.arrow")
+    compact_cohort(tmp_path / "cohort.arrow", tmp_path / "cohort.arrow")
+    assert restore_schema(feather.read_table(tmp_path / "cohort.arrow")).equals(original)
+    assert [path.name for path in tmp_path.iterdir()] == ["cohort.arrow"]
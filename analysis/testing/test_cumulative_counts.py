@@ -0,0 +1,163 @@
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pandas.testing
+import pytest
+
+from analysis.annual_counts.cumulative_counts import GROUP_COLUMNS, MEASURE_COLUMNS, calculate_counts, yearly_intervals
+from analysis.lib.dummy_tables import write_dummy_tables
+from analysis.lib.reference_cohorts import annual_counts, annual_counts_inputs, read_tables
+
+DUMMY_TABLES = "dummy_tables"
+
+# generate_annual_migrant_counts.py's measures over the dummy tables, as the
+# reference cohorts evaluate them interval by interval. Regenerate with
+#   python -m analysis.lib.reference_cohorts --dummy-tables dummy_tables --cohorts patient_features \
+#       --annual-counts-output analysis/testing/fixtures/annual_migrant_counts_dummy_tables.csv
+# ehrQL's own measures are checked against it when ehrQL is installed.
+GOLDEN_MEASURES = "analysis/testing/fixtures/annual_migrant_counts_dummy_tables.csv"
+
+
+def _ehrql(command, definition, output):
+    subprocess.run(
+        [sys.executable, "-m", "ehrql", command, definition,
+         "--dummy-tables", DUMMY_TABLES, "--output", output],
+        check=True,
+    )
+
+
+def _sorted(counts):
+    keys = ["measure", "interval_start", *GROUP_COLUMNS]
+    counts = counts[MEASURE_COLUMNS + GROUP_COLUMNS].astype({column: str for column in GROUP_COLUMNS})
+    return counts.sort_values(keys).reset_index(drop=True)
+
+
+def _round_trip(counts, path):
+    # as the scripts write them, so that missing groups read back the same way
+    counts.to_csv(path, index=False)
+    return pd.read_csv(path)
+
+
+def test_cumulative_counts_match_the_golden_measures(tmp_path):
+    patients, registrations, addresses = annual_counts_inputs(read_tables(DUMMY_TABLES))
+    interval_starts, interval_ends = yearly_intervals()
+    counts = calculate_counts(patients, registrations, addresses, interval_starts, interval_ends)
+
+    golden = pd.read_csv(GOLDEN_MEASURES)
+    assert len(golden)
+    pandas.testing.assert_frame_equal(
+        _sorted(_round_trip(counts, tmp_path / "cumulative.csv")), _sorted(golden), check_dtype=False
+    )
+
+
+def _on_boundaries(tables, boundaries, rng, fraction=0.2):
+    # moves a fraction of every date to the day before, on or after an interval
+    # boundary, keeping each spell's start on or before its end
+    days = np.concatenate([boundaries - 1, boundaries, boundaries + 1])
+    for table in tables.values():
+        for column in [c for c in table.columns if c == "date" or c.endswith("_date") or c.startswith("date_")]:
+            moved = rng.random(len(table)) < fraction
+            table.loc[moved, column] = rng.choice(days, moved.sum())
+        if "start_date" in table.columns:
+            backwards = (table["start_date"] > table["end_date"]).fillna(False).to_numpy()
+            table.loc[backwards, "end_date"] = table.loc[backwards, "start_date"]
+
+
+def test_cumulative_counts_match_the_reference_measures_on_synthetic_tables(tmp_path):
+    # the dummy tables are too small to have codes or spells on the interval
+    # boundaries, so check a synthetic population with dates moved onto them
+    write_dummy_tables(tmp_path / "tables", population_size=2000, seed=7)
+    tables = read_tables(tmp_path / "tables")
+    interval_starts, interval_ends = yearly_intervals()
+    _on_boundaries(tables, np.concatenate([interval_starts, interval_ends]), np.random.default_rng(7))
+    counts = calculate_counts(*annual_counts_inputs(tables), interval_starts, interval_ends)
+
+    pandas.testing.assert_frame_equal(
+        _sorted(_round_trip(counts, tmp_path / "cumulative.csv")),
+        _sorted(_round_trip(annual_counts(tables), tmp_path / "measures.csv")),
+        check_dtype=False,
+    )
+
+
+def test_golden_measures_are_up_to_date(tmp_path):
+    pandas.testing.assert_frame_equal(
+        _sorted(_round_trip(annual_counts(read_tables(DUMMY_TABLES)), tmp_path / "measures.csv")),
+        _sorted(pd.read_csv(GOLDEN_MEASURES)),
+        check_dtype=False,
+    )
+
+
+def test_cumulative_counts_match_the_measures_on_the_dummy_tables(tmp_path):
+    pytest.importorskip("ehrql")
+    _ehrql("generate-measures", "analysis/annual_counts/generate_annual_migrant_counts.py",
+           str(tmp_path / "measures.csv"))
+    _ehrql("generate-dataset", "analysis/annual_counts/dataset_definition_annual_counts_inputs.py",
+           f"{tmp_path / 'inputs'}:arrow")
+    _ehrql("generate-dataset", "analysis/create_cohorts/dataset_definition_patient_features.py",
+           str(tmp_path / "patient_features.arrow"))
+
+    # as the generate_annual_migrant_counts_cumulative action runs it
+    subprocess.run(
+        [sys.executable, "analysis/annual_counts/cumulative_counts.py",
+         "--input-dir", str(tmp_path / "inputs"), "--features", str(tmp_path / "patient_features.arrow"),
+         "--output", str(tmp_path / "cumulative.csv")],
+        check=True,
+    )
+
+    measures = _sorted(pd.read_csv(tmp_path / "measures.csv"))
+    pandas.testing.assert_frame_equal(_sorted(pd.read_csv(tmp_path / "cumulative.csv")), measures, check_dtype=False)
+    pandas.testing.assert_frame_equal(_sorted(pd.read_csv(GOLDEN_MEASURES)), measures, check_dtype=False)
+
+
+def _dates(rng, n, first, last, missing=0.0):
+    days = rng.integers(np.datetime64(first, "D").astype(int), np.datetime64(last, "D").astype(int), n)
+    return pd.Series(days.astype("datetime64[D]")).mask(rng.random(n) < missing)
+
+
+def _random_inputs(rng, n_patients=400):
+    patient_id = rng.permutation(n_patients) + 1
+    patients = pd.DataFrame({
+        "patient_id": patient_id,
+        "date_of_birth": _dates(rng, n_patients, "1915-01-01", "2020-01-01", missing=0.02),
+        "date_of_death": _dates(rng, n_patients, "2005-01-01", "2030-01-01", missing=0.7),
+        "sex": rng.choice(["male", "female", "unknown"], n_patients, p=[0.49, 0.49, 0.02]),
+        "ethnicity": rng.choice(["1", "2", "unknown"], n_patients),
+        **{
+            f"first_{name}_code_date": _dates(rng, n_patients, "2000-01-01", "2026-01-01", missing=0.5)
+            for name in ["any_migrant", "cob_migrant", "asylum_refugee_migrant", "interpreter_migrant"]
+        },
+    })
+    n = n_patients * 2
+    start_date = _dates(rng, n, "2000-01-01", "2024-01-01")
+    registrations = pd.DataFrame({
+        "patient_id": rng.integers(1, n_patients + 1, n),
+        "start_date": start_date,
+        "end_date": (start_date + pd.to_timedelta(rng.integers(0, 4000, n), "D")).mask(rng.random(n) < 0.4),
+        "practice_pseudo_id": rng.integers(1, 50, n),
+        "region": pd.Series(rng.choice(["London", "North West"], n)).mask(rng.random(n) < 0.1),
+    })
+    start_date = _dates(rng, n, "2000-01-01", "2024-01-01")
+    addresses = pd.DataFrame({
+        "patient_id": rng.integers(1, n_patients + 1, n),
+        "address_id": rng.permutation(n),
+        "start_date": start_date,
+        "end_date": (start_date + pd.to_timedelta(rng.integers(0, 4000, n), "D")).mask(rng.random(n) < 0.4),
+        "has_postcode": rng.random(n) < 0.8,
+        "imd_quintile": rng.choice(["1 (most deprived)", "3", "5 (least deprived)", "unknown"], n),
+    })
+    return patients, registrations, addresses
+
+
+def test_counts_are_the_same_for_any_number_of_workers():
+    inputs = _random_inputs(np.random.default_rng(1))
+    interval_starts, interval_ends = yearly_intervals()
+    counts = calculate_counts(*inputs, interval_starts, interval_ends)
+    assert len(counts)
+
+    # more workers than subgroups, and more than patients per chunk would need
+    for workers in [4, 9]:
+        pandas.testing.assert_frame_equal(
+            calculate_counts(*inputs, interval_starts, interval_ends, workers=workers), counts
+        )
@@ -0,0 +1,109 @@
+import csv
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from analysis.generate_demographic_tables import demographics_table
+from analysis.generate_demographic_tables.demographics_table import write_demographics_table
+
+
+def _cohort(path):
+    # two record batches; patient 4's cob flag and patient 5's asylum flag are missing
+    feather.write_feather(pa.table({
+        "patient_id": pa.array([1, 2, 3, 4, 5, 6], pa.int64()),
+        "number_of_migration_codes": pa.array([1, 2, 3, 4, 5, None], pa.int64()),
+        "sex": pa.array(["male", "female", "female", "male", "female", "male"]).dictionary_encode(),
+        "has_cob_migrant_code": [True, True, False, None, False, True],
+        "has_asylum_or_refugee_migrant_code": [False, True, False, False, None, True],
+        "has_interpreter_migrant_code": [False, False, True, False, False, False],
+        "region": ["London", " ", None, "London", "North East", "London"],
+    }), path, chunksize=4)
+    return path
+
+
+def _read(path):
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_subgroup_table(tmp_path):
+    write_demographics_table(_cohort(tmp_path / "cohort.arrow"), tmp_path / "table.csv")
+
+    # All migrants: 1-6; Country of birth: 1, 2, 6; Interpreter: 3; Asylum
+    # seeker or refugee: 2, 6. Overall is all four stacked, as add_overall()
+    # over bind_rows() gave
+    assert _read(tmp_path / "table.csv") == [
+        ["**Characteristic**", "**Overall**  \nN = 12", "**All migrants**  \nN = 6",
+         "**Country of birth**  \nN = 3", "**Interpreter**  \nN = 1",
+         "**Asylum seeker or refugee**  \nN = 2"],
+        ["__number_of_migration_codes__", "", "", "", "", ""],
+        ["1", "2 (22%)", "1 (20%)", "1 (50%)", "0 (0%)", "0 (0%)"],
+        ["2", "3 (33%)", "1 (20%)", "1 (50%)", "0 (0%)", "1 (100%)"],
+        ["3", "2 (22%)", "1 (20%)", "0 (0%)", "1 (100%)", "0 (0%)"],
+        ["4", "1 (11%)", "1 (20%)", "0 (0%)", "0 (0%)", "0 (0%)"],
+        ["5", "1 (11%)", "1 (20%)", "0 (0%)", "0 (0%)", "0 (0%)"],
+        ["Unknown", "3", "1", "1", "0", "1"],
+        ["__sex__", "", "", "", "", ""],
+        ["female", "6 (50%)", "3 (50%)", "1 (33%)", "1 (100%)", "1 (50%)"],
+        ["male", "6 (50%)", "3 (50%)", "2 (67%)", "0 (0%)", "1 (50%)"],
+        ["__region__", "", "", "", "", ""],
+        ["London", "6 (86%)", "3 (75%)", "2 (100%)", "0 (0%)", "1 (100%)"],
+        ["North East", "1 (14%)", "1 (25%)", "0 (0%)", "0 (0%)", "0 (0%)"],
+        ["Unknown", "5", "2", "1", "1", "1"],
+    ]
+
+
+def test_population_table_summarises_every_column(tmp_path):
+    write_demographics_table(_cohort(tmp_path / "cohort.arrow"), tmp_path / "table.csv", subgroups={})
+
+    rows = _read(tmp_path / "table.csv")
+    assert rows[0] == ["**Characteristic**", "**N = 6**"]
+    assert [row[0] for row in rows if row[0].startswith("__")] == [
+        "__patient_id__", "__number_of_migration_codes__", "__sex__", "__has_cob_migrant_code__",
+        "__has_asylum_or_refugee_migrant_code__", "__has_interpreter_migrant_code__", "__region__",
+    ]
+    # logicals are one row of the TRUE count
+    assert ["__has_cob_migrant_code__", "3 (60%)"] in rows
+    # blanks are only missing in the subgroup tables, as in the R scripts
+    assert [" ", "1 (20%)"] in rows
+
+
+def _continuous_cohort(path, rng, n=3000):
+    feather.write_feather(pa.table({
+        "patient_id": pa.array(rng.permutation(n) * 1_000_003, pa.int64()),
+        "time_to_first_migration_code": pa.array(
+            rng.integers(-500, 20_000, n), pa.int64(), mask=rng.random(n) < 0.1
+        ),
+        "date_of_birth": pa.array(
+            rng.integers(-20_000, 20_000, n).astype("datetime64[D]"), pa.date32(), mask=rng.random(n) < 0.05
+        ),
+        "has_cob_migrant_code": rng.random(n) < 0.5,
+        "has_asylum_or_refugee_migrant_code": rng.random(n) < 0.2,
+        "has_interpreter_migrant_code": rng.random(n) < 0.7,
+    }), path, chunksize=700)
+    return path
+
+
+def test_quartiles_found_by_re_reading_match_the_value_counts(tmp_path, monkeypatch):
+    cohort = _continuous_cohort(tmp_path / "cohort.arrow", np.random.default_rng(1))
+    for subgroups in [demographics_table.SUBGROUPS, {}]:
+        write_demographics_table(cohort, tmp_path / "counted.csv", subgroups)
+        with monkeypatch.context() as patch:
+            # every integer and date column is re-read, over several passes
+            patch.setattr(demographics_table, "MAX_VALUE_COUNTS", 5)
+            patch.setattr(demographics_table, "SELECTION_BUCKETS", 4)
+            write_demographics_table(cohort, tmp_path / "selected.csv", subgroups)
+        assert _read(tmp_path / "selected.csv") == _read(tmp_path / "counted.csv")
+
+
+def test_quartiles_are_r_type_2(tmp_path):
+    rng = np.random.default_rng(2)
+    cohort = _continuous_cohort(tmp_path / "cohort.arrow", rng, n=1001)
+    write_demographics_table(cohort, tmp_path / "table.csv", subgroups={})
+
+    values = feather.read_table(cohort).column("time_to_first_migration_code").drop_null().to_numpy()
+    median, lower, upper = np.quantile(values, [0.5, 0.25, 0.75], method="averaged_inverted_cdf")
+    row = next(row for row in _read(tmp_path / "table.csv") if row[0] == "__time_to_first_migration_code__")
+    number = demographics_table._number
+    assert row[1] == f"{number(median)} ({number(lower)}-{number(upper)})"
@@ -0,0 +1,111 @@
+import json
+import sys
+
+import pytest
+
+from analysis.annual_counts import incremental_counts
+from analysis.annual_counts.incremental_counts import (
+    fingerprint_path,
+    merge_rows,
+    plan,
+    read_rows,
+    record_fingerprint,
+    update_counts,
+    write_rows,
+)
+
+START_DATE = "2010-01-01"
+HEADER = ["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"]
+
+# Stands in for ehrQL's generate-measures: writes a row per measure per
+# yearly interval asked for, measure by measure, and logs each run
+FAKE_RUNNER = """
+import csv
+import sys
+
+log, _, definition, *args = sys.argv[1:]
+output = args[args.index("--output") + 1]
+start_year = int(args[args.index("--start-date") + 1][:4])
+intervals = int(args[args.index("--intervals") + 1])
+with open(log, "a") as f:
+    f.write(f"{start_year} {intervals}\\n")
+with open(output, "w", newline="") as f:
+    writer = csv.writer(f)
+    writer.writerow(["measure", "interval_start", "interval_end", "ratio", "numerator", "denominator"])
+    for measure in ["a", "b"]:
+        for year in range(start_year, start_year + intervals):
+            writer.writerow([measure, f"{year}-01-01", f"{year}-12-31", "0.5", "1", "2"])
+"""
+
+
+def _rows(measures, years):
+    return [[m, f"{y}-01-01", f"{y}-12-31", "0.5", "1", "2"] for m in measures for y in years]
+
+
+def _runner(tmp_path):
+    (tmp_path / "runner.py").write_text(FAKE_RUNNER)
+    return f"{sys.executable} {tmp_path / 'runner.py'} {tmp_path / 'runs.log'}"
+
+
+def _runs(tmp_path):
+    return (tmp_path / "runs.log").read_text().splitlines()
+
+
+def _update(tmp_path, end_year, **kwargs):
+    update_counts(tmp_path / "counts.csv", end_year, START_DATE, runner=_runner(tmp_path), **kwargs)
+
+
+def test_plan(tmp_path):
+    output = tmp_path / "counts.csv"
+    assert plan(output, START_DATE, 2015, "abc") == (START_DATE, 6)
+
+    write_rows(output, HEADER, _rows(["a"], range(2010, 2013)))
+    # no fingerprint yet
+    assert plan(output, START_DATE, 2015, "abc") == (START_DATE, 6)
+
+    incremental_counts.write_fingerprint(output, "abc", START_DATE)
+    assert plan(output, START_DATE, 2015, "abc") == ("2013-01-01", 3)
+    assert plan(output, START_DATE, 2012, "abc") is None
+    # another definition or first interval
+    assert plan(output, START_DATE, 2015, "def") == (START_DATE, 6)
+    assert plan(output, "2011-01-01", 2015, "abc") == ("2011-01-01", 5)
+
+
+def test_merge_rows():
+    # sorted by interval: the new intervals go at the end
+    by_interval = sorted(_rows(["a", "b"], [2010, 2011]), key=lambda row: row[1])
+    assert merge_rows(HEADER, by_interval, _rows(["a", "b"], [2012])) == by_interval + _rows(["a", "b"], [2012])
+
+    # measure by measure: each measure's new intervals go after its own
+    assert merge_rows(HEADER, _rows(["a", "b"], [2010, 2011]), _rows(["a", "b"], [2012])) == _rows(
+        ["a", "b"], [2010, 2011, 2012]
+    )
+
+
+def test_only_new_intervals_are_computed(tmp_path):
+    _update(tmp_path, 2012)
+    _update(tmp_path, 2012)
+    _update(tmp_path, 2014)
+    assert _runs(tmp_path) == ["2010 3", "2013 2"]
+    assert read_rows(tmp_path / "counts.csv") == (HEADER, _rows(["a", "b"], range(2010, 2015)))
+
+    _update(tmp_path, 2014, full=True)
+    assert _runs(tmp_path)[-1] == "2010 5"
+
+
+def test_a_recorded_output_is_extended(tmp_path):
+    # as the project.yaml action writes it, without a fingerprint
+    write_rows(tmp_path / "counts.csv", HEADER, _rows(["a", "b"], range(2010, 2013)))
+    record_fingerprint(tmp_path / "counts.csv", START_DATE)
+    assert json.loads(fingerprint_path(tmp_path / "counts.csv").read_text())["start_date"] == START_DATE
+
+    _update(tmp_path, 2014)
+    assert _runs(tmp_path) == ["2013 2"]
+    assert read_rows(tmp_path / "counts.csv") == (HEADER, _rows(["a", "b"], range(2010, 2015)))
+
+
+def test_only_a_full_output_can_be_recorded(tmp_path):
+    write_rows(tmp_path / "counts.csv", HEADER, _rows(["a"], range(2011, 2013)))
+    with pytest.raises(ValueError, match="isn't a full run"):
+        record_fingerprint(tmp_path / "counts.csv", START_DATE)
+    assert not fingerprint_path(tmp_path / "counts.csv").exists()
@@ -0,0 +1,89 @@
+import datetime
+import math
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+import pytest
+
+from analysis.km_estimates.kaplan_meier import Z, kaplan_meier
+
+ORIGIN = datetime.date(2010, 1, 1)
+NEVER = 1000
+
+
+def _cohort(path, follow_up, compression="uncompressed"):
+    """A KM cohort from (days to event or None, days to censoring or None,
+    sex), all starting at ORIGIN; None as the origin makes a row unusable."""
+    def dates(days):
+        return pa.array([None if d is None else ORIGIN + datetime.timedelta(d) for d in days], pa.date32())
+
+    event, censor, sex = zip(*follow_up)
+    feather.write_feather(pa.table({
+        "patient_id": pa.array(range(len(follow_up)), pa.int64()),
+        "baseline_date": dates([0] * len(follow_up)),
+        "processed_first_migration_code_date": dates(event),
+        "censor_date": dates(censor),
+        "sex": pa.array(sex).dictionary_encode(),
+        "region": pa.array(["London"] * len(follow_up)),
+    }), path, compression=compression, chunksize=3)
+    return path
+
+
+# events on days 2, 2, 5 and 8; censored on days 3 and 7 (one of them by a
+# code after their censor date)
+FOLLOW_UP = [
+    (2, NEVER, "female"),
+    (2, NEVER, "male"),
+    (None, 3, "female"),
+    (5, NEVER, "male"),
+    (9, 7, "female"),
+    (8, None, "male"),
+]
+
+
+@pytest.mark.parametrize("compression", ["uncompressed", "zstd"])
+def test_estimates_match_a_hand_computed_curve(tmp_path, compression):
+    estimates = kaplan_meier(_cohort(tmp_path / "km.arrow", FOLLOW_UP, compression), strata=[""], min_count=0)
+
+    assert estimates["strata"].unique().tolist() == ["overall"]
+    assert estimates[["time", "n_risk", "n_event", "n_censor"]].values.tolist() == [
+        [2, 6, 2, 0], [3, 4, 0, 1], [5, 3, 1, 0], [7, 2, 0, 1], [8, 1, 1, 0],
+    ]
+    surv = [4 / 6, 4 / 6, 4 / 6 * 2 / 3, 4 / 6 * 2 / 3, 0]
+    assert estimates["surv"].tolist() == pytest.approx(surv)
+
+    # Greenwood's variance on day 5: 2 / (6 * 4) + 1 / (3 * 2)
+    day_5 = estimates.iloc[2]
+    assert day_5["surv_se"] == pytest.approx(surv[2] * 0.5)
+    assert day_5["surv_ll"] == pytest.approx(math.exp(math.log(surv[2]) - Z * 0.5))
+    assert day_5["surv_ul"] == pytest.approx(min(math.exp(math.log(surv[2]) + Z * 0.5), 1))
+    # once everyone left has had the event the curve is 0, without limits
+    assert np.isnan(estimates.iloc[4][["surv_ll", "surv_ul"]].astype(float)).all()
+
+
+def test_rows_without_follow_up_are_dropped(tmp_path):
+    follow_up = [*FOLLOW_UP, (None, None, "male"), (-1, NEVER, "female")]
+    estimates = kaplan_meier(_cohort(tmp_path / "km.arrow", follow_up), strata=[""], min_count=0)
+    assert estimates["n_risk"].iloc[0] == 6
+
+
+def test_strata(tmp_path):
+    estimates = kaplan_meier(
+        _cohort(tmp_path / "km.arrow", FOLLOW_UP), strata=["", "sex", "sex,region"], min_count=0
+    )
+    first = estimates.groupby(["strata", "sex"], dropna=False).first()["n_risk"]
+    assert first.to_dict() == {
+        ("overall", np.nan): 6, ("sex", "female"): 3, ("sex", "male"): 3,
+        ("sex,region", "female"): 3, ("sex,region", "male"): 3,
+    }
+
+
+def test_counts_are_rounded(tmp_path):
+    # ten patients with an event on each of days 1 to 10: the cumulative
+    # events are rounded up to 6 and 12, and the number in the stratum to 9
+    follow_up = [(day, NEVER, "female") for day in range(1, 11)]
+    estimates = kaplan_meier(_cohort(tmp_path / "km.arrow", follow_up), strata=[""], min_count=6)
+
+    assert estimates[["time", "n_risk", "n_event", "n_censor"]].values.tolist() == [[1, 9, 6, 0], [7, 3, 6, 0]]
+    assert estimates["surv"].tolist() == pytest.approx([1 - 6 / 9, 0])
@@ -0,0 +1,88 @@
+from datetime import date
+from dataset_definition_patient_features import dataset
+
+test_data = {
+    # Expected in population
+    1:{
+        "patients": {
+            "date_of_birth": date(1999, 1, 1),
+            "sex": "male",
+            "date_of_death": None},
+        "practice_registrations": [
+            {
+            "end_date": date(2023, 1, 1),
+            "start_date": date(2003, 1, 1)
+            }
+        ],
+        "clinical_events": [
+            {
+                # Earlier ethnicity code
+                "date": date(2010, 1, 1),
+                "snomedct_code": "10117001"
+            },
+            {
+                # Latest ethnicity code
+                "date": date(2015, 1,1 ),
+                "snomedct_code":  "10292001"
+            }
+        ],
+        "ons_deaths": {
+            "date": None
+        },
+        "expected_in_population": True,
+        "expected_columns": {
+            "latest_ethnicity_code": "10292001",
+            "latest_ethnicity_group": "Chinese or Other Ethnic Groups",
+            "year_of_birth": 1999,
+            "year_of_birth_band": "1986-2005"
+        }
+    },
+    # Expected in population (the cohorts' own criteria, such as sex, are
+    # applied in the cohort definitions)
+    2:{
+        "patients": {
+            "date_of_birth": date(1950, 6, 1),
+            "sex": "intersex",
+            "date_of_death": date(2016, 3, 1)},
+        "practice_registrations": [
+            {
+            "end_date": date(2009, 1, 1),
+            "start_date": date(2001, 5, 1)
+            },
+            {
+            "end_date": None,
+            "start_date": date(2012, 1, 1)
+            }
+        ],
+        "clinical_events": [],
+        "ons_deaths": {
+            "date": date(2016, 3, 2)
+        },
+        "expected_in_population": True,
+        "expected_columns": {
+            "latest_ethnicity_code": None,
+            "latest_ethnicity_group": None,
+            "year_of_birth": 1950,
+            "year_of_birth_band": "1946-1965"
+        }
+    },
+    # Not expected in population (registration ended before the study start)
+    3:{
+        "patients": {
+            "date_of_birth": date(1970, 1, 1),
+            "sex": "female",
+            "date_of_death": None},
+        "practice_registrations": [
+            {
+            "end_date": date(2008, 12, 31),
+            "start_date": date(2000, 1, 1)
+            }
+        ],
+        "clinical_events": [],
+        "ons_deaths": {
+            "date": None
+        },
+        "expected_in_population": False,
+        "expected_columns": {}
+    }
+}
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+from analysis.lib import point_in_time
+from analysis.lib.reference_cohorts import address_on, registration_on
+from analysis.lib.spells import from_days, intersect
+
+N_PATIENTS = 300
+
+
+def _days(rng, n, missing=0.0):
+    # few distinct days, so that spells tie and touch
+    days = pd.Series(rng.choice(np.arange(14_000, 14_060, 3), n), dtype="Int64")
+    return days.mask(rng.random(n) < missing)
+
+
+def _ends(rng, starts, missing):
+    # some ending before they start, on the day they start or open-ended
+    ends = starts + pd.Series(rng.integers(-3, 40, len(starts)), dtype="Int64")
+    return ends.mask(rng.random(len(starts)) < missing)
+
+
+def _registrations(rng):
+    n = N_PATIENTS * 2
+    start_date = _days(rng, n, missing=0.02)
+    return pd.DataFrame({
+        "patient_id": rng.integers(1, N_PATIENTS + 1, n),
+        "start_date": start_date,
+        "end_date": _ends(rng, start_date, missing=0.3),
+        "practice_pseudo_id": pd.Series(rng.permutation(n), dtype="Int64").mask(rng.random(n) < 0.1),
+        "row_id": np.arange(n),
+    })
+
+
+def _addresses(rng):
+    n = N_PATIENTS * 2
+    start_date = _days(rng, n, missing=0.02)
+    return pd.DataFrame({
+        "patient_id": rng.integers(1, N_PATIENTS + 1, n),
+        "address_id": rng.permutation(n),
+        "start_date": start_date,
+        "end_date": _ends(rng, start_date, missing=0.3),
+        "has_postcode": pd.Series(rng.random(n) < 0.7, dtype="boolean").mask(rng.random(n) < 0.1),
+    })
+
+
+def _as_dates(frame):
+    # reference_cohorts works on day numbers, point_in_time on dates
+    frame = frame.copy()
+    for column in ["start_date", "end_date"]:
+        days = frame[column]
+        frame[column] = pd.Series(from_days(days.fillna(0).to_numpy()), index=frame.index).mask(days.isna())
+    return frame
+
+
+def _picked_on(segments, day, column, patient_index):
+    covering = segments[(segments["start"] <= day) & (day < segments["end"])]
+    return covering.set_index("patient_id")[column].reindex(patient_index)
+
+
+def _assert_same(actual, expected):
+    # NA where nobody is picked, whatever the dtype
+    pd.testing.assert_series_equal(
+        actual.astype("Int64"), expected.astype("Int64"), check_names=False
+    )
+
+
+def _grid(frame):
+    days = np.r_[frame["start_date"].dropna(), frame["end_date"].dropna()].astype(np.int64)
+    return np.unique(np.r_[days - 1, days, days + 1])
+
+
+def test_registration_segments_match_registration_on():
+    rng = np.random.default_rng(1)
+    registrations = _registrations(rng)
+    patient_index = pd.Index(np.arange(1, N_PATIENTS + 1), name="patient_id")
+    segments = point_in_time.registration_segments(_as_dates(registrations), ["row_id"])
+
+    for day in _grid(registrations):
+        _assert_same(
+            _picked_on(segments, day, "row_id", patient_index),
+            registration_on(registrations, day, "row_id", patient_index),
+        )
+
+
+def test_address_segments_match_address_on():
+    rng = np.random.default_rng(2)
+    addresses = _addresses(rng)
+    patient_index = pd.Index(np.arange(1, N_PATIENTS + 1), name="patient_id")
+    segments = point_in_time.address_segments(_as_dates(addresses), ["address_id"], patient_index)
+
+    for day in _grid(addresses):
+        _assert_same(
+            _picked_on(segments, day, "address_id", patient_index),
+            address_on(addresses, day, patient_index)["address_id"],
+        )
+
+
+def test_lookup_on_matches_registration_on_and_address_on():
+    rng = np.random.default_rng(3)
+    registrations = _registrations(rng)
+    addresses = _addresses(rng)
+    patient_index = pd.Index(np.arange(1, N_PATIENTS + 2), name="patient_id")  # one with neither
+    days = np.union1d(_grid(registrations), _grid(addresses))
+
+    lookup = point_in_time.lookup_on(
+        point_in_time.registration_index(_as_dates(registrations), ["row_id"]),
+        point_in_time.address_index(_as_dates(addresses), ["address_id"]),
+        patient_index,
+        from_days(days),
+    )
+
+    # patient by patient, each with every date
+    assert (lookup["patient_id"].to_numpy() == np.repeat(patient_index, len(days))).all()
+    for i, day in enumerate(days):
+        on_day = lookup.iloc[i::len(days)].set_index("patient_id")
+        assert (on_day["date"] == from_days([day])[0]).all()
+        registration = registration_on(registrations, day, "row_id", patient_index)
+        _assert_same(on_day["row_id"], registration)
+        assert (on_day["registered"] == registration.notna()).all()
+        _assert_same(on_day["address_id"], address_on(addresses, day, patient_index)["address_id"])
+
+
+def test_intersect_picks_both_on_every_day():
+    rng = np.random.default_rng(4)
+    registrations = _registrations(rng)
+    addresses = _addresses(rng)
+    patient_index = pd.Index(np.arange(1, N_PATIENTS + 1), name="patient_id")
+    left = point_in_time.registration_segments(_as_dates(registrations), ["row_id"])
+    right = point_in_time.address_segments(_as_dates(addresses), ["address_id"], patient_index)
+
+    both = intersect(left, right.sample(frac=1, random_state=4))
+
+    # the address segments cover every day (without an address_id where
+    # there's no address), so the intersection is wherever a patient is registered
+    for day in np.union1d(_grid(registrations), _grid(addresses)):
+        row_id = _picked_on(left, day, "row_id", patient_index)
+        address_id = _picked_on(right, day, "address_id", patient_index)
+        _assert_same(_picked_on(both, day, "row_id", patient_index), row_id)
+        _assert_same(_picked_on(both, day, "address_id", patient_index), address_id.where(row_id.notna()))
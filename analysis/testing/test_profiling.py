@@ -0,0 +1,44 @@
+import re
+from pathlib import Path
+
+import pytest
+
+from analysis.lib.benchmarks import DEFAULT_RUNNER, EHRQL_VERSION, run_benchmark
+
+DUMMY_TABLES = "dummy_tables"
+DEFINITION = "analysis/create_cohorts/dataset_definition_full_study_cohort.py"
+
+
+def test_ehrql_version_is_the_one_the_actions_run():
+    images = set(re.findall(r"\behrql:(v\d+)\b", Path("project.yaml").read_text()))
+    assert images == {EHRQL_VERSION}
+
+
+def test_profiling_runs_a_definition():
+    # profiling.py is built on ehrQL internals, which may change in any release
+    pytest.importorskip("ehrql")
+    from ehrql.loaders import load_dataset_definition
+    from ehrql.query_engines.local_file import LocalFileQueryEngine
+
+    from analysis.lib.profiling import hot_spots, profile_dataset
+
+    dataset, _ = load_dataset_definition(Path(DEFINITION), [], environ={})
+    report = profile_dataset(dataset, LocalFileQueryEngine(DUMMY_TABLES))
+
+    assert set(report["variables"]) == set(dataset.variables)
+    for entry in [report["population"], *report["variables"].values()]:
+        assert entry["own_seconds"] >= 0
+        for rows in entry["tables"].values():
+            assert 0 <= rows["rows_kept"] <= rows["rows_scanned"]
+    summary = hot_spots(report).splitlines()
+    assert len(summary) == 1 + 1 + len(report["variables"]) + len(report["events"])
+
+
+def test_benchmark_runs_a_definition(tmp_path):
+    pytest.importorskip("ehrql")
+
+    result = run_benchmark("full_study_cohort", 0, DEFAULT_RUNNER, DUMMY_TABLES, tmp_path)
+
+    assert result["succeeded"], result["error"]
+    assert result["output_size_mb"] > 0
+    assert result["peak_rss_mb"] > 0
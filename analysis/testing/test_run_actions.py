@@ -0,0 +1,114 @@
+import sys
+
+from analysis.lib import run_actions
+from analysis.lib.run_actions import chain_lengths, command, critical_path, run_through_opensafely
+
+# Stands in for an action: logs when it starts and ends, and fails if told to
+FAKE_ACTION = """
+import sys
+from pathlib import Path
+
+log, name = sys.argv[1:]
+with open(log, "a") as f:
+    f.write(f"start {name}\\n")
+with open(log, "a") as f:
+    f.write(f"end {name}\\n")
+if (Path(log).parent / f"fail-{name}").exists():
+    sys.exit("failing on purpose")
+"""
+
+#   a -> b -> d
+#   a -> c
+#   e
+NEEDS = {"a": [], "b": ["a"], "c": ["a"], "d": ["b"], "e": []}
+
+ACTIONS = {
+    "dataset": {"run": "ehrql:v1 generate-dataset analysis/dataset_definition.py --output output/dataset.arrow"},
+    "split": {"run": "python:latest analysis/split.py --input output/dataset.arrow", "needs": ["dataset"]},
+    "km": {"run": "kaplan-meier-function:v0.0.14 --df_input=output/split.arrow", "needs": ["split"]},
+    "table": {"run": "python:latest analysis/table.py", "needs": ["dataset"]},
+}
+ACTION_NEEDS = {name: action.get("needs", []) for name, action in ACTIONS.items()}
+
+
+def test_chain_lengths():
+    lengths = chain_lengths(NEEDS, {"a": 1, "b": 2, "c": 10, "d": 3})
+    # e has no timing: the default of 1
+    assert lengths == {"a": 11, "b": 5, "c": 10, "d": 3, "e": 1}
+
+
+def test_critical_path():
+    finished = {
+        "a": {"end": 1}, "b": {"end": 3}, "c": {"end": 4}, "d": {"end": 5}, "e": {"end": 2},
+    }
+    assert critical_path(NEEDS, finished) == ["a", "b", "d"]
+    # d didn't run: c ended last
+    del finished["d"]
+    assert critical_path(NEEDS, finished) == ["a", "c"]
+    assert critical_path(NEEDS, {}) == []
+
+
+def test_a_reusable_action_and_what_it_needs_go_through_opensafely_run():
+    through_opensafely = run_through_opensafely(ACTION_NEEDS, ACTIONS)
+    assert through_opensafely == {"km", "split", "dataset"}
+
+    def argv(name, local):
+        return command(name, ACTIONS[name], local, name in through_opensafely)
+
+    for local in [False, True]:
+        assert argv("km", local) == ["opensafely", "run", "km"]
+        assert argv("split", local) == ["opensafely", "run", "split"]
+        assert argv("dataset", local) == ["opensafely", "run", "dataset"]
+    assert argv("table", local=False) == ["opensafely", "exec", "python:latest", "analysis/table.py"]
+    assert argv("table", local=True) == [sys.executable, "analysis/table.py"]
+
+
+def _run(tmp_path, monkeypatch, workers=4, history=None, selected=None):
+    (tmp_path / "action.py").write_text(FAKE_ACTION)
+    log = tmp_path / "runs.log"
+    monkeypatch.setattr(
+        run_actions, "command",
+        lambda name, action, local=False, through_opensafely=False: [
+            sys.executable, str(tmp_path / "action.py"), str(log), name
+        ],
+    )
+    actions = {name: {"run": f"python:latest {name}.py"} for name in NEEDS}
+    results = run_actions.run_actions(
+        NEEDS, actions, set(selected or NEEDS), workers, memory_gb=16, history=history,
+        log_dir=tmp_path / "logs",
+    )
+    return results, log.read_text().splitlines() if log.exists() else []
+
+
+def test_actions_start_once_what_they_need_has_finished(tmp_path, monkeypatch):
+    results, runs = _run(tmp_path, monkeypatch)
+    assert all(result["succeeded"] for result in results.values())
+    assert sorted(results) == sorted(NEEDS)
+    for name, requirements in NEEDS.items():
+        for requirement in requirements:
+            assert runs.index(f"end {requirement}") < runs.index(f"start {name}")
+
+
+def test_the_longest_chain_goes_first(tmp_path, monkeypatch):
+    history = {name: {"succeeded": True, "wall_time_s": 1.0} for name in NEEDS}
+    history["c"]["wall_time_s"] = 100.0
+    _, runs = _run(tmp_path, monkeypatch, workers=1, history=history)
+    starts = [line.split()[1] for line in runs if line.startswith("start")]
+    # a first, as c needs it, then c before b and e
+    assert starts[:2] == ["a", "c"]
+    assert starts.index("e") > starts.index("c")
+
+
+def test_actions_needing_a_failed_one_are_skipped(tmp_path, monkeypatch):
+    (tmp_path / "fail-b").touch()
+    results, runs = _run(tmp_path, monkeypatch)
+    assert results["b"]["succeeded"] is False
+    assert results["d"] == {"succeeded": False, "skipped": True}
+    assert all(results[name]["succeeded"] for name in ["a", "c", "e"])
+    assert "start d" not in runs
+
+
+def test_only_the_selected_actions_run(tmp_path, monkeypatch):
+    results, runs = _run(tmp_path, monkeypatch, selected=run_actions.with_needs(["b"], NEEDS))
+    assert sorted(results) == ["a", "b"]
+    assert [line for line in runs if line.startswith("start")] == ["start a", "start b"]
@@ -0,0 +1,121 @@
+import sys
+
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from analysis.lib.sharded_dataset import run_sharded
+
+N_SHARDS = 3
+
+# Stands in for ehrQL: writes every patient in the shard's patients.csv with
+# the definition's VALUE, logs which shard it ran and fails if told to
+FAKE_RUNNER = """
+import sys
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.feather as feather
+
+log, _, definition, *args = sys.argv[1:]
+tables = Path(args[args.index("--dummy-tables") + 1])
+output = args[args.index("--output") + 1]
+with open(log, "a") as f:
+    f.write(tables.name + "\\n")
+if (Path(log).parent / f"fail-{tables.name}").exists():
+    sys.exit("failing on purpose")
+
+namespace = {}
+exec(Path(definition).read_text(), namespace)
+patients = pa_csv.read_csv(tables / "patients.csv")
+feather.write_feather(pa.table({
+    "patient_id": patients.column("patient_id"),
+    "value": pa.array([namespace["VALUE"]] * patients.num_rows, pa.int64()),
+}), output)
+"""
+
+
+def _setup(tmp_path, n_patients=20, value=1):
+    (tmp_path / "runner.py").write_text(FAKE_RUNNER)
+    (tmp_path / "definition.py").write_text(f"VALUE = {value}\n")
+    _write_patients(tmp_path, n_patients)
+    return f"{sys.executable} {tmp_path / 'runner.py'} {tmp_path / 'runs.log'}"
+
+
+def _write_patients(tmp_path, n_patients):
+    tables = tmp_path / "tables"
+    tables.mkdir(exist_ok=True)
+    rows = "".join(f"{i},1990-01-01,,male\n" for i in range(1, n_patients + 1))
+    (tables / "patients.csv").write_text("patient_id,date_of_birth,date_of_death,sex\n" + rows)
+
+
+def _run(tmp_path, runner, **kwargs):
+    return run_sharded(
+        str(tmp_path / "definition.py"), tmp_path / "tables", tmp_path / "merged.arrow",
+        N_SHARDS, N_SHARDS, runner, work_dir=tmp_path / "work", **kwargs,
+    )
+
+
+def _runs(tmp_path):
+    runs = (tmp_path / "runs.log").read_text().split()
+    (tmp_path / "runs.log").unlink()
+    return sorted(runs)
+
+
+def _merged(tmp_path):
+    table = feather.read_table(tmp_path / "merged.arrow").sort_by("patient_id")
+    return table.column("patient_id").to_pylist(), set(pc.unique(table.column("value")).to_pylist())
+
+
+def test_only_the_failed_shard_is_rerun(tmp_path):
+    runner = _setup(tmp_path)
+    (tmp_path / "fail-1").touch()
+    assert not _run(tmp_path, runner)
+    assert not (tmp_path / "merged.arrow").exists()
+    assert _runs(tmp_path) == ["0", "1", "2"]
+
+    (tmp_path / "fail-1").unlink()
+    assert _run(tmp_path, runner)
+    assert _runs(tmp_path) == ["1"]
+    assert _merged(tmp_path) == (list(range(1, 21)), {1})
+
+
+def test_nothing_is_rerun_when_nothing_changed(tmp_path):
+    runner = _setup(tmp_path)
+    assert _run(tmp_path, runner)
+    _runs(tmp_path)
+    assert _run(tmp_path, runner)
+    assert not (tmp_path / "runs.log").exists()
+
+
+def test_a_changed_definition_reruns_every_shard(tmp_path):
+    runner = _setup(tmp_path)
+    assert _run(tmp_path, runner)
+    _runs(tmp_path)
+
+    (tmp_path / "definition.py").write_text("VALUE = 2\n")
+    assert _run(tmp_path, runner)
+    assert _runs(tmp_path) == ["0", "1", "2"]
+    assert _merged(tmp_path) == (list(range(1, 21)), {2})
+
+
+def test_regenerated_tables_rerun_every_shard(tmp_path):
+    runner = _setup(tmp_path)
+    assert _run(tmp_path, runner)
+    _runs(tmp_path)
+
+    _write_patients(tmp_path, 30)
+    assert _run(tmp_path, runner)
+    assert _runs(tmp_path) == ["0", "1", "2"]
+    assert _merged(tmp_path) == (list(range(1, 31)), {1})
+
+
+def test_rerunning_one_shard_after_a_change_does_not_merge_stale_shards(tmp_path):
+    runner = _setup(tmp_path)
+    assert _run(tmp_path, runner)
+    _runs(tmp_path)
+
+    (tmp_path / "definition.py").write_text("VALUE = 2\n")
+    assert not _run(tmp_path, runner, only_shards=[0])
+    assert _runs(tmp_path) == ["0"]
+    assert _merged(tmp_path) == (list(range(1, 21)), {1})
@@ -0,0 +1,36 @@
+import pytest
+
+from analysis.create_cohorts.split_census_cohorts import split_census_cohorts
+from analysis.lib.dummy_tables import write_dummy_tables
+from analysis.lib.reference_cohorts import census_cohorts, read_tables, to_arrow
+
+CENSUS_2011 = "2011-03-27"
+CENSUS_2021 = "2021-03-21"
+
+
+@pytest.fixture(scope="module")
+def tables(tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp("tables")
+    write_dummy_tables(output_dir, population_size=1000, seed=8)
+    return read_tables(output_dir)
+
+
+def _split(tables, census_dates):
+    return split_census_cohorts(to_arrow(census_cohorts(tables, census_dates)))
+
+
+def test_a_single_census_date_is_split_like_several(tables):
+    both = _split(tables, [CENSUS_2011, CENSUS_2021])
+    assert list(both) == ["2011", "2021"]
+    for census_date, year in [(CENSUS_2011, "2011"), (CENSUS_2021, "2021")]:
+        single = _split(tables, [census_date])
+        assert list(single) == [year]
+        assert single[year].num_rows > 0
+        assert single[year].equals(both[year])
+        assert "in_census_cohort" not in single[year].column_names
+        assert "msoa_code" in single[year].column_names
+
+
+def test_census_dates_in_the_same_year_are_rejected(tables):
+    with pytest.raises(ValueError, match="same year"):
+        census_cohorts(tables, [CENSUS_2021, "2021-12-31"])